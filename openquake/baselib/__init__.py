@@ -110,7 +110,8 @@ def boolean(flag):
 
 
 config.read(soft_mem_limit=int, hard_mem_limit=int, port=int,
-            multi_user=boolean,
+            multi_user=boolean, adaptive_tasks=boolean,
+            balanced_dispatch=boolean,
             serialize_jobs=boolean, strict=boolean, code=exec)
 
 if config.directory.custom_tmp:
@@ -21,7 +21,6 @@ import os
 import re
 import gzip
 import getpass
-import itertools
 import collections
 import numpy
 import h5py
@@ -137,30 +136,70 @@ def read(calc_id, mode='r', datadir=None):
     return dstore
 
 
-def dset2df(dset, index):
+def _slices(size, chunksize, rowsize=1):
+    # slices along the first axis producing about chunksize rows each
+    step = max(1, chunksize // rowsize)
+    for start in range(0, size, step):
+        yield slice(start, min(start + step, size))
+
+
+def _dic2df(dic, index, start, size):
+    # the default index is the row number in the full dataset
+    df = pandas.DataFrame(dic, pandas.RangeIndex(start, start + size))
+    return df if index is None else df.set_index(index)
+
+
+def _tags2df(shape_descr, tags, arr, index, start=0):
+    # arr is a slice of the dataset along the first axis, starting at start
+    tags = [tags[0][start:start + len(arr)]] + tags[1:]
+    idxs = numpy.indices(arr.shape).reshape(arr.ndim, -1)
+    dic = {field: values[idx]
+           for field, values, idx in zip(shape_descr, tags, idxs)}
+    dic['value'] = arr.reshape(-1)
+    return _dic2df(dic, index, start * int(numpy.prod(arr.shape[1:])),
+                   arr.size)
+
+
+def dset2df(dset, index=None, chunksize=None):
     """
     Converts an HDF5 dataset with an attribute shape_descr into a Pandas
-    dataframe.
+    dataframe. The dataset is read with a single HDF5 read and the tag
+    columns are built by broadcasting. If chunksize is given, returns
+    instead a generator of dataframes with (about) chunksize rows each,
+    by reading one slice of the dataset at the time.
     """
-    shape_descr = [v.decode('utf-8') for v in dset.attrs['shape_descr']]
-    out = []
-    tags = []
-    idxs = []
-    dtlist = []
-    for i, field in enumerate(shape_descr):
-        values = dset.attrs[field]
-        try:
-            dt = values[0].dtype
-        except AttributeError:  # for instance a string has no dtype
-            dt = type(values[0])
-        dtlist.append((field, dt))
-        tags.append(values)
-        idxs.append(range(len(values)))
-    dtlist.append(('value', dset.dtype))
-    for idx, values in zip(itertools.product(*idxs),
-                           itertools.product(*tags)):
-        out.append(values + (dset[idx],))
-    return pandas.DataFrame.from_records(numpy.array(out, dtlist), index)
+    shape_descr = hdf5.decode_array(dset.attrs['shape_descr'])
+    tags = [numpy.array(dset.attrs[field]) for field in shape_descr]
+    if chunksize is None:
+        return _tags2df(shape_descr, tags, dset[()], index)
+    rowsize = int(numpy.prod(dset.shape[1:]))
+    return (_tags2df(shape_descr, tags, dset[slc], index, slc.start)
+            for slc in _slices(len(dset), chunksize, rowsize))
+
+
+def arr2df(arr, index=None, start=0):
+    """
+    Converts a structured array into a Pandas dataframe; vector fields
+    are split into scalar columns <name>_<i>, <name>_<i>_<j>, etc.
+
+    >>> arr = numpy.array([(1, [.1, .2]), (2, [.3, .4])],
+    ...                   [('id', int), ('loss', (float, 2))])
+    >>> df = arr2df(arr, 'id')
+    >>> list(df.columns)
+    ['loss_0', 'loss_1']
+    >>> df.loc[2].loss_1
+    0.4
+    """
+    dic = {}
+    for name in arr.dtype.names:
+        col = arr[name]
+        if col.ndim > 1:  # vector field
+            templ = name + '_%d' * (col.ndim - 1)
+            for i in numpy.ndindex(col.shape[1:]):
+                dic[templ % i] = col[(slice(None),) + i]
+        else:  # scalar field
+            dic[name] = col
+    return _dic2df(dic, index, start, len(arr))
 
 
 class DataStore(collections.abc.MutableMapping):
@@ -430,11 +469,16 @@ class DataStore(collections.abc.MutableMapping):
         data = bytes(numpy.asarray(self[key][()]))
         return io.BytesIO(gzip.decompress(data))
 
-    def read_df(self, key, index=None):
+    def read_df(self, key, index=None, chunksize=None):
         """
         :param key: name of the structured dataset
         :param index: if given, name of the "primary key" field
-        :returns: pandas DataFrame associated to the dataset
+        :param chunksize: if given, read the dataset in chunks
+        :returns: pandas DataFrame associated to the dataset, or a generator
+                  of DataFrames with chunksize rows each if chunksize is given
+
+        NB: in the chunked case the datastore must stay open while
+        the generator is consumed.
         """
         try:
             dset = self.getitem(key)
@@ -446,27 +490,11 @@ class DataStore(collections.abc.MutableMapping):
         if len(dset) == 0:
             raise self.EmptyDataset('Dataset %s is empty' % key)
         if 'shape_descr' in dset.attrs:
-            return dset2df(dset, index)
-        dtlist = []
-        for name in dset.dtype.names:
-            dt = dset.dtype[name]
-            if dt.shape:  # vector field
-                templ = name + '_%d' * len(dt.shape)
-                for i, _ in numpy.ndenumerate(numpy.zeros(dt.shape)):
-                    dtlist.append((templ % i, dt.base))
-            else:  # scalar field
-                dtlist.append((name, dt))
-        data = numpy.zeros(len(dset), dtlist)
-        for name in dset.dtype.names:
-            arr = dset[name]
-            dt = dset.dtype[name]
-            if dt.shape:  # vector field
-                templ = name + '_%d' * len(dt.shape)
-                for i, _ in numpy.ndenumerate(numpy.zeros(dt.shape)):
-                    data[templ % i] = arr[(slice(None),) + i]
-            else:  # scalar field
-                data[name] = arr
-        return pandas.DataFrame.from_records(data, index=index)
+            return dset2df(dset, index, chunksize)
+        if chunksize is None:
+            return arr2df(dset[()], index)
+        return (arr2df(dset[slc], index, slc.start)
+                for slc in _slices(len(dset), chunksize))
 
     @property
     def metadata(self):
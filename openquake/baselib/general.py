@@ -31,9 +31,11 @@ import builtins
 import operator
 import warnings
 import tempfile
+import threading
 import importlib
 import itertools
 import subprocess
+import collections
 from collections.abc import Mapping, Container, MutableSequence
 import numpy
 from decorator import decorator
@@ -721,6 +723,77 @@ class AccumDict(dict):
                                for key, value in self.items()})
 
 
+class LRUCache(object):
+    """
+    A thread-safe cache of byte strings, bounded by their total size:
+    when the limit is exceeded the least recently used values are discarded.
+    Values larger than the limit are not stored at all.
+
+    >>> cache = LRUCache(maxbytes=10)
+    >>> cache['a'] = b'12345'
+    >>> cache['b'] = b'67890'
+    >>> cache['a']  # now 'b' is the least recently used value
+    b'12345'
+    >>> cache['c'] = b'xyz'
+    >>> sorted(cache), cache.nbytes
+    (['a', 'c'], 8)
+    >>> cache.get('b') is None
+    True
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._dic = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._dic.move_to_end(key)
+            except KeyError:
+                return default
+            return self._dic[key]
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._dic.move_to_end(key)
+            return self._dic[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._dic:
+                self.nbytes -= len(self._dic.pop(key))
+            if len(value) > self.maxbytes:
+                return
+            self._dic[key] = value
+            self.nbytes += len(value)
+            while self.nbytes > self.maxbytes:
+                self.nbytes -= len(self._dic.popitem(last=False)[1])
+
+    def discard(self, pred):
+        """
+        Remove all the keys satisfying the given predicate
+
+        :returns: the number of removed keys
+        """
+        with self._lock:
+            keys = [key for key in self._dic if pred(key)]
+            for key in keys:
+                self.nbytes -= len(self._dic.pop(key))
+        return len(keys)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._dic))
+
+    def __len__(self):
+        return len(self._dic)
+
+    def __repr__(self):
+        return '<%s %d keys, %s>' % (self.__class__.__name__, len(self),
+                                     humansize(self.nbytes))
+
+
 # return a dict imt -> slice and the total number of levels
 def _slicedict_n(imt_dt):
     n = 0
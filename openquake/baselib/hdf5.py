@@ -17,8 +17,8 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import ast
-import csv
 import inspect
 import logging
 import tempfile
@@ -29,8 +29,9 @@ from urllib.parse import quote_plus, unquote_plus
 import collections
 import toml
 import numpy
+import pandas
 import h5py
-from openquake.baselib import InvalidFile
+from openquake.baselib import InvalidFile, config
 from openquake.baselib.python3compat import encode, decode
 
 vbytes = h5py.special_dtype(vlen=bytes)
@@ -52,6 +53,85 @@ def maybe_encode(value):
     return value
 
 
+def parse_layout(spec):
+    """
+    Parse a layout specification, i.e. a comma-separated string of tokens
+    among gzip, gzip<level>, lzf, shuffle and chunk=<rows>, where <rows>
+    is the size of the chunks along the first axis (the chunks extend
+    over the full size of the other axes):
+
+    >>> parse_layout('gzip4,shuffle')
+    {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+    >>> parse_layout('lzf,chunk=1000')
+    {'compression': 'lzf', 'chunks': 1000}
+    >>> parse_layout('')
+    {}
+    """
+    layout = {}
+    for token in spec.replace(' ', '').split(','):
+        if not token:
+            continue
+        elif token == 'lzf':
+            layout['compression'] = 'lzf'
+        elif re.fullmatch(r'gzip\d?', token):
+            layout['compression'] = 'gzip'
+            if token[4:]:
+                layout['compression_opts'] = int(token[4:])
+        elif token == 'shuffle':
+            layout['shuffle'] = True
+        elif re.fullmatch(r'chunk=\d+', token) and int(token[6:]):
+            layout['chunks'] = int(token[6:])
+        else:
+            raise ValueError('Invalid token %r in the layout %r' %
+                             (token, spec))
+    return layout
+
+
+def set_layouts(layouts=()):
+    """
+    Set the global storage policy, i.e. a list of pairs (regex, layout)
+    coming from the given dictionary dataset name regex -> layout spec
+    (for instance the parameter dataset_layouts in the job.ini) and then
+    from the section [dataset_layouts] of openquake.cfg. The first regex
+    fully matching the name of a dataset determines its layout.
+    """
+    items = list(dict(layouts).items()) + list(
+        config.get('dataset_layouts', {}).items())
+    LAYOUTS[:] = [(re.compile(regex), parse_layout(spec))
+                  for regex, spec in items]
+
+
+def get_layout(name, shape):
+    """
+    :param name: name of a dataset
+    :param shape: shape of the dataset (extendable if shape[0] is None)
+    :returns: the h5py arguments chunks, compression, etc for the dataset
+
+    Empty datasets, i.e. with a fixed dimension equal to zero, cannot be
+    chunked nor compressed, so they are always contiguous.
+    """
+    if 0 in shape:
+        return {}
+    for regex, layout in LAYOUTS:
+        if regex.fullmatch(name.lstrip('/')):
+            break
+    else:
+        return {}
+    layout = layout.copy()
+    if 'chunks' in layout and len(shape):
+        rows = layout['chunks']
+        if shape[0] is not None:
+            rows = min(rows, shape[0])
+        layout['chunks'] = (rows,) + tuple(shape[1:])
+    elif 'chunks' in layout:  # scalar dataset, cannot be chunked
+        del layout['chunks']
+    return layout
+
+
+LAYOUTS = []  # populated by set_layouts
+set_layouts()
+
+
 def create(hdf5, name, dtype, shape=(None,), compression=None,
            fillvalue=0, attrs=None):
     """
@@ -62,20 +142,65 @@ def create(hdf5, name, dtype, shape=(None,), compression=None,
     :param compression: None or 'gzip' are recommended
     :param attrs: dictionary of attributes of the dataset
     :returns: a HDF5 dataset
+
+    If compression is None, the chunking and compression are determined
+    by the layouts set with :func:`set_layouts`.
     """
+    layout = get_layout(name, shape)
+    if compression:
+        layout['compression'] = compression
     if shape[0] is None:  # extendable dataset
+        layout.setdefault('chunks', True)
         dset = hdf5.create_dataset(
-            name, (0,) + shape[1:], dtype, chunks=True, maxshape=shape,
-            compression=compression)
+            name, (0,) + shape[1:], dtype, maxshape=shape, **layout)
     else:  # fixed-shape dataset
         dset = hdf5.create_dataset(name, shape, dtype, fillvalue=fillvalue,
-                                   compression=compression)
+                                   **layout)
     if attrs:
         for k, v in attrs.items():
             dset.attrs[k] = maybe_encode(v)
     return dset
 
 
+def memmap(dset, mode='r'):
+    """
+    Memory-map a contiguous, uncompressed dataset with a fixed-size dtype,
+    so that slices and fancy indexing read directly from the page cache,
+    shared between the processes reading the same file. Otherwise, for
+    instance for chunked, virtual or variable-length datasets, or for
+    files not opened in mode 'r' (which could have pages not flushed
+    yet), return the dataset itself, to be read in the usual way:
+
+    >>> fname = tempfile.mktemp(suffix='.hdf5')
+    >>> with File(fname, 'w') as h5:
+    ...     h5['contiguous'] = numpy.arange(10.)
+    ...     _ = create(h5, 'chunked', float)
+    >>> with File(fname, 'r') as h5:
+    ...     arr = memmap(h5['contiguous'])
+    ...     isinstance(arr, numpy.memmap), arr[[2, 5]]
+    ...     isinstance(memmap(h5['chunked']), h5py.Dataset)
+    (True, array([2., 5.]))
+    True
+    >>> with File(fname, 'r+') as h5:  # the file could be written
+    ...     isinstance(memmap(h5['contiguous']), h5py.Dataset)
+    True
+    >>> os.remove(fname)
+
+    :param dset: a h5py dataset
+    :param mode: 'r' for a read-only map, 'c' for a copy-on-write map
+    :returns: a numpy.memmap or the dataset
+    """
+    if (dset.chunks is not None or dset.is_virtual or dset.external or
+            dset.dtype.hasobject or not dset.shape or dset.size == 0 or
+            dset.file.driver != 'sec2' or dset.file.mode != 'r'):
+        return dset
+    offset = dset.id.get_offset()
+    if offset is None:  # no data was written yet
+        return dset
+    return numpy.memmap(dset.file.filename, dset.dtype, mode, offset,
+                        dset.shape)
+
+
 def preshape(obj):
     """
     :returns: the shape of obj, except the last dimension
@@ -108,6 +233,159 @@ def extend(dset, array, **attrs):
     return newlength
 
 
+class Budget(object):
+    """
+    A memory budget shared by several :class:`Appender` instances: when
+    the bytes buffered by all of them reach `maxbytes` they are flushed
+    together.
+
+    :param maxbytes: the total size of the in-memory buffers
+    """
+    def __init__(self, maxbytes=2 ** 26):
+        self.maxbytes = maxbytes
+        self.nbytes = 0  # number of bytes buffered by all the appenders
+        self.appenders = []
+
+    def flush(self):
+        """
+        Flush all the appenders sharing the budget
+        """
+        for appender in self.appenders:
+            appender.flush()
+
+
+class Appender(object):
+    """
+    Append arrays to an extensible dataset by accumulating them in memory
+    up to `maxbytes` and then writing them with a single contiguous write.
+    The dataset grows geometrically, so the number of resizes is
+    logarithmic in the number of rows, and it is truncated to the exact
+    number of rows by .close(). The dataset is looked up in the container
+    at each flush, so the appender survives a reopening of the file
+    (i.e. a DataStore.swmr_on). Here is an example:
+
+    >>> fname = tempfile.mktemp(suffix='.hdf5')
+    >>> with File(fname, 'w') as h5:
+    ...     dset = create(h5, 'data', numpy.float32)
+    ...     app = Appender(h5, 'data')
+    ...     for i in range(10):
+    ...         _ = app.append(numpy.ones(3, numpy.float32) * i)
+    ...     len(app), len(h5['data'])
+    ...     app.close()
+    ...     len(h5['data'])
+    (30, 0)
+    30
+    >>> os.remove(fname)
+
+    NB: before .close() the dataset can contain more rows than the
+    appended ones, so it must not be read directly; use len(appender)
+    to get the number of appended rows.
+
+    When many datasets are appended together (i.e. one per tag
+    combination) the appenders can share a :class:`Budget`, so that the
+    memory occupation is bounded by the budget and not by the number of
+    datasets times `maxbytes`.
+
+    :param container: an hdf5.File or DataStore containing the dataset
+    :param key: the name of the extensible dataset
+    :param maxbytes: the size of the in-memory buffer
+    :param budget: a Budget shared with other appenders, or None
+    """
+    def __init__(self, container, key, maxbytes=2 ** 26, budget=None):
+        self.container = container
+        self.key = key
+        self.maxbytes = maxbytes
+        self.budget = budget
+        if budget is not None:
+            budget.appenders.append(self)
+        self.length = len(container[key])  # number of rows on disk
+        self.buffer = []
+        self.nrows = 0  # number of buffered rows
+        self.nbytes = 0  # number of buffered bytes
+
+    def __len__(self):
+        return self.length + self.nrows
+
+    def append(self, array):
+        """
+        :param array: an array or a list of arrays for vlen datasets
+        :returns: the total number of appended rows
+        """
+        if len(array) == 0:
+            return len(self)
+        if isinstance(array, list):  # variable length arrays
+            arr = numpy.empty(len(array), object)
+            for i, val in enumerate(array):
+                arr[i] = val
+            array = arr
+        if array.dtype.name == 'object':
+            nbytes = sum(val.nbytes for val in array) + 8 * len(array)
+        else:
+            nbytes = array.nbytes
+        self.buffer.append(array)
+        self.nrows += len(array)
+        self.nbytes += nbytes
+        if self.budget is not None:
+            self.budget.nbytes += nbytes
+            if self.budget.nbytes >= self.budget.maxbytes:
+                self.budget.flush()
+        elif self.nbytes >= self.maxbytes:
+            self.flush()
+        return len(self)
+
+    def flush(self):
+        """
+        Write the buffered rows on the dataset, by growing it if needed
+        """
+        if not self.buffer:
+            return
+        array = (self.buffer[0] if len(self.buffer) == 1
+                 else numpy.concatenate(self.buffer))
+        dset = self.container[self.key]
+        newlength = self.length + len(array)
+        if newlength > len(dset):
+            dset.resize((max(newlength, 2 * len(dset)),) + dset.shape[1:])
+        if array.dtype.name == 'object':  # h5py wants a list for vlen data
+            array = list(array)
+        dset[self.length:newlength] = array
+        self.length = newlength
+        if self.budget is not None:
+            self.budget.nbytes -= self.nbytes
+        self.buffer.clear()
+        self.nrows = 0
+        self.nbytes = 0
+
+    def close(self):
+        """
+        Flush the buffer and truncate the dataset to the right length
+        """
+        self.flush()
+        dset = self.container[self.key]
+        if len(dset) > self.length:
+            dset.resize((self.length,) + dset.shape[1:])
+
+
+def create_virtual(hdf5, key, sources, dtype):
+    """
+    Create a virtual dataset concatenating 1D datasets stored in other
+    files. Relative file names are resolved by HDF5 with respect to the
+    directory of the file containing the virtual dataset.
+
+    :param hdf5: a h5py.File object
+    :param key: the name of the virtual dataset
+    :param sources: a list of triples (filename, dataset name, length)
+    :param dtype: the dtype of the source datasets
+    :returns: the virtual dataset
+    """
+    layout = h5py.VirtualLayout((sum(src[2] for src in sources),), dtype)
+    start = 0
+    for fname, name, length in sources:
+        layout[start:start + length] = h5py.VirtualSource(
+            fname, name, shape=(length,))
+        start += length
+    return hdf5.create_virtual_dataset(key, layout)
+
+
 class LiteralAttrs(object):
     """
     A class to serialize a set of parameters in HDF5 format. The goal is to
@@ -345,8 +623,13 @@ class File(h5py.File):
             self.save_attrs(path, attrs, __pyclass__=pyclass)
 
     def _set(self, path, obj):
+        layout = (get_layout(path, obj.shape)
+                  if isinstance(obj, numpy.ndarray) else {})
         try:
-            super().__setitem__(path, obj)
+            if layout:
+                self.create_dataset(path, data=obj, **layout)
+            else:
+                super().__setitem__(path, obj)
         except Exception as exc:
             raise exc.__class__('Could not set %s=%r' % (path, obj))
 
@@ -647,54 +930,83 @@ def build_dt(dtypedict, names):
     return numpy.dtype(lst)
 
 
-def _read_csv(fileobj, compositedt):
-    itemsize = [0] * len(compositedt)
-    for i, name in enumerate(compositedt.names):
-        if compositedt[name].kind == 'S':  # limit of the length of byte-fields
-            itemsize[i] = compositedt[name].itemsize
-    rows = []
-    for lineno, row in enumerate(csv.reader(fileobj), 3):
-        cols = []
-        for i, col in enumerate(row):
-            if itemsize[i] and len(col) > itemsize[i]:
-                raise ValueError(
-                    'line %d: %s=%r has length %d > %d' %
-                    (lineno, compositedt.names[i], col, len(col), itemsize[i]))
-            cols.append(col)
-        rows.append(tuple(cols))
-    return numpy.array(rows, compositedt)
-
-
-# NB: it would be nice to use numpy.loadtxt(
-#  f, build_dt(dtypedict, header), delimiter=sep, ndmin=1, comments=None)
-# however numpy does not support quoting, and "foo,bar" would be split :-(
-def read_csv(fname, dtypedict={None: float}, renamedict={}, sep=','):
-    """
-    :param fname: a CSV file with an header and float fields
-    :param dtypedict: a dictionary fieldname -> dtype, None -> default
-    :param renamedict: aliases for the fields to rename
-    :param sep: separator (default comma)
-    :return: a structured array of floats
-    """
+def _read_csv(fileobj, compositedt, renamedict={}, sep=',', chunksize=None,
+              lineno=1):
+    # parse the columns directly into typed arrays, block by block;
+    # numeric fields are converted by the C parser of pandas, while
+    # string fields are read as objects and length-checked vectorially
+    newdt = numpy.dtype([(renamedict.get(name, name), compositedt[name])
+                         for name in compositedt.names])
+    dtype = {}
+    for name in compositedt.names:
+        dt = compositedt[name]
+        dtype[name] = dt if dt.kind in 'biuf' else object
+    reader = pandas.read_csv(
+        fileobj, sep=sep, header=None, names=compositedt.names, dtype=dtype,
+        na_filter=False, float_precision='round_trip', chunksize=chunksize)
+    for df in [reader] if chunksize is None else reader:
+        arr = numpy.zeros(len(df), newdt)
+        for name in compositedt.names:
+            col = df[name].to_numpy()
+            size = compositedt[name].itemsize
+            if compositedt[name].kind == 'S' and len(col):
+                # limit of the length of byte-fields
+                lens = df[name].str.len().to_numpy()
+                bad, = numpy.where(lens > size)
+                if len(bad):
+                    i = bad[0]
+                    raise ValueError(
+                        'line %d: %s=%r has length %d > %d' %
+                        (lineno + i + 1, name, col[i], lens[i], size))
+            arr[renamedict.get(name, name)] = col
+        lineno += len(df)
+        yield arr
+
+
+def _iter_csv(fname, dtypedict, renamedict, sep, chunksize):
     attrs = {}
     with open(fname, encoding='utf-8-sig') as f:
+        lineno = 0
         while True:
             first = next(f)
+            lineno += 1
             if first.startswith('#'):
                 attrs = dict(parse_comment(first.strip('#,\n ')))
                 continue
             break
         header = first.strip().split(sep)
+        dupl = set(name for name in header if header.count(name) > 1)
+        if dupl:
+            raise InvalidFile('%s: duplicated field(s) %s in the header' %
+                              (fname, ', '.join(sorted(dupl))))
         try:
-            arr = _read_csv(f, build_dt(dtypedict, header))
+            dt = build_dt(dtypedict, header)
         except KeyError:
             raise KeyError('Missing None -> default in dtypedict')
+        try:
+            for arr in _read_csv(f, dt, renamedict, sep, chunksize, lineno):
+                yield ArrayWrapper(arr, attrs)
         except Exception as exc:
             raise InvalidFile('%s: %s' % (fname, exc))
-    if renamedict:
-        newnames = []
-        for name in arr.dtype.names:
-            new = renamedict.get(name, name)
-            newnames.append(new)
-        arr.dtype.names = newnames
-    return ArrayWrapper(arr, attrs)
+
+
+def read_csv(fname, dtypedict={None: float}, renamedict={}, sep=',',
+             chunksize=None):
+    """
+    :param fname: a CSV file with an header and float fields
+    :param dtypedict: a dictionary fieldname -> dtype, None -> default
+    :param renamedict: aliases for the fields to rename
+    :param sep: separator (default comma)
+    :param chunksize: if given, read the file in blocks of chunksize rows
+    :return: a structured array of floats or an iterator over blocks
+
+    The header is parsed and validated only once, and the metadata in
+    the comment line (if any) is attached to each ArrayWrapper. Passing a
+    chunksize is the way to read large files (i.e. exposures with millions
+    of assets) without keeping the strings of the whole file in memory.
+    """
+    aws = _iter_csv(fname, dtypedict, renamedict, sep, chunksize)
+    if chunksize:
+        return aws
+    [aw] = aws
+    return aw
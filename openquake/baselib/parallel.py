@@ -74,6 +74,19 @@ available at the moment:
 `OQ_DISTRIBUTE` set tp "zmq"
    use the zmq concurrency mechanism (experimental)
 
+With the processpool it is possible to transport the big numpy arrays
+in the task results via shared memory blocks (Python >= 3.8): in that case
+only small descriptors are sent via zmq, and the master copies the arrays
+out of the blocks and frees them. Notice that this is not a zero-copy
+transport: each array is copied into a block by the worker and out of it
+by the master, but the (much slower) pickling and sending of the array
+through the zmq sockets is avoided. The blocks stay registered with the
+resource tracker of the master, shared by the workers of the pool, so
+they are removed even if the master dies before reading them. The feature
+is enabled by setting `shared_memory_threshold` (in bytes) in the section
+`distribution` of openquake.cfg: only the arrays bigger than the
+threshold are transported in that way.
+
 There is also an `OQ_DISTRIBUTE` = "threadpool"; however the
 performance of using threads instead of processes is normally bad for the
 kind of applications we are interested in (CPU-dominated, which large
@@ -97,6 +110,12 @@ A major feature of the Starmap API is the ability to monitor the time spent
 in each task and the memory allocated. Such information is written into an
 HDF5 file that can be provided by the user or autogenerated.
 
+It is also possible to profile a fraction of the tasks with a sampling
+profiler, by setting the environment variable `OQ_PROFILE_TASKS` (or
+the `profile_tasks` parameter in the job.ini): for instance with
+`OQ_PROFILE_TASKS=0.1` one task every ten is profiled. The sampled stacks
+are saved in the `profile` dataset and can be seen with `oq show profile`.
+
 The Starmap.apply API
 ====================================
 
@@ -138,6 +157,7 @@ the single core processing the slow task). The OpenQuake engine does
 a great deal of work trying to split slow sources in more manageable
 fast sources.
 """
+import io
 import os
 import re
 import ast
@@ -147,6 +167,7 @@ import socket
 import signal
 import pickle
 import inspect
+import hashlib
 import logging
 import operator
 import itertools
@@ -160,14 +181,18 @@ try:
 except ImportError:
     def setproctitle(title):
         "Do nothing"
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
 
 from openquake.baselib import config, hdf5, workerpool, __version__
 from openquake.baselib.zeromq import zmq, Socket
 from openquake.baselib.performance import (
-    Monitor, memory_rss, init_performance)
+    Monitor, StackSampler, memory_rss, init_performance)
 from openquake.baselib.general import (
     split_in_blocks, block_splitter, AccumDict, humansize, CallableDict,
-    gettemp)
+    gettemp, WeightedSequence)
 
 sys.setrecursionlimit(1200)  # raised a bit to make pickle happier
 # see https://github.com/gem/oq-engine/issues/5230
@@ -179,6 +204,15 @@ try:
     CT = len(psutil.Process().cpu_affinity()) * 2
 except AttributeError:
     CT = psutil.cpu_count() * 2
+# arrays bigger than this (in bytes) are sent back via shared memory
+SHM_THRESHOLD = int(config.distribution.get('shared_memory_threshold') or 0)
+# tasks slower than this factor times the median are resubmitted
+SPECULATION = float(config.distribution.get('speculation_factor') or 0)
+# fraction of the tasks to run under the sampling profiler; the default
+# can be overridden by each calculation with the parameter profile_tasks
+PROFILE_DEFAULT = float(os.environ.get('OQ_PROFILE_TASKS', 0))
+PROFILE = PROFILE_DEFAULT
+smap_ids = itertools.count()  # used to discard stale results
 
 
 @submit.add('no')
@@ -205,6 +239,9 @@ def celery_submit(self, func, args, monitor):
 
 @submit.add('zmq')
 def zmq_submit(self, func, args, monitor):
+    if self.dispatcher:  # send directly to the best workerpool
+        mem = self.mem_by_task.get(func.__name__, 0)
+        return self.dispatcher.send((func, args, self.task_no, monitor), mem)
     if not hasattr(self, 'sender'):
         port = int(config.zworkers.ctrl_port) + 2
         task_input_url = 'tcp://127.0.0.1:%d' % port
@@ -229,6 +266,39 @@ def oq_distribute(task=None):
     return dist
 
 
+class _ShmPickler(pickle.Pickler):
+    # store the arrays bigger than the threshold in shared memory blocks
+    def __init__(self, file, threshold):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.threshold = threshold
+        self.blocks = []  # pairs (block name, nbytes)
+
+    def persistent_id(self, obj):
+        if (isinstance(obj, numpy.ndarray) and obj.nbytes >= self.threshold
+                and obj.nbytes and not obj.dtype.hasobject):
+            # the block is unlinked by the receiver; it stays registered
+            # with the resource tracker, which removes it if the receiver
+            # dies before reading it
+            shm = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+            numpy.ndarray(obj.shape, obj.dtype, buffer=shm.buf)[:] = obj
+            shm.close()
+            self.blocks.append((shm.name, obj.nbytes))
+            return shm.name, obj.shape, obj.dtype
+        return None
+
+
+class _ShmUnpickler(pickle.Unpickler):
+    # copy the arrays out of the shared memory blocks and free the blocks
+    def persistent_load(self, pid):
+        name, shape, dtype = pid
+        shm = shared_memory.SharedMemory(name)
+        try:
+            return numpy.ndarray(shape, dtype, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+
 class Pickled(object):
     """
     An utility to manually pickling/unpickling objects.
@@ -238,12 +308,23 @@ class Pickled(object):
     of the pickled bytestring.
 
     :param obj: the object to pickle
+    :param shm_threshold:
+        if positive, arrays bigger than it are stored in shared memory
+        blocks, to be freed by the process calling .unpickle or .free
     """
-    def __init__(self, obj):
+    def __init__(self, obj, shm_threshold=0):
         self.clsname = obj.__class__.__name__
         self.calc_id = str(getattr(obj, 'calc_id', ''))  # for monitors
+        self.blocks = []
         try:
-            self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            if shm_threshold and shared_memory:
+                f = io.BytesIO()
+                pickler = _ShmPickler(f, shm_threshold)
+                pickler.dump(obj)
+                self.pik = f.getvalue()
+                self.blocks = pickler.blocks
+            else:
+                self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
         except TypeError as exc:  # can't pickle, show the obj in the message
             raise TypeError('%s: %s' % (exc, obj))
 
@@ -253,13 +334,112 @@ class Pickled(object):
             self.clsname, self.calc_id, humansize(len(self)))
 
     def __len__(self):
-        """Length of the pickled bytestring"""
-        return len(self.pik)
+        """Length of the pickled bytestring plus the shared memory"""
+        return len(self.pik) + sum(nbytes for name, nbytes in self.blocks)
 
     def unpickle(self):
         """Unpickle the underlying object"""
+        if self.blocks:
+            obj = _ShmUnpickler(io.BytesIO(self.pik)).load()
+            self.blocks = []  # freed by the unpickler
+            return obj
         return pickle.loads(self.pik)
 
+    def free(self):
+        """Free the shared memory blocks without unpickling"""
+        free_blocks(name for name, _ in self.blocks)
+        self.blocks = []
+
+
+def free_blocks(names):
+    """
+    Unlink the shared memory blocks with the given names, if they exist
+
+    :param names: an iterable of block names
+    """
+    for name in names:
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:  # already freed
+            continue
+        shm.close()
+        shm.unlink()
+
+
+def _workers_see_files():
+    # True if the workers can read the files written by the master
+    if config.directory.shared_dir:
+        return True
+    dist = oq_distribute()
+    if dist in ('no', 'processpool', 'threadpool'):
+        return True
+    elif dist == 'zmq':
+        hosts = [hc.split()[0].split(':')[0]
+                 for hc in config.zworkers.host_cores.split(',')
+                 if hc.strip()]
+        return all(host in ('127.0.0.1', 'localhost') for host in hosts)
+    return False
+
+
+_shared = {}  # key -> (calc_id, object), both in the master and the workers
+# id(object) -> (object, Shared instance); the object is kept alive, so
+# that its id cannot be reused by another object while in the dictionary
+_shared_ref = {}
+
+
+class Shared(object):
+    """
+    A reference to an object broadcast to the workers only once.
+    The object is pickled a single time by the master and saved in a file;
+    each worker reads the file the first time it needs the object and
+    keeps it in a cache keyed by the SHA1 of the pickled bytes. Then only
+    the reference travels with the task arguments. The cache is evicted by
+    :meth:`Starmap.evict` in the master at the end of the calculation and
+    in the workers when a task of another calculation arrives.
+
+    :param key: the SHA1 of the pickled object
+    :param path: the file containing the pickled object
+    :param calc_id: the calculation owning the object
+    """
+    def __init__(self, key, path, calc_id):
+        self.key = key
+        self.path = path
+        self.calc_id = calc_id
+
+    def __repr__(self):
+        return '<Shared %s #%s>' % (self.key[:8], self.calc_id)
+
+    def __len__(self):
+        """Approximate size of the reference"""
+        return len(self.key) + len(self.path)
+
+    def unpickle(self):
+        """Return the referenced object, reading it only once"""
+        try:
+            return _shared[self.key][1]
+        except KeyError:
+            pass
+        evict_shared(self.calc_id)
+        with open(self.path, 'rb') as f:
+            obj = pickle.load(f)
+        _shared[self.key] = self.calc_id, obj
+        _shared_ref[id(obj)] = obj, self
+        return obj
+
+
+def evict_shared(calc_id):
+    """
+    Remove from the cache the shared objects of the calculations different
+    from the given one
+
+    :param calc_id: the current calculation
+    """
+    for key, (cid, obj) in list(_shared.items()):
+        if cid != calc_id:
+            del _shared[key]
+            if _shared_ref.get(id(obj), (None,))[0] is obj:
+                del _shared_ref[id(obj)]
+
 
 def get_pickled_sizes(obj):
     """
@@ -288,7 +468,7 @@ def pickle_sequence(objects):
     Convert an iterable of objects into a list of pickled objects.
     If the iterable contains copies, the pickling will be done only once.
     If the iterable contains objects already pickled, they will not be
-    pickled again.
+    pickled again. Shared objects are replaced by their references.
 
     :param objects: a sequence of objects to pickle
     """
@@ -297,8 +477,10 @@ def pickle_sequence(objects):
     for obj in objects:
         obj_id = id(obj)
         if obj_id not in cache:
-            if isinstance(obj, Pickled):  # already pickled
+            if isinstance(obj, (Pickled, Shared)):  # already pickled
                 cache[obj_id] = obj
+            elif obj_id in _shared_ref:  # broadcast object
+                cache[obj_id] = _shared_ref[obj_id][1]
             else:  # pickle the object
                 cache[obj_id] = Pickled(obj)
         out.append(cache[obj_id])
@@ -326,15 +508,16 @@ class Result(object):
     func = None
 
     def __init__(self, val, mon, tb_str='', msg=''):
+        shm = getattr(mon, 'shm_threshold', 0)
         if isinstance(val, dict):
-            self.pik = Pickled(val)
+            self.pik = Pickled(val, shm)
             self.nbytes = {k: len(Pickled(v)) for k, v in val.items()}
         elif isinstance(val, tuple) and callable(val[0]):
             self.func = val[0]
             self.pik = pickle_sequence(val[1:])
             self.nbytes = {'tot': sum(len(p) for p in self.pik)}
         else:
-            self.pik = Pickled(val)
+            self.pik = Pickled(val, shm)
             self.nbytes = {'tot': len(self.pik)}
         self.mon = mon
         self.tb_str = tb_str
@@ -418,6 +601,8 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
     :param mon: a monitor
     """
     isgenfunc = inspect.isgeneratorfunction(func)
+    if mon.calc_id is not None:  # free the objects of other calculations
+        evict_shared(mon.calc_id)
     if hasattr(args[0], 'unpickle'):
         # args is a list of Pickled objects
         args = [a.unpickle() for a in args]
@@ -440,9 +625,16 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
             def gen(*args):
                 yield func(*args)
             it = gen(*args)
+        profile = getattr(mon, 'profile', 0)
+        if profile and task_no % max(1, round(1 / profile)) == 0:
+            sampler = StackSampler().start()
+        else:
+            sampler = None
         while True:
             # StopIteration -> TASK_ENDED
             res = Result.new(next, (it,), mon, sentbytes)
+            if sampler and res.msg == 'TASK_ENDED':
+                mon.stacks = sampler.stop()  # sent back with the monitor
             try:
                 zsocket.send(res)
             except Exception:  # like OverflowError
@@ -525,6 +717,7 @@ class IterResult(object):
                 self.h5['task_sent'] = str(task_sent)
                 name = result.mon.operation[6:]  # strip 'total '
                 result.mon.save_task_info(self.h5, result, name, mem_gb)
+                result.mon.save_profile(self.h5, name)
                 result.mon.flush(self.h5)
                 self.h5.flush()
             elif not result.func:  # real output
@@ -576,6 +769,99 @@ class IterResult(object):
         return res
 
 
+class TaskTimer(object):
+    """
+    Predict the duration of a task from the weights of its elements, by
+    using a rate (seconds per unit of weight) for each kind of element.
+    The rates are fitted with least squares on the observed durations,
+    which can be task durations (as in task_info) or element durations
+    (as in source_info). For instance, with 2 kinds of elements:
+
+    >>> timer = TaskTimer(weight=len, key=lambda item: item[0])
+    >>> timer.observe(['aa', 'a'], 3.)
+    >>> timer.observe(['bbbb'], 2.)
+    >>> timer.observe(['aaa', 'bb'], 4.)
+    >>> round(timer.predict(['a', 'bb']), 2)
+    2.0
+
+    :param weight: function returning the weight of an element
+    :param key: function returning the kind of an element
+    """
+    def __init__(self, weight, key=lambda item: 'Unspecified'):
+        self.weight = weight
+        self.key = key
+        self.kinds = {}  # kind -> index
+        self.ata = numpy.zeros((0, 0))  # normal equations
+        self.atb = numpy.zeros(0)
+        self.totweight = 0
+        self.totduration = 0
+        self.rates = None  # seconds per unit of weight, by kind
+
+    def weights(self, items):
+        """
+        :returns: an array with the total weight of the items by kind
+        """
+        for item in items:
+            kind = self.key(item)
+            if kind not in self.kinds:
+                self.kinds[kind] = len(self.kinds)
+        w = numpy.zeros(len(self.kinds))
+        for item in items:
+            w[self.kinds[self.key(item)]] += self.weight(item)
+        return w
+
+    def observe(self, items, duration, wvec=None):
+        """
+        Update the rates with a new observation
+
+        :param items: the elements processed in the given time
+        :param duration: the time spent, in seconds
+        :param wvec: if given, the precomputed weights of the items
+        """
+        w = self.weights(items) if wvec is None else wvec
+        K = len(self.kinds)
+        if K > len(self.atb):  # there are new kinds
+            ata = numpy.zeros((K, K))
+            n = len(self.atb)
+            ata[:n, :n] = self.ata
+            self.ata = ata
+            self.atb = numpy.concatenate([self.atb, numpy.zeros(K - n)])
+        w = numpy.concatenate([w, numpy.zeros(K - len(w))])
+        self.ata += numpy.outer(w, w)
+        self.atb += w * duration
+        self.totweight += w.sum()
+        self.totduration += duration
+        if self.totweight == 0:
+            return
+        # ridge regression around the average rate, to keep the
+        # system solvable when there are few observations of a kind
+        rate = self.totduration / self.totweight
+        lam = max(numpy.trace(self.ata) / K * 1E-3, 1E-12)
+        rates = numpy.linalg.solve(self.ata + lam * numpy.eye(K),
+                                   self.atb + lam * rate)
+        self.rates = numpy.maximum(rates, rate * 1E-3)
+
+    def duration(self, item):
+        """
+        :returns: the predicted duration of the given element
+        """
+        idx = self.kinds.get(self.key(item))
+        if idx is None or idx >= len(self.rates):  # unknown kind
+            return self.weight(item) * self.totduration / self.totweight
+        return self.weight(item) * self.rates[idx]
+
+    def predict(self, items, wvec=None):
+        """
+        :returns: the predicted duration of a task on the given items
+        """
+        if self.rates is None:
+            return 0.
+        w = self.weights(items) if wvec is None else wvec
+        n = len(self.rates)
+        unknown = w[n:].sum() * self.totduration / self.totweight
+        return w[:n] @ self.rates[:len(w[:n])] + unknown
+
+
 def init_workers():
     """Waiting function, used to wake up the process pool"""
     setproctitle('oq-worker')
@@ -710,12 +996,148 @@ class Starmap(object):
         self.receiver = 'tcp://%s:%s' % (
             config.dbserver.listen, config.dbserver.receiver_ports)
         self.monitor.backurl = None  # overridden later
+        # the workers of the processpool are on the same machine as the
+        # master, so they can send back the results via shared memory
+        self.monitor.shm_threshold = (
+            SHM_THRESHOLD if self.distribute == 'processpool' else 0)
+        self.monitor.profile = PROFILE
         self.tasks = []  # populated by .submit
         self.task_no = 0
+        self.timer = None  # set by .adapt
+        self.predicted = {}  # task_no -> predicted duration
+        self.monitor.smap_id = next(smap_ids)
+        self.speculation = SPECULATION if self.distribute != 'no' else 0
+        self.running = {}  # task_no -> [func, args, start time, sent]
+        self.elapsed = []  # times of the finished tasks
+        self.speculated = set()  # task numbers of the resubmitted tasks
+        self.owner = {}  # task_no -> attempt sending the first result
+        self.busy = 0  # number of running attempts
+        self.dispatcher = None
+        self.mem_by_task = {}  # task name -> max memory used, in bytes
+        self.lineage = None  # id(args) -> root, set by .track
+        self.roots = {}  # task_no -> position of the originating task
+        self.todo_by_root = collections.Counter()
+        self.done_roots = []  # roots with all their subtasks completed
+        self.root = None  # root of the last received output
         if self.distribute == 'zmq':  # add a check
             err = workerpool.check_status()
             if err:
                 raise RuntimeError(err)
+            if config.zworkers.get('balanced_dispatch'):
+                self.dispatcher = workerpool.Dispatcher(
+                    workerpool.WorkerMaster(**config.zworkers))
+
+    def share(self, obj):
+        """
+        Broadcast the given object to the workers only once: after this
+        call the object is replaced by a small :class:`Shared` reference
+        every time it appears in the arguments of a task. If the workers
+        cannot read the files of the master (i.e. on a cluster without a
+        shared_dir) this is a no-op.
+
+        :param obj: an object to be sent to many tasks
+        :returns: the object itself
+        """
+        if id(obj) in _shared_ref or not _workers_see_files():
+            return obj
+        pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        key = hashlib.sha1(pik).hexdigest()
+        path = os.path.join(os.path.dirname(self.h5.filename),
+                            'calc_%s_%s.pik' % (self.calc_id, key))
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(pik)
+        _shared[key] = self.calc_id, obj
+        _shared_ref[id(obj)] = obj, Shared(key, path, self.calc_id)
+        return obj
+
+    @classmethod
+    def evict(cls, calc_id):
+        """
+        Remove the objects shared by the given calculation and their files
+        """
+        for obj_id, (_obj, ref) in list(_shared_ref.items()):
+            if ref.calc_id == calc_id:
+                del _shared_ref[obj_id]
+                _shared.pop(ref.key, None)
+                if os.path.exists(ref.path):
+                    os.remove(ref.path)
+
+    def adapt(self, weight, key=lambda item: 'Unspecified',
+              observe_tasks=True):
+        """
+        Enable the adaptive scheduling of the tasks in the queue: the
+        durations of the finished tasks (or of their elements) are used to
+        predict the durations of the queued tasks, then the tasks predicted
+        to be much slower than the median prediction for the finished tasks
+        are split and the tiny ones are merged.
+
+        :param weight: function returning the weight of an element of arg0
+        :param key: function returning the kind of an element of arg0
+        :param observe_tasks:
+            if False, the durations must be passed to .timer.observe by
+            the caller, element by element
+        """
+        self.timer = TaskTimer(weight, key)
+        self.observe_tasks = observe_tasks
+        self.predictions = []  # predicted durations of the finished tasks
+        self.wvec = {}  # task_no -> weights by kind
+
+    def _adapt(self, func, args):
+        # split or merge a queued task depending on the predicted duration;
+        # the threshold comes from the same timer, so that the predictions
+        # are compared on the same scale even if the timer is fed with
+        # element durations, which do not include the task overhead
+        med = numpy.median(self.predictions)
+        items = args[0]
+        pred = self.timer.predict(items)
+        if pred > 2 * med:  # split
+            blocks = list(block_splitter(items, med, self.timer.duration))
+            if len(blocks) > 1:
+                logging.debug('Splitting task with predicted duration '
+                              '%d s in %d', pred, len(blocks))
+                blocks = [WeightedSequence(
+                    (item, self.timer.weight(item)) for item in block)
+                    for block in blocks]
+                self.task_queue[:0] = [
+                    (func, (block,) + args[1:]) for block in blocks[1:]]
+                return func, (blocks[0],) + args[1:]
+        elif pred < med / 4:  # merge with the next tasks
+            items = list(items)
+            while self.task_queue and pred < med / 2:
+                f, a = self.task_queue[0]
+                if f is not func or len(a) != len(args) or isinstance(
+                        a[0], Pickled) or any(
+                            x is not y for x, y in zip(a[1:], args[1:])):
+                    break
+                pred += self.timer.predict(a[0])
+                items.extend(a[0])
+                del self.task_queue[0]
+            if len(items) > len(args[0]):
+                items = WeightedSequence(
+                    (item, self.timer.weight(item)) for item in items)
+                return func, (items,) + args[1:]
+        return func, args
+
+    def track(self, done=()):
+        """
+        Enable the tracking of the task lineage: the tasks in the queue
+        are identified by their position (the root), the subtasks inherit
+        the root of the task generating them and a root is appended to
+        .done_roots when all of its tasks are completed. The outputs
+        received set the attribute .root to the root of their task.
+
+        :param done: roots of the tasks already completed, to be skipped
+        """
+        assert self.timer is None, 'Cannot track adaptive tasks'
+        self.lineage = {}
+        queue = []
+        for root, (func, args) in enumerate(self.task_queue):
+            if root not in done:
+                self.lineage[id(args)] = root
+                self.todo_by_root[root] += 1
+                queue.append((func, args))
+        self.task_queue[:] = queue
 
     def log_percent(self):
         """
@@ -754,6 +1176,12 @@ class Starmap(object):
         if OQ_TASK_NO is not None and self.task_no != int(OQ_TASK_NO):
             self.task_no += 1
             return
+        if self.lineage is not None:
+            self.roots[self.task_no] = self.lineage.pop(id(args))
+        if self.timer and not isinstance(args[0], Pickled):
+            wvec = self.timer.weights(args[0])
+            self.wvec[self.task_no] = wvec
+            self.predicted[self.task_no] = self.timer.predict(args[0], wvec)
         dist = 'no' if self.num_tasks == 1 or OQ_TASK_NO else self.distribute
         if dist != 'no':
             pickled = isinstance(args[0], Pickled)
@@ -768,6 +1196,9 @@ class Starmap(object):
                 argnames = getargnames(func)[:-1]
             self.sent[fname] += {a: len(p) for a, p in zip(argnames, args)}
         res = submit[dist](self, func, args, monitor)
+        if self.speculation and dist != 'no':
+            self.running[self.task_no] = [func, args, time.time(), False]
+            self.busy += 1
         self.task_no += 1
         self.tasks.append(res)
 
@@ -805,9 +1236,91 @@ class Starmap(object):
                 # remove in LIFO order
                 func, args = self.task_queue[0]
                 del self.task_queue[0]
+                if (self.timer and len(self.predictions) > 2 and
+                        not isinstance(args[0], Pickled)):
+                    func, args = self._adapt(func, args)
                 self.submit(args, func=func)
                 self.todo += 1
 
+    def _observe(self, mon):
+        # store the predicted duration and update the timer
+        mon.predicted = self.predicted.pop(mon.task_no, 0)
+        wvec = self.wvec.pop(mon.task_no, None)
+        if wvec is not None:
+            if self.observe_tasks:
+                self.timer.observe((), mon.duration, wvec)
+            # prediction with the current rates, zero if there are none
+            pred = self.timer.predict((), wvec)
+            if pred:
+                self.predictions.append(pred)
+
+    def _speculate(self):
+        # resubmit the slow tasks when the queue is empty and there are
+        # idle cores; only the tasks which sent nothing yet are considered
+        if self.task_queue or len(self.elapsed) < 3:
+            return
+        num_cores = self.num_cores or CT // 2
+        limit = self.speculation * numpy.median(self.elapsed)
+        now = time.time()
+        for task_no, (func, args, t0, sent) in list(self.running.items()):
+            if self.busy >= num_cores:
+                break
+            elif sent or task_no in self.speculated or now - t0 < limit:
+                continue
+            logging.info('Resubmitting task #%d, running since %d s',
+                         task_no, now - t0)
+            mon = self.monitor.new(self.monitor.operation, attempt=1)
+            task_no, self.task_no = self.task_no, task_no
+            submit[self.distribute](self, func, args, mon)
+            task_no, self.task_no = self.task_no, task_no
+            self.speculated.add(task_no)
+            self.busy += 1
+
+    def _duplicate(self, res):
+        # True for the results of the losing copy of a resubmitted task
+        task_no = res.mon.task_no
+        ended = res.msg == 'TASK_ENDED'
+        if ended:
+            self.busy -= 1
+        elif res.msg:  # warning, it does not count as a result
+            return False
+        if task_no in self.speculated:
+            attempt = getattr(res.mon, 'attempt', 0)
+            if self.owner.setdefault(task_no, attempt) != attempt:
+                return True
+        if task_no in self.running:
+            if ended:
+                t0 = self.running.pop(task_no)[2]
+                self.elapsed.append(time.time() - t0)
+            else:
+                self.running[task_no][3] = True
+        return False
+
+    def _task_ended(self, task_no):
+        # a root is done when all of its tasks and subtasks are done
+        root = self.roots.pop(task_no)
+        self.todo_by_root[root] -= 1
+        if self.todo_by_root[root] == 0:
+            del self.todo_by_root[root]
+            self.done_roots.append(root)
+
+    def _iter_polling(self):
+        # iterate on the socket, performing the periodic checks every second
+        zsocket = self.socket.zsocket
+        last = time.time()
+        while True:
+            try:
+                if zsocket.poll(1000):
+                    yield zsocket.recv_pyobj()
+            except zmq.ZMQError:  # sending SIGTERM raises ZMQError
+                break
+            if time.time() - last > 1:
+                if self.speculation:
+                    self._speculate()
+                if self.dispatcher:
+                    self.dispatcher.flush()
+                last = time.time()
+
     def _loop(self):
         num_cores = self.num_cores or CT // 2
         if self.task_queue:
@@ -818,30 +1331,68 @@ class Starmap(object):
         if not hasattr(self, 'socket'):  # no submit was ever made
             return ()
 
-        isocket = iter(self.socket)
+        if self.speculation or self.dispatcher:
+            isocket = self._iter_polling()
+        else:
+            isocket = iter(self.socket)
         self.todo = len(self.tasks)
-        while self.todo:
-            res = next(isocket)
-            if self.calc_id != res.mon.calc_id:
-                logging.warning('Discarding a result from job %s, since this '
-                                'is job %d', res.mon.calc_id, self.calc_id)
-            elif res.msg == 'TASK_ENDED':
-                self.todo -= 1
-                self._submit_many(1)
-                logging.debug('%d tasks todo, %d in queue',
-                              self.todo, len(self.task_queue))
-                self.log_percent()
-                yield res
-            elif res.func:  # add subtask
-                self.task_queue.append((res.func, res.pik))
-                if self.num_cores is None:
-                    self._submit_many(1)  # oversubmit
-                elif self.todo < self.num_cores:
-                    self._submit_many(self.num_cores - self.todo)
-            else:
-                yield res
+        blocks = []  # names of the shared memory blocks received
+        try:
+            while self.todo:
+                res = next(isocket)
+                for name, _ in getattr(res.pik, 'blocks', ()):
+                    blocks.append(name)
+                if (self.dispatcher and res.msg == 'TASK_ENDED' and
+                        res.mon.smap_id == self.monitor.smap_id):
+                    name = res.mon.operation[6:]  # strip 'total '
+                    self.mem_by_task[name] = max(
+                        self.mem_by_task.get(name, 0), res.mon.mem)
+                    self.dispatcher.done(res.mon.task_no, res.mon.host)
+                if self.calc_id != res.mon.calc_id:
+                    logging.warning(
+                        'Discarding a result from job %s, since this is job '
+                        '%d', res.mon.calc_id, self.calc_id)
+                    if hasattr(res.pik, 'free'):
+                        res.pik.free()
+                elif (res.mon.smap_id != self.monitor.smap_id or
+                      self.speculation and self._duplicate(res)):
+                    logging.debug('Discarding a duplicated result of task #%d',
+                                  res.mon.task_no)
+                    if hasattr(res.pik, 'free'):
+                        res.pik.free()
+                elif res.msg == 'TASK_ENDED':
+                    if self.timer:
+                        self._observe(res.mon)
+                    if self.lineage is not None:
+                        self._task_ended(res.mon.task_no)
+                    self.todo -= 1
+                    self._submit_many(1)
+                    logging.debug('%d tasks todo, %d in queue',
+                                  self.todo, len(self.task_queue))
+                    self.log_percent()
+                    yield res
+                elif res.func:  # add subtask
+                    self.task_queue.append((res.func, res.pik))
+                    if self.lineage is not None:
+                        root = self.roots[res.mon.task_no]
+                        self.lineage[id(res.pik)] = root
+                        self.todo_by_root[root] += 1
+                    if self.num_cores is None:
+                        self._submit_many(1)  # oversubmit
+                    elif self.todo < self.num_cores:
+                        self._submit_many(self.num_cores - self.todo)
+                else:
+                    if self.lineage is not None and not res.msg:
+                        self.root = self.roots[res.mon.task_no]
+                    yield res
+        finally:
+            # free the blocks of the results not consumed, for instance
+            # because of an exception in the reduce function
+            free_blocks(blocks)
         self.log_percent()
         self.socket.__exit__(None, None, None)
+        if self.dispatcher:
+            self.dispatcher.close()
         self.tasks.clear()
 
 
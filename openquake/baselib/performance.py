@@ -17,8 +17,12 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
 import time
+import socket
 import getpass
+import threading
+import collections
 from datetime import datetime
 import psutil
 import numpy
@@ -36,7 +40,15 @@ perf_dt = numpy.dtype([('operation', '<S50'), ('time_sec', float),
 task_info_dt = numpy.dtype(
     [('taskname', '<S50'), ('task_no', numpy.uint32),
      ('weight', numpy.float32), ('duration', numpy.float32),
-     ('received', numpy.int64), ('mem_gb', numpy.float32)])
+     ('predicted', numpy.float32), ('received', numpy.int64),
+     ('mem_gb', numpy.float32)])
+timeline_dt = numpy.dtype(
+    [('operation', '<S50'), ('task_no', numpy.int32), ('host', '<S50'),
+     ('pid', numpy.uint32), ('start', float), ('stop', float)])
+profile_dt = numpy.dtype(
+    [('taskname', '<S50'), ('task_no', numpy.uint32), ('stack', hdf5.vstr),
+     ('counts', numpy.uint32)])
+HOST = socket.gethostname()
 
 
 def init_performance(hdf5file, swmr=False):
@@ -49,6 +61,12 @@ def init_performance(hdf5file, swmr=False):
         hdf5.create(h5, 'performance_data', perf_dt)
     if 'task_info' not in h5:
         hdf5.create(h5, 'task_info', task_info_dt)
+    if 'task_timeline' not in h5:
+        hdf5.create(h5, 'task_timeline', timeline_dt)
+    if 'profile' not in h5:
+        # NB: the stacks are vstr, so the dataset cannot be read
+        # on-the-fly in SWMR mode, only when the calculation is over
+        hdf5.create(h5, 'profile', profile_dt)
     if 'task_sent' not in h5:
         h5['task_sent'] = '{}'
     if swmr:
@@ -71,6 +89,96 @@ def _pairs(items):
     return sorted(lst)
 
 
+def trace_events(timeline):
+    """
+    Convert a timeline array into a dictionary in Chrome trace-event
+    format, to be saved as JSON and opened with chrome://tracing or
+    https://ui.perfetto.dev. Each host is displayed as a process and each
+    worker as a thread, with the nested operations inside the tasks:
+
+    >>> timeline = numpy.array([
+    ...     ('total classical', 0, 'h1', 12, 10., 12.),
+    ...     ('computing pnes', 0, 'h1', 12, 10.5, 11.)], timeline_dt)
+    >>> evs = trace_events(timeline)['traceEvents']
+    >>> [(ev['name'], ev['ts'], ev['dur']) for ev in evs if ev['ph'] == 'X']
+    [('total classical', 0, 2000000), ('computing pnes', 500000, 500000)]
+
+    :param timeline: an array of dtype timeline_dt
+    :returns: a dictionary with keys traceEvents and displayTimeUnit
+    """
+    events = []
+    if len(timeline) == 0:
+        return dict(traceEvents=events, displayTimeUnit='ms')
+    hosts = sorted(set(timeline['host']))
+    for i, host in enumerate(hosts):
+        events.append(dict(name='process_name', ph='M', pid=i,
+                           args=dict(name=host.decode('utf8'))))
+    t0 = timeline['start'].min()
+    for rec in numpy.sort(timeline, order='start'):
+        events.append(dict(
+            name=rec['operation'].decode('utf8'), ph='X',
+            pid=hosts.index(rec['host']), tid=int(rec['pid']),
+            ts=int(round((rec['start'] - t0) * 1E6)),
+            dur=int(round((rec['stop'] - rec['start']) * 1E6)),
+            args=dict(task_no=int(rec['task_no']))))
+    return dict(traceEvents=events, displayTimeUnit='ms')
+
+
+class StackSampler(object):
+    """
+    A statistical profiler with a low overhead: a background thread looks
+    at the stack of the profiled thread every `interval` seconds and counts
+    the stacks in folded format, i.e. as strings of frames separated by
+    semicolons, starting from the frame calling .start. Here is an example
+    of use:
+
+    >>> sampler = StackSampler(interval=.001).start()
+    >>> _ = sum(i * i for i in range(1000000))
+    >>> stacks = sampler.stop()
+    >>> sum(stacks.values()) > 0
+    True
+
+    :param interval: sampling interval in seconds
+    """
+    def __init__(self, interval=.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        Start sampling the current thread
+        """
+        self.thread_id = threading.get_ident()
+        self.base = sys._getframe(1)  # the frame calling .start
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None and frame is not self.base:
+                code = frame.f_code
+                frames.append('%s (%s:%d)' % (
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            if frames and not self._stop.is_set():  # skip the .stop frames
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        """
+        Stop sampling
+
+        :returns: a Counter folded stack -> number of samples
+        """
+        self._stop.set()
+        self.thread.join()
+        return self.stacks
+
+
 def memory_rss(pid):
     """
     :returns: the RSS memory allocated by a process
@@ -108,6 +216,7 @@ class Monitor(object):
     address = None
     authkey = None
     calc_id = None
+    max_spans = 100  # intervals recorded for the timeline at each flush
 
     def __init__(self, operation='', measuremem=False, inner_loop=False,
                  h5=None):
@@ -119,6 +228,7 @@ class Monitor(object):
         self.duration = 0
         self._start_time = self._stop_time = time.time()
         self.children = []
+        self.spans = []  # (host, pid, start, stop) for the timeline
         self.counts = 0
         self.address = None
         self.username = getpass.getuser()
@@ -159,6 +269,17 @@ class Monitor(object):
                          self.task_no))
         return numpy.array(data, perf_dt)
 
+    def get_timeline(self):
+        """
+        :returns:
+            an array of dtype timeline_dt with the time intervals spent
+            in the monitored block, up to .max_spans intervals
+        """
+        return numpy.array([(self.operation, self.task_no, host, pid,
+                             start, stop)
+                            for host, pid, start, stop in self.spans],
+                           timeline_dt)
+
     def __enter__(self):
         self.exc = None  # exception
         self._start_time = time.time()
@@ -174,6 +295,9 @@ class Monitor(object):
         self._stop_time = time.time()
         self.duration += self._stop_time - self._start_time
         self.counts += 1
+        if len(self.spans) < self.max_spans:
+            self.spans.append(
+                (HOST, os.getpid(), self._start_time, self._stop_time))
         if self.h5:
             self.flush(self.h5)
 
@@ -186,19 +310,36 @@ class Monitor(object):
         :param name: name of the task function
         :param mem_gb: memory consumption at the saving time (optional)
         """
-        t = (name, self.task_no, self.weight, self.duration, len(res.pik),
-             mem_gb)
+        # the predicted duration is set by the adaptive Starmap, if any
+        t = (name, self.task_no, self.weight, self.duration,
+             getattr(self, 'predicted', 0), len(res.pik), mem_gb)
         data = numpy.array([t], task_info_dt)
         hdf5.extend(h5['task_info'], data)
         h5['task_info'].flush()  # notify the reader
 
+    def save_profile(self, h5, name):
+        """
+        Called by parallel.IterResult to save the stacks sampled by
+        a profiled task, if any.
+
+        :param h5: where to save the stacks
+        :param name: name of the task function
+        """
+        stacks = getattr(self, 'stacks', None)
+        if stacks and 'profile' in h5:
+            data = numpy.array([(name, self.task_no, stack, counts)
+                                for stack, counts in stacks.items()],
+                               profile_dt)
+            hdf5.extend(h5['profile'], data)
+
     def reset(self):
         """
-        Reset duration, mem, counts
+        Reset duration, mem, counts, spans
         """
         self.duration = 0
         self.mem = 0
         self.counts = 0
+        self.spans = []
 
     def flush(self, h5):
         """
@@ -206,12 +347,19 @@ class Monitor(object):
         """
         if not self.children:
             data = self.get_data()
+            timeline = self.get_timeline()
         else:
             lst = [self.get_data()]
+            tls = [self.get_timeline()]
             for child in self.children:
                 lst.append(child.get_data())
+                tls.append(child.get_timeline())
                 child.reset()
             data = numpy.concatenate(lst)
+            timeline = numpy.concatenate(tls)
+        if len(timeline) and 'task_timeline' in h5:
+            hdf5.extend(h5['task_timeline'], timeline)
+            h5['task_timeline'].flush()
         if len(data) == 0:  # no information
             return
         hdf5.extend(h5['performance_data'], data)
@@ -233,7 +381,7 @@ class Monitor(object):
         """
         new = object.__new__(self.__class__)
         vars(new).update(vars(self), operation=operation, children=[],
-                         counts=0, mem=0, duration=0)
+                         counts=0, mem=0, duration=0, spans=[])
         vars(new).update(kw)
         return new
 
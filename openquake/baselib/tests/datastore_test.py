@@ -22,6 +22,8 @@ import sys
 import unittest
 import tempfile
 import numpy
+import pandas
+from openquake.baselib import hdf5, InvalidFile
 from openquake.baselib.datastore import DataStore, read
 
 
@@ -61,6 +63,141 @@ class DataStoreTestCase(unittest.TestCase):
         self.dstore['a/b'] = 42
         self.assertTrue('a/b' in self.dstore)
 
+    def test_read_df(self):
+        arr = numpy.zeros(10, [('id', numpy.uint32), ('taxonomy', 'S10'),
+                               ('value', (numpy.float32, (2, 3)))])
+        arr['id'] = numpy.arange(10)
+        arr['value'] = numpy.arange(60).reshape(10, 2, 3)
+        self.dstore['arr'] = arr
+        df = self.dstore.read_df('arr', 'id')
+        self.assertEqual(list(df.columns), ['taxonomy'] + [
+            'value_%d_%d' % ij for ij in numpy.ndindex(2, 3)])
+        self.assertEqual(df.loc[7].value_1_2, 47)
+
+        # reading in chunks gives the same dataframe
+        dfs = list(self.dstore.read_df('arr', chunksize=4))
+        self.assertEqual([len(d) for d in dfs], [4, 4, 2])
+        df = self.dstore.read_df('arr')
+        self.assertTrue(pandas.concat(dfs).equals(df))
+
+    def test_dset2df(self):
+        self.dstore['losses'] = numpy.arange(12.).reshape(4, 3)
+        dset = self.dstore.getitem('losses')
+        dset.attrs['shape_descr'] = ['period', 'loss_type']
+        dset.attrs['period'] = [10, 50, 100, 500]
+        dset.attrs['loss_type'] = ['structural', 'contents', 'occupants']
+        df = self.dstore.read_df('losses', ['period', 'loss_type'])
+        self.assertEqual(len(df), 12)
+        self.assertEqual(df.loc[100, 'contents'].value, 7)
+        dfs = list(self.dstore.read_df('losses', chunksize=6))
+        self.assertEqual([len(d) for d in dfs], [6, 6])
+        self.assertTrue(
+            pandas.concat(dfs).equals(self.dstore.read_df('losses')))
+
+    def test_appender(self):
+        self.dstore.create_dset('data', numpy.uint32)
+        self.dstore.create_dset('vlen', hdf5.vfloat32)
+        data = hdf5.Appender(self.dstore, 'data', maxbytes=100)
+        vlen = hdf5.Appender(self.dstore, 'vlen', maxbytes=100)
+        for i in range(20):
+            data.append(numpy.arange(i, dtype=numpy.uint32))
+            vlen.append([numpy.ones(i % 3, numpy.float32)] * 2)
+        self.assertEqual(len(data), 190)
+        self.assertGreaterEqual(len(self.dstore['data']), data.length)
+        data.close()
+        vlen.close()
+        numpy.testing.assert_equal(
+            self.dstore['data'][()],
+            numpy.concatenate([numpy.arange(i) for i in range(20)]))
+        self.assertEqual([len(arr) for arr in self.dstore['vlen'][-4:]],
+                         [0, 0, 1, 1])
+
+    def test_budget(self):
+        # the appenders sharing a budget are flushed together
+        budget = hdf5.Budget(maxbytes=100)
+        apps = []
+        for name in ('a', 'b'):
+            self.dstore.create_dset(name, numpy.uint32)
+            apps.append(hdf5.Appender(self.dstore, name, budget=budget))
+        apps[0].append(numpy.arange(10, dtype=numpy.uint32))  # 40 bytes
+        apps[1].append(numpy.arange(10, dtype=numpy.uint32))  # 80 bytes
+        self.assertEqual([app.length for app in apps], [0, 0])
+        apps[1].append(numpy.arange(5, dtype=numpy.uint32))  # 100 bytes
+        self.assertEqual([app.length for app in apps], [10, 15])
+        self.assertEqual(budget.nbytes, 0)
+        apps[0].append(numpy.arange(3, dtype=numpy.uint32))
+        apps[0].close()  # flushing one appender releases its bytes
+        self.assertEqual(budget.nbytes, 0)
+        apps[1].close()
+        self.assertEqual(len(self.dstore['a']), 13)
+        self.assertEqual(len(self.dstore['b']), 15)
+
+    def test_layouts(self):
+        hdf5.set_layouts({'data': 'gzip1,shuffle,chunk=100', 'arr': 'lzf'})
+        try:
+            dset = self.dstore.create_dset('data', numpy.float32)
+            self.dstore['arr'] = numpy.ones((10, 3))
+            self.dstore['other'] = numpy.ones((10, 3))
+        finally:
+            hdf5.set_layouts()
+        self.assertEqual(dset.chunks, (100,))
+        self.assertEqual(dset.compression, 'gzip')
+        self.assertTrue(dset.shuffle)
+        self.assertEqual(self.dstore['arr'].compression, 'lzf')
+        self.assertIsNone(self.dstore['other'].chunks)  # contiguous
+        with self.assertRaises(ValueError):
+            hdf5.parse_layout('gzip,chunk=0')
+
+    def test_empty_layouts(self):
+        # empty datasets cannot be chunked nor compressed
+        hdf5.set_layouts({'empty.*': 'gzip1,shuffle,chunk=100'})
+        try:
+            self.dstore['empty'] = numpy.zeros(
+                0, [('eid', numpy.uint32), ('x', numpy.float32)])
+            self.dstore.create_dset('empty2d', numpy.float32, (0, 3))
+            self.dstore.create_dset('empty_ext', numpy.float32, (None, 0))
+        finally:
+            hdf5.set_layouts()
+        for name in ('empty', 'empty2d', 'empty_ext'):
+            self.assertIsNone(self.dstore[name].compression)
+            self.assertEqual(self.dstore[name].size, 0)
+        self.assertIsNone(self.dstore['empty'].chunks)
+
+    def test_array_wrapper_writeable(self):
+        # ArrayWrapper.from_ reads the dataset, it does not memory-map it
+        self.dstore['arr'] = numpy.arange(10.)
+        aw = hdf5.ArrayWrapper.from_(self.dstore['arr'])
+        self.assertNotIsInstance(aw.array, numpy.memmap)
+        aw.array[0] = 1.  # it can be modified in place
+
+    def test_read_csv(self):
+        fname = os.path.join(tempfile.mkdtemp(), 'data.csv')
+        with open(fname, 'w') as f:
+            f.write('#,,"investigation_time=50.0"\n'
+                    'site_id,event_id,name,gmv_PGA\n')
+            for i in range(10):
+                f.write('%d,%d,"a,%d",%s\n' % (i % 3, i, i * 10, i / 10))
+        dtypedict = {'site_id': numpy.uint32, 'name': hdf5.vstr,
+                     None: numpy.float32}
+        renamedict = dict(site_id='sid', event_id='eid')
+        aw = hdf5.read_csv(fname, dtypedict, renamedict)
+        self.assertEqual(aw.investigation_time, 50.)
+        self.assertEqual(aw.array.dtype.names, ('sid', 'eid', 'name',
+                                                'gmv_PGA'))
+        self.assertEqual(aw.array['name'][-1], 'a,90')
+        aws = list(hdf5.read_csv(fname, dtypedict, renamedict, chunksize=4))
+        self.assertEqual([len(aw.array) for aw in aws], [4, 4, 2])
+        self.assertEqual(aws[-1].investigation_time, 50.)
+        numpy.testing.assert_equal(
+            numpy.concatenate([aw.array for aw in aws]), aw.array)
+
+        # the byte fields are checked and the line is reported
+        with self.assertRaises(InvalidFile) as ctx:
+            list(hdf5.read_csv(fname, {'name': (numpy.string_, 3),
+                                       None: float}, chunksize=4))
+        self.assertIn("line 4: name='a,10' has length 4 > 3",
+                      str(ctx.exception))
+
     def test_export_path(self):
         path = self.dstore.export_path('hello.txt', tempfile.mkdtemp())
         mo = re.search(r'hello_\d+', path)
@@ -25,7 +25,7 @@ from operator import attrgetter
 from collections import namedtuple
 from openquake.baselib.general import (
     block_splitter, split_in_blocks, assert_close,
-    deprecated, DeprecationWarning, cached_property)
+    deprecated, DeprecationWarning, cached_property, LRUCache)
 
 
 class BlockSplitterTestCase(unittest.TestCase):
@@ -192,3 +192,18 @@ class CachedPropertyTestCase(unittest.TestCase):
         self.__dict__['one'] = 2
         self.assertEqual(self.one, 2)
         self.assertEqual(self.ncalls, 1)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test(self):
+        cache = LRUCache(maxbytes=10)
+        cache[1, 'hcurves'] = b'1234'
+        cache[2, 'hcurves'] = b'5678'
+        cache[2, 'hmaps'] = b'too large value'  # not stored
+        self.assertEqual(sorted(cache), [(1, 'hcurves'), (2, 'hcurves')])
+        cache[1, 'hcurves'] = b'12'  # replace
+        self.assertEqual(cache.nbytes, 6)
+        self.assertEqual(cache.discard(lambda key: key[0] == 1), 1)
+        self.assertEqual(list(cache), [(2, 'hcurves')])
+        self.assertEqual(cache.nbytes, 4)
@@ -17,11 +17,13 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import pickle
 import unittest.mock as mock
 import time
 import shutil
 import unittest
 import itertools
+import collections
 import tempfile
 import numpy
 from openquake.baselib import parallel, general, hdf5, workerpool, performance
@@ -168,6 +170,158 @@ class ThreadPoolTestCase(unittest.TestCase):
                 parallel.Starmap.shutdown()
 
 
+@unittest.skipIf(parallel.shared_memory is None, 'requires Python >= 3.8')
+class SharedMemoryTestCase(unittest.TestCase):
+    def test_roundtrip(self):
+        big = numpy.arange(1000, dtype=numpy.float64)
+        small = numpy.arange(10)
+        pik = parallel.Pickled({'big': big, 'small': small}, 1000)
+        self.assertEqual(len(pik.blocks), 1)  # only the big array
+        name, nbytes = pik.blocks[0]
+        self.assertEqual(nbytes, 8000)
+        self.assertGreater(len(pik), 8000)
+        dic = pik.unpickle()
+        numpy.testing.assert_equal(dic['big'], big)
+        numpy.testing.assert_equal(dic['small'], small)
+        # the block has been freed by the receiver
+        with self.assertRaises(FileNotFoundError):
+            parallel.shared_memory.SharedMemory(name)
+
+    def test_free(self):
+        pik = parallel.Pickled(numpy.zeros(1000), 1000)
+        [(name, nbytes)] = pik.blocks
+        pik.free()
+        self.assertEqual(pik.blocks, [])
+        with self.assertRaises(FileNotFoundError):
+            parallel.shared_memory.SharedMemory(name)
+
+    def test_free_blocks(self):
+        # the blocks not read are freed, the already freed ones are ignored
+        read = parallel.Pickled(numpy.zeros(1000), 1000)
+        unread = parallel.Pickled(numpy.ones(1000), 1000)
+        names = [name for pik in (read, unread) for name, _ in pik.blocks]
+        read.unpickle()
+        parallel.free_blocks(names)
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                parallel.shared_memory.SharedMemory(name)
+
+
+class SharedTestCase(unittest.TestCase):
+    def test_broadcast(self):
+        tmpdir = tempfile.mkdtemp()
+        with hdf5.File(os.path.join(tmpdir, 'calc_42.hdf5'), 'w') as h5:
+            smap = parallel.Starmap(get_length, distribute='no', h5=h5)
+            obj = {'a': numpy.arange(1000)}
+            smap.share(obj)
+        [ref] = parallel.pickle_sequence([obj])
+        self.assertIsInstance(ref, parallel.Shared)
+        self.assertLess(len(ref), len(parallel.Pickled(obj)) / 10)
+        self.assertIs(ref.unpickle(), obj)  # in the master cache
+        with open(ref.path, 'rb') as f:
+            numpy.testing.assert_equal(pickle.load(f)['a'], obj['a'])
+
+        # in the workers the object is read once and then cached
+        with mock.patch.dict(parallel._shared, {}, clear=True):
+            copy = ref.unpickle()
+            self.assertIs(ref.unpickle(), copy)
+            # a subtask argument is sent again as a reference
+            self.assertIs(parallel.pickle_sequence([copy])[0], ref)
+            # a task of another calculation evicts the object
+            parallel.evict_shared(43)
+            self.assertEqual(parallel._shared, {})
+            self.assertIsInstance(
+                parallel.pickle_sequence([copy])[0], parallel.Pickled)
+        # the reference keeps the object alive, so its id is not reused
+        self.assertIs(parallel._shared_ref[id(obj)][0], obj)
+
+        parallel.Starmap.evict(42)
+        self.assertFalse(os.path.exists(ref.path))
+        [pik] = parallel.pickle_sequence([obj])
+        self.assertIsInstance(pik, parallel.Pickled)
+        shutil.rmtree(tmpdir)
+
+
+class AdaptiveTestCase(unittest.TestCase):
+    def test_split_and_merge(self):
+        smap = parallel.Starmap(get_length, distribute='no')
+        smap.adapt(weight=len)
+        for n in (10, 10, 10):  # 10 elements per second
+            smap.timer.observe(['x'] * n, 1.)
+            smap.predictions.append(smap.timer.predict(['x'] * n))
+        self.assertAlmostEqual(smap.timer.predict(['a'] * 50), 5.)
+
+        # a task 5 times slower than the median is split in 5 tasks
+        smap.task_queue = []
+        func, args = smap._adapt(get_length, (['a'] * 50,))
+        self.assertEqual(len(args[0]), 10)
+        self.assertEqual(len(smap.task_queue), 4)
+
+        # tiny tasks with the same arguments are merged
+        smap.task_queue = [(get_length, (['b'],))] * 3
+        func, args = smap._adapt(get_length, (['b'],))
+        self.assertEqual(len(args[0]), 4)
+        self.assertEqual(smap.task_queue, [])
+
+    def test_threshold(self):
+        # the timer is fed with the element durations, so the threshold
+        # is given by its predictions and not by the task durations
+        smap = parallel.Starmap(get_length, distribute='no')
+        smap.adapt(weight=len, observe_tasks=False)
+        smap.timer.observe(['x'] * 10, 1.)
+        for task_no in range(3):
+            smap.wvec[task_no] = smap.timer.weights(['x'] * 10)
+            mon = performance.Monitor()
+            mon.task_no, mon.duration = task_no, 7.  # with the overhead
+            smap._observe(mon)
+        numpy.testing.assert_allclose(smap.predictions, [1., 1., 1.])
+
+
+class LineageTestCase(unittest.TestCase):
+    def test_track(self):
+        # the subtasks spawned by a supertask are tracked to its root
+        allargs = [('aaaaeeeeiii',), ('u',), ('aaaaaaaaeeeeiii',)]
+        parallel.Starmap.init()
+        try:
+            smap = parallel.Starmap(supertask)
+            smap.task_queue = [(supertask, args) for args in allargs]
+            smap.track(done={1})  # skip the second task
+            n_by_root = collections.Counter()
+            for res in smap._loop():
+                if res.msg != 'TASK_ENDED':
+                    n_by_root[smap.root] += res.get().get('n', 0)
+        finally:
+            parallel.Starmap.shutdown()
+        self.assertEqual(n_by_root, {0: 11, 2: 15})
+        self.assertEqual(sorted(smap.done_roots), [0, 2])
+        self.assertEqual(smap.todo_by_root, {})
+
+
+def slow_first(n, monitor):
+    # the first attempt of task 0 is very slow
+    if n == 0 and getattr(monitor, 'attempt', 0) == 0:
+        time.sleep(5)
+    return {'n': n}
+
+
+class SpeculationTestCase(unittest.TestCase):
+    def test(self):
+        parallel.Starmap.init(poolsize=4, distribute='threadpool')
+        try:
+            smap = parallel.Starmap(
+                slow_first, [(n,) for n in range(6)],
+                distribute='threadpool', num_cores=4)
+            smap.speculation = 3
+            smap.task_queue = [(slow_first, args) for args in smap.task_args]
+            t0 = time.time()
+            res = [r.get() for r in smap._loop() if r.msg != 'TASK_ENDED']
+            self.assertLess(time.time() - t0, 5)
+        finally:
+            parallel.Starmap.shutdown()
+        self.assertEqual(sorted(r['n'] for r in res), list(range(6)))
+        self.assertEqual(smap.speculated, {0})
+
+
 def sum_chunk(slc, hdf5path):
     with hdf5.File(hdf5path, 'r') as f:
         return f['array'][slc].sum()
@@ -19,7 +19,13 @@ import time
 import unittest
 import pickle
 import numpy
-from openquake.baselib.performance import Monitor
+from openquake.baselib.performance import Monitor, StackSampler
+
+
+def busy_loop(seconds):
+    t0 = time.time()
+    while time.time() - t0 < seconds:
+        pass
 
 
 class MonitorTestCase(unittest.TestCase):
@@ -58,5 +64,30 @@ class MonitorTestCase(unittest.TestCase):
         total_time = data['time_sec'].sum()
         self.assertGreaterEqual(total_time, 0.3)
 
+    def test_timeline(self):
+        mon = Monitor('timeline')
+        child = mon('child')
+        for i in range(3):
+            with child:
+                pass
+        child.max_spans = 3  # the next intervals are discarded
+        with child:
+            pass
+        timeline = child.get_timeline()
+        self.assertEqual(len(timeline), 3)
+        self.assertEqual(set(timeline['operation']), {b'child'})
+        self.assertTrue((timeline['stop'] >= timeline['start']).all())
+        self.assertEqual(child.new('other').spans, [])  # not shared
+        child.reset()
+        self.assertEqual(len(child.get_timeline()), 0)
+
+    def test_sampler(self):
+        sampler = StackSampler(interval=.001).start()
+        busy_loop(.1)
+        stacks = sampler.stop()
+        self.assertGreater(sum(stacks.values()), 0)
+        for stack in stacks:  # the stacks start from the calling frame
+            self.assertTrue(stack.startswith('busy_loop ('), stack)
+
     def test_pickleable(self):
         pickle.loads(pickle.dumps(self.mon))
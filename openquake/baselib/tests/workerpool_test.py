@@ -18,9 +18,9 @@
 
 import time
 import unittest
-from openquake.baselib import config
-from openquake.baselib.workerpool import WorkerMaster
-from openquake.baselib.parallel import Starmap
+from openquake.baselib import config, zeromq as z, __version__
+from openquake.baselib.workerpool import WorkerMaster, Dispatcher
+from openquake.baselib.parallel import Starmap, Monitor
 from openquake.baselib.general import socket_ready
 
 
@@ -53,3 +53,94 @@ class WorkerPoolTestCase(unittest.TestCase):
     def tearDownClass(cls):
         cls.master.stop()
         config.zworkers = cls.z
+
+
+class FakeMaster(WorkerMaster):
+    def __init__(self, loads):
+        self.loads = loads
+
+    def load(self):
+        return self.loads.items()
+
+
+GB = 1024 ** 3
+
+
+class DispatcherTestCase(unittest.TestCase):
+    def test_best_host(self):
+        loads = {'a': dict(free_mem=8 * GB, total_mem=16 * GB, load=.9,
+                           num_workers=2, running=0, task_port=0),
+                 'b': dict(free_mem=6 * GB, total_mem=16 * GB, load=.1,
+                           num_workers=2, running=0, task_port=0)}
+        dispatcher = Dispatcher(FakeMaster(loads))
+        dispatcher.update()
+        # b has less free memory but a much lower load
+        self.assertEqual(dispatcher.best_host(GB), 'b')
+        # only a can take a task of 5 GB without going over the limit
+        self.assertEqual(dispatcher.best_host(5 * GB), 'a')
+        # no host can take a task of 20 GB, but nothing is running
+        self.assertEqual(dispatcher.best_host(20 * GB), 'a')
+        dispatcher.inflight['a'].append(GB)
+        self.assertIsNone(dispatcher.best_host(20 * GB))  # held back
+        # no free cores on b
+        dispatcher.inflight['b'].extend([GB, GB])
+        self.assertEqual(dispatcher.best_host(GB), 'a')
+
+    def test_done(self):
+        # a task resubmitted by the speculation runs on two hosts; the
+        # copy which ends frees the resources of its own host
+        loads = {'a': dict(free_mem=8 * GB, total_mem=16 * GB, load=.1,
+                           num_workers=2, running=0, task_port=0),
+                 'b': dict(free_mem=8 * GB, total_mem=16 * GB, load=.1,
+                           num_workers=2, running=0, task_port=0)}
+        dispatcher = Dispatcher(FakeMaster(loads))
+        dispatcher.inflight['a'].append(GB)
+        dispatcher.inflight['b'].append(2 * GB)
+        dispatcher.sent[0] = [('a', GB), ('b', 2 * GB)]
+        dispatcher.done(0, 'a')
+        self.assertEqual(dispatcher.inflight['a'], [])
+        self.assertEqual(dispatcher.inflight['b'], [2 * GB])
+        self.assertEqual(dispatcher.sent[0], [('b', 2 * GB)])
+        dispatcher.done(0, 'b')
+        self.assertEqual(dispatcher.inflight['b'], [])
+        self.assertNotIn(0, dispatcher.sent)
+
+
+class BalancedDispatchTestCase(unittest.TestCase):
+    # two local workerpools receiving tasks from a Dispatcher
+    @classmethod
+    def setUpClass(cls):
+        port = int(config.zworkers.ctrl_port) + 20
+        host_cores = '127.0.0.1:%d 1,127.0.0.1:%d 1' % (port, port + 1)
+        cls.master = WorkerMaster(port, host_cores, balanced_dispatch=True)
+        cls.master.start()
+        cls.master.wait()
+
+    def test(self):
+        dispatcher = Dispatcher(self.master)
+        mon = Monitor('double')
+        mon.inject = False
+        mon.version = __version__
+        with z.Socket('tcp://127.0.0.1:%s' % config.dbserver.receiver_ports,
+                      z.zmq.PULL, 'bind') as sock:
+            mon.backurl = 'tcp://127.0.0.1:%d' % sock.port
+            for i in range(6):
+                dispatcher.send((double, (i,), i, mon))
+            self.assertEqual(len(dispatcher.held), 4)  # 1 task per pool
+            hosts = set(host for lst in dispatcher.sent.values()
+                        for host, mem in lst)
+            self.assertEqual(len(hosts), 2)  # both pools were used
+            results = []
+            for res in sock:
+                if res.msg == 'TASK_ENDED':
+                    dispatcher.done(res.mon.task_no, res.mon.host)
+                    if len(results) == 6:
+                        break
+                else:
+                    results.append(res.get())
+        dispatcher.close()
+        self.assertEqual(sorted(results), [0, 2, 4, 6, 8, 10])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.master.stop()
@@ -1,11 +1,14 @@
 import os
+import copy
 import sys
 import time
 import signal
 import shutil
 import logging
 import tempfile
+import threading
 import subprocess
+import collections
 import multiprocessing
 import psutil
 from openquake.baselib import (
@@ -33,6 +36,24 @@ def _streamer():
         pass  # killed cleanly by SIGINT/SIGTERM
 
 
+def _router(frontend, backend):
+    # router for a workerpool receiving the tasks directly from the master
+    try:
+        z.zmq.proxy(frontend, backend)
+    except (KeyboardInterrupt, z.zmq.ContextTerminated):
+        pass
+
+
+def get_load():
+    """
+    :returns: the load of the current machine (1-minute average per core)
+    """
+    try:
+        return os.getloadavg()[0] / psutil.cpu_count()
+    except (AttributeError, OSError):  # not available on Windows
+        return 0.
+
+
 def check_status(**kw):
     """
     :returns: a non-empty error string if the streamer or worker pools are down
@@ -41,7 +62,9 @@ def check_status(**kw):
     c.update(kw)
     hostport = config.dbserver.listen, int(c['ctrl_port']) + 1
     errors = []
-    if not general.socket_ready(hostport):
+    if c.get('balanced_dispatch'):
+        pass  # the tasks are sent directly to the workerpools
+    elif not general.socket_ready(hostport):
         errors.append('The task streamer on %s:%s is down' % hostport)
     for host, status in WorkerMaster(**c).status():
         if status != 'running':
@@ -52,13 +75,20 @@ def check_status(**kw):
 class WorkerMaster(object):
     """
     :param ctrl_port: port on which the worker pools listen
-    :param host_cores: names of the remote hosts and number of cores to use
+    :param host_cores:
+        names of the remote hosts and number of cores to use; a host can be
+        given as host:port to run several worker pools on the same machine
     :param remote_python: path of the Python executable on the remote hosts
+    :param balanced_dispatch:
+        if true, the worker pools receive the tasks directly from the master
+        (see :class:`Dispatcher`) and not from the streamer
     """
     def __init__(self, ctrl_port=config.zworkers.ctrl_port, host_cores=None,
-                 remote_python=None, receiver_ports=None):
+                 remote_python=None, receiver_ports=None,
+                 balanced_dispatch=False):
         # NB: receiver_ports is not used but needed for compliance
         self.ctrl_port = int(ctrl_port)
+        self.balanced_dispatch = balanced_dispatch
         self.host_cores = ([hc.split() for hc in host_cores.split(',')]
                            if host_cores else [])
         for host, cores in self.host_cores:
@@ -68,6 +98,21 @@ class WorkerMaster(object):
         self.remote_python = remote_python or sys.executable
         self.popens = []
 
+    def hostport(self, host):
+        """
+        :returns: the pair (hostname, control port) for the given host
+        """
+        if ':' in host:
+            name, port = host.rsplit(':', 1)
+            return name, int(port)
+        return host, self.ctrl_port
+
+    def ctrl_url(self, host):
+        """
+        :returns: the URL of the control socket of the given host
+        """
+        return 'tcp://%s:%s' % self.hostport(host)
+
     def wait(self, seconds=30):
         """
         Wait until all workerpools start
@@ -91,7 +136,7 @@ class WorkerMaster(object):
             host_cores = [hc for hc in self.host_cores if hc[0] == host]
         lst = []
         for host, _ in host_cores:
-            ready = general.socket_ready((host, self.ctrl_port))
+            ready = general.socket_ready(self.hostport(host))
             lst.append((host, 'running' if ready else 'not-running'))
         return lst
 
@@ -103,16 +148,19 @@ class WorkerMaster(object):
         starting = []
         for host, cores in self.host_cores:
             if self.status(host)[0][1] == 'running':
-                print('%s:%s already running' % (host, self.ctrl_port))
+                print('%s:%s already running' % self.hostport(host))
                 continue
-            ctrl_url = 'tcp://%s:%s' % (host, self.ctrl_port)
-            if host == '127.0.0.1':  # localhost
+            ctrl_url = self.ctrl_url(host)
+            name = self.hostport(host)[0]
+            if name == '127.0.0.1':  # localhost
                 args = [sys.executable]
             else:
-                args = ['ssh', host, self.remote_python]
+                args = ['ssh', name, self.remote_python]
             args += ['-m', 'openquake.baselib.workerpool', ctrl_url,
                      '-n', cores]
-            if host != '127.0.0.1':
+            if self.balanced_dispatch:
+                args.append('--balanced')
+            if name != '127.0.0.1':
                 logging.warning(
                     '%s: if it hangs, check the ssh keys', ' '.join(args))
             self.popens.append(subprocess.Popen(args))
@@ -128,7 +176,7 @@ class WorkerMaster(object):
             if self.status(host)[0][1] == 'not-running':
                 print('%s not running' % host)
                 continue
-            ctrl_url = 'tcp://%s:%s' % (host, self.ctrl_port)
+            ctrl_url = self.ctrl_url(host)
             with z.Socket(ctrl_url, z.zmq.REQ, 'connect') as sock:
                 sock.send('stop')
                 stopped.append(host)
@@ -151,7 +199,7 @@ class WorkerMaster(object):
             if self.status(host)[0][1] == 'not-running':
                 print('%s not running' % host)
                 continue
-            ctrl_url = 'tcp://%s:%s' % (host, self.ctrl_port)
+            ctrl_url = self.ctrl_url(host)
             with z.Socket(ctrl_url, z.zmq.REQ, 'connect') as sock:
                 sock.send('kill')
                 killed.append(host)
@@ -166,12 +214,25 @@ class WorkerMaster(object):
             if self.status(host)[0][1] == 'not-running':
                 print('%s not running' % host)
                 continue
-            ctrl_url = 'tcp://%s:%s' % (host, self.ctrl_port)
+            ctrl_url = self.ctrl_url(host)
             with z.Socket(ctrl_url, z.zmq.REQ, 'connect') as sock:
                 tasks = sock.send('get_executing')
                 executing.append((host, tasks))
         return executing
 
+    def load(self):
+        """
+        :returns: a list of pairs (host, load dictionary) for the running
+                  worker pools
+        """
+        loads = []
+        for host, _ in self.host_cores:
+            if self.status(host)[0][1] == 'not-running':
+                continue
+            with z.Socket(self.ctrl_url(host), z.zmq.REQ, 'connect') as sock:
+                loads.append((host, sock.send('get_load')))
+        return loads
+
     def restart(self):
         """
         Stop and start again
@@ -181,6 +242,125 @@ class WorkerMaster(object):
         return 'restarted'
 
 
+class Dispatcher(object):
+    """
+    Send the tasks directly to the worker pools, choosing each time the
+    pool best able to take the task, i.e. the one with a free core and
+    the most free memory after subtracting the estimated footprint of
+    the task, penalized by the load of the machine. Tasks that no pool
+    can take without going over the soft memory limit are held back
+    until a task ends or the memory is freed; if nothing is running
+    they are sent anyway, to the pool with the most free memory.
+
+    :param master: a :class:`WorkerMaster` instance
+    :param refresh: minimum number of seconds between two load requests
+    """
+    def __init__(self, master, refresh=1.):
+        self.master = master
+        self.refresh = refresh
+        self.reserve = 1 - config.memory.soft_mem_limit / 100
+        self.loads = {}  # host -> dictionary sent by the worker pool
+        self.last = 0  # time of the last refresh
+        self.held = collections.deque()  # pairs (message, memory)
+        self.inflight = collections.defaultdict(list)  # host -> memories
+        self.sent = {}  # task_no -> list of pairs (host, memory)
+        self.new = collections.Counter()  # host -> memory sent since refresh
+        self.senders = {}  # host -> PUSH socket
+
+    def update(self):
+        """
+        Ask the worker pools for their load
+        """
+        self.loads = dict(self.master.load())
+        self.new.clear()
+        self.last = time.time()
+
+    def best_host(self, mem):
+        """
+        :param mem: the estimated memory required by a task, in bytes
+        :returns: the host to send the task to, or None
+        """
+        candidates = []
+        for host, load in self.loads.items():
+            if len(self.inflight[host]) >= load['num_workers']:
+                continue
+            free = load['free_mem'] - self.new[host] - mem
+            if free >= load['total_mem'] * self.reserve:
+                score = free / load['total_mem'] - load['load']
+                candidates.append((score, host))
+        if candidates:
+            return max(candidates)[1]
+        elif self.loads and not any(self.inflight.values()):
+            # nothing is running: better to swap than to wait forever
+            return max(self.loads, key=lambda h: self.loads[h]['free_mem'])
+
+    def send(self, msg, mem=0):
+        """
+        Send a task message, or hold it back
+
+        :param msg: a tuple (func, args, task_no, monitor)
+        :param mem: the estimated memory required by the task, in bytes
+        """
+        self.held.append((msg, mem))
+        self.flush()
+
+    def flush(self):
+        """
+        Send the tasks held back, if possible
+
+        :returns: the number of tasks still held back
+        """
+        if time.time() - self.last > self.refresh:
+            self.update()
+        while self.held:
+            msg, mem = self.held[0]
+            host = self.best_host(mem)
+            if host is None:
+                break
+            self.held.popleft()
+            # the host is sent back in the monitor of the TASK_ENDED result
+            func, args, task_no, mon = msg
+            mon = copy.copy(mon)
+            mon.host = host
+            msg = func, args, task_no, mon
+            if host not in self.senders:
+                url = 'tcp://%s:%d' % (self.master.hostport(host)[0],
+                                       self.loads[host]['task_port'])
+                self.senders[host] = z.Socket(
+                    url, z.zmq.PUSH, 'connect').__enter__()
+            self.senders[host].send(msg)
+            self.inflight[host].append(mem)
+            self.sent.setdefault(msg[2], []).append((host, mem))
+            self.new[host] += mem
+        return len(self.held)
+
+    def done(self, task_no, host):
+        """
+        Free the resources of the given task and send the tasks held back
+
+        :param task_no: the number of the task which ended
+        :param host: the host where the task was executed
+        """
+        sent = self.sent.get(task_no, [])
+        for i, (h, mem) in enumerate(sent):
+            # a task resubmitted by the speculation has a copy per host
+            if h == host:
+                del sent[i]
+                self.inflight[host].remove(mem)
+                break
+        if not sent:
+            self.sent.pop(task_no, None)
+        self.flush()
+
+    def close(self):
+        """
+        Close the sockets
+        """
+        for sock in self.senders.values():
+            sock.__exit__(None, None, None)
+        self.senders.clear()
+
+
 def worker(sock, executing):
     """
     :param sock: a zeromq.Socket of kind PULL
@@ -202,9 +382,11 @@ class WorkerPool(object):
 
     :param ctrl_url: zmq address of the control socket
     :param num_workers: the number of workers (or -1)
+    :param balanced: if true, receive the tasks from a :class:`Dispatcher`
     """
-    def __init__(self, ctrl_url, num_workers=-1):
+    def __init__(self, ctrl_url, num_workers=-1, balanced=False):
         self.ctrl_url = ctrl_url
+        self.balanced = balanced
         self.task_server_url = 'tcp://%s:%s' % (
             config.dbserver.host, int(config.zworkers.ctrl_port) + 1)
         if num_workers == -1:
@@ -224,6 +406,9 @@ class WorkerPool(object):
         title = 'oq-zworkerpool %s' % self.ctrl_url[6:]  # strip tcp://
         print('Starting ' + title, file=sys.stderr)
         setproctitle(title)
+        if self.balanced:
+            # the workers read the tasks from a local router
+            self.task_server_url = 'ipc://%s.tasks' % self.executing
         # start workers
         self.workers = []
         for _ in range(self.num_workers):
@@ -233,6 +418,14 @@ class WorkerPool(object):
             proc.start()
             sock.pid = proc.pid
             self.workers.append(sock)
+        if self.balanced:
+            # NB: the zmq sockets must be created after forking the workers
+            # receive the tasks on a random port, reported by get_load
+            frontend = z.context.socket(z.zmq.PULL)
+            self.task_port = frontend.bind_to_random_port('tcp://0.0.0.0')
+            backend = z.bind(self.task_server_url, z.zmq.PUSH)
+            threading.Thread(target=_router, args=(frontend, backend),
+                             daemon=True).start()
 
         # start control loop accepting the commands stop and kill
         with z.Socket(self.ctrl_url, z.zmq.REP, 'bind') as ctrlsock:
@@ -247,7 +440,21 @@ class WorkerPool(object):
                     ctrlsock.send(self.num_workers)
                 elif cmd == 'get_executing':
                     ctrlsock.send(' '.join(sorted(os.listdir(self.executing))))
+                elif cmd == 'get_load':
+                    ctrlsock.send(self.get_load())
         shutil.rmtree(self.executing)
+        if self.balanced and os.path.exists(self.executing + '.tasks'):
+            os.remove(self.executing + '.tasks')
+
+    def get_load(self):
+        """
+        :returns: a dictionary with free memory, load and running tasks
+        """
+        mem = psutil.virtual_memory()
+        return dict(free_mem=mem.available, total_mem=mem.total,
+                    load=get_load(), num_workers=self.num_workers,
+                    running=len(os.listdir(self.executing)),
+                    task_port=getattr(self, 'task_port', None))
 
     def stop(self):
         """
@@ -267,13 +474,15 @@ class WorkerPool(object):
 
 
 @sap.Script
-def workerpool(worker_url='tcp://0.0.0.0:1909', num_workers=-1):
+def workerpool(worker_url='tcp://0.0.0.0:1909', num_workers=-1,
+               balanced=False):
     # start a workerpool without a streamer
-    WorkerPool(worker_url, num_workers).start()
+    WorkerPool(worker_url, num_workers, balanced).start()
 
 
 workerpool.arg('worker_url', 'ZMQ address (tcp:///w.x.y.z:port) of the worker')
 workerpool.opt('num_workers', 'number of cores to use', type=int)
+workerpool.flg('balanced', 'receive the tasks directly from the master')
 
 if __name__ == '__main__':
     workerpool.callfunc()
@@ -19,6 +19,7 @@ import os
 import sys
 import abc
 import pdb
+import time
 import logging
 import operator
 import itertools
@@ -31,7 +32,7 @@ from openquake.baselib import (
     general, hdf5, datastore, __version__ as engine_version)
 from openquake.baselib import parallel
 from openquake.baselib.performance import Monitor, init_performance
-from openquake.hazardlib import InvalidFile, site
+from openquake.hazardlib import InvalidFile, site, probability_map
 from openquake.hazardlib.site_amplification import Amplifier
 from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.hazardlib.source import rupture
@@ -53,6 +54,7 @@ U32 = numpy.uint32
 F32 = numpy.float32
 TWO16 = 2 ** 16
 TWO32 = 2 ** 32
+CHUNKSIZE = 100000  # rows read at once from the imported CSV files
 
 stats_dt = numpy.dtype([('mean', F32), ('std', F32),
                         ('min', F32), ('max', F32), ('len', U16)])
@@ -114,6 +116,9 @@ def fix_ones(pmap):
     Here we solve the issue by replacing the unphysical probabilities 1
     with .9999999999999999 (the float64 closest to 1).
     """
+    if isinstance(pmap, probability_map.DenseProbabilityMap):
+        pmap.array[pmap.array == 1.] = .9999999999999999
+        return pmap
     for sid in pmap:
         array = pmap[sid].array
         array[array == 1.] = .9999999999999999
@@ -148,6 +153,111 @@ To avoid that, set a proper `region_grid_spacing` so that your exposure
 takes less sites.''' % MAXSITES
 
 
+def checkpoint_path(calc_id, datadir=None):
+    """
+    :returns: the path of the checkpoint file of the given calculation
+    """
+    return os.path.join(datadir or datastore.get_datadir(),
+                        'calc_%d_ckp.hdf5' % calc_id)
+
+
+class Checkpoint(object):
+    """
+    Aggregation function periodically saving the state of a reduction in
+    the file calc_XXX_ckp.hdf5 next to the datastore, so that an interrupted
+    calculation can be resumed with `oq resume`. The outputs of a task
+    (and of its subtasks) are buffered and aggregated only when the task
+    is completed, therefore the saved accumulator contains the contributions
+    of the completed tasks and nothing else.
+
+    :param calc:
+        a calculator with methods .save_checkpoint(h5, acc) and
+        .load_checkpoint(h5, acc)
+    :param smap: a Starmap with a task queue, not yet started
+    :param agg: the underlying aggregation function
+    """
+    def __init__(self, calc, smap, agg):
+        self.calc = calc
+        self.smap = smap
+        self.agg = agg
+        self.done = []
+        self.num_tasks = len(smap.task_queue)
+        self.every = calc.oqparam.checkpoint_every
+        self.path = calc.datastore.filename[:-5] + '_ckp.hdf5'
+        self.partial = general.AccumDict(accum=[])  # root -> outputs
+        self.last = time.time()
+
+    def resume(self, acc):
+        """
+        Read the checkpoint of the calculation to resume, if any, and
+        start tracking the tasks of the Starmap, skipping the completed ones.
+
+        :param acc: the initial accumulator
+        :returns: the accumulator updated with the checkpoint
+        """
+        calc = self.calc
+        if calc.resume_id:
+            path = checkpoint_path(calc.resume_id, calc.datastore.datadir)
+            if not os.path.exists(path):
+                logging.warning('%s does not exist, starting from scratch',
+                                path)
+            else:
+                with hdf5.File(path, 'r') as h5:
+                    if h5.attrs['num_tasks'] != self.num_tasks:
+                        raise RuntimeError(
+                            'The checkpoint %s refers to %d tasks, but now '
+                            'there are %d tasks' % (
+                                path, h5.attrs['num_tasks'], self.num_tasks))
+                    self.done = h5['done'][()].tolist()
+                    acc = calc.load_checkpoint(h5, acc)
+                logging.info('Resuming from %s: %d/%d task(s) completed',
+                             path, len(self.done), self.num_tasks)
+        self.smap.track(set(self.done))
+        return acc
+
+    def __call__(self, acc, val):
+        self.partial[self.smap.root].append(val)
+        return self.flush(acc)
+
+    def flush(self, acc):
+        """
+        Aggregate the outputs of the completed tasks and save the
+        checkpoint if more than `checkpoint_every` seconds passed
+        """
+        if not self.smap.done_roots:
+            return acc
+        for root in self.smap.done_roots:
+            for val in self.partial.pop(root, []):
+                acc = self.agg(acc, val)
+            self.done.append(root)
+        del self.smap.done_roots[:]
+        if time.time() - self.last > self.every:
+            self.save(acc)
+        return acc
+
+    def save(self, acc):
+        """
+        Save the accumulator and the completed tasks in a temporary file
+        and then atomically replace the previous checkpoint
+        """
+        tmp = self.path[:-5] + '_tmp.hdf5'
+        with hdf5.File(tmp, 'w') as h5:
+            h5.attrs['num_tasks'] = self.num_tasks
+            h5['done'] = numpy.array(sorted(self.done), U32)
+            self.calc.save_checkpoint(h5, acc)
+        os.replace(tmp, self.path)
+        self.last = time.time()
+        logging.info('Saved a checkpoint with %d completed task(s)',
+                     len(self.done))
+
+    def remove(self):
+        """
+        Remove the checkpoint, when the calculation ends successfully
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
 class BaseCalculator(metaclass=abc.ABCMeta):
     """
     Abstract base class for all calculators.
@@ -160,8 +270,10 @@ class BaseCalculator(metaclass=abc.ABCMeta):
     accept_precalc = []
     from_engine = False  # set by engine.run_calc
     is_stochastic = False  # True for scenario and event based calculators
+    resume_id = None  # set by `oq resume`
 
     def __init__(self, oqparam, calc_id):
+        hdf5.set_layouts(oqparam.dataset_layouts)
         self.datastore = datastore.DataStore(calc_id)
         init_performance(self.datastore.hdf5)
         self._monitor = Monitor(
@@ -172,6 +284,9 @@ class BaseCalculator(metaclass=abc.ABCMeta):
         self.oqparam = oqparam
         if oqparam.num_cores:
             parallel.CT = oqparam.num_cores * 2
+        # reset at each calculation, so that a previous calculation in the
+        # same process cannot leave the profiler on
+        parallel.PROFILE = oqparam.profile_tasks or parallel.PROFILE_DEFAULT
 
     def monitor(self, operation='', **kw):
         """
@@ -260,6 +375,7 @@ class BaseCalculator(metaclass=abc.ABCMeta):
                 readinput.gmfs = None
                 readinput.eids = None
                 readinput.gsim_lt_cache.clear()
+                parallel.Starmap.evict(self.datastore.calc_id)
 
                 # remove temporary hdf5 file, if any
                 if os.path.exists(self.datastore.tempname) and remove:
@@ -835,17 +951,25 @@ class HazardCalculator(BaseCalculator):
     def store_source_info(self, calc_times):
         """
         Save (weight, num_sites, calc_time) inside the source_info dataset
+        and, if calc_times contains also the number of computed contexts,
+        the collapse ratio
         """
         if calc_times:
             source_info = self.datastore['source_info']
-            arr = numpy.zeros((len(source_info), 3), F32)
             # NB: the zip magic is needed for performance,
             # looping would be too slow
             ids, vals = zip(*calc_times.items())
+            vals = numpy.array(vals, F32)
+            arr = numpy.zeros((len(source_info), vals.shape[1]), F32)
             arr[numpy.array(ids)] = vals
             source_info['eff_ruptures'] += arr[:, 0]
             source_info['num_sites'] += arr[:, 1]
             source_info['calc_time'] += arr[:, 2]
+            if vals.shape[1] > 3:  # number of computed contexts
+                ratio = numpy.ones(len(arr), F32)
+                ok = arr[:, 3] > 0
+                ratio[ok] = arr[ok, 0] / arr[ok, 3]
+                source_info['collapse_ratio'] = ratio
 
     def post_process(self):
         """For compatibility with the engine"""
@@ -1046,36 +1170,48 @@ def import_gmfs(dstore, fname, sids):
     :param sids: the site IDs (complete)
     :returns: event_ids, num_rlzs
     """
-    array = hdf5.read_csv(fname, {'sid': U32, 'eid': U32, None: F32},
-                          renamedict=dict(site_id='sid', event_id='eid',
-                                          rlz_id='rlzi')).array
-    names = array.dtype.names
-    if names[0] == 'rlzi':  # backward compatbility
-        names = names[1:]  # discard the field rlzi
-    imts = [name[4:] for name in names[2:]]
     oq = dstore['oqparam']
-    missing = set(oq.imtls) - set(imts)
-    if missing:
-        raise ValueError('The calculation needs %s which is missing from %s' %
-                         (', '.join(missing), fname))
     imt2idx = {imt: i for i, imt in enumerate(oq.imtls)}
-    arr = numpy.zeros(len(array), oq.gmf_data_dt())
-    for name in names:
-        if name.startswith('gmv_'):
-            try:
-                m = imt2idx[name[4:]]
-            except KeyError:  # the file contains more than enough IMTs
-                pass
+    arrays = []
+    names = None
+    # the file is read in blocks, converting each block into gmf_data_dt
+    # so that the float32 fields are never kept in memory all together
+    for aw in hdf5.read_csv(fname, {'sid': U32, 'eid': U32, None: F32},
+                            renamedict=dict(site_id='sid', event_id='eid',
+                                            rlz_id='rlzi'),
+                            chunksize=CHUNKSIZE):
+        if not hasattr(aw, 'array'):  # empty block, i.e. only the header
+            continue
+        array = aw.array
+        if names is None:  # check the header only once
+            names = array.dtype.names
+            if names[0] == 'rlzi':  # backward compatbility
+                names = names[1:]  # discard the field rlzi
+            imts = [name[4:] for name in names[2:]]
+            missing = set(oq.imtls) - set(imts)
+            if missing:
+                raise ValueError('The calculation needs %s which is missing '
+                                 'from %s' % (', '.join(missing), fname))
+        arr = numpy.zeros(len(array), oq.gmf_data_dt())
+        for name in names:
+            if name.startswith('gmv_'):
+                try:
+                    m = imt2idx[name[4:]]
+                except KeyError:  # the file contains more than enough IMTs
+                    pass
+                else:
+                    arr['gmv'][:, m] = array[name]
             else:
-                arr['gmv'][:, m] = array[name]
-        else:
-            arr[name] = array[name]
-
-    n = len(numpy.unique(array[['sid', 'eid']]))
-    if n != len(array):
+                arr[name] = array[name]
+        arrays.append(arr)
+    if not arrays:
+        raise InvalidFile('%s: the file is empty' % fname)
+    arr = numpy.concatenate(arrays)
+    n = len(numpy.unique(arr[['sid', 'eid']]))
+    if n != len(arr):
         raise ValueError('Duplicated site_id, event_id in %s' % fname)
     # store the events
-    eids = numpy.unique(array['eid'])
+    eids = numpy.unique(arr['eid'])
     eids.sort()
     if eids[0] != 0:
         raise ValueError('The event_id must start from zero in %s' % fname)
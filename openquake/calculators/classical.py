@@ -22,12 +22,13 @@ import operator
 from datetime import datetime
 import numpy
 
-from openquake.baselib import parallel, hdf5
+from openquake.baselib import parallel, hdf5, config
 from openquake.baselib.general import AccumDict, block_splitter
 from openquake.hazardlib.contexts import ContextMaker
 from openquake.hazardlib.calc.filters import split_sources
 from openquake.hazardlib.calc.hazard_curve import classical
-from openquake.hazardlib.probability_map import ProbabilityMap
+from openquake.hazardlib.probability_map import (
+    ProbabilityMap, DenseProbabilityMap)
 from openquake.commonlib import calc, util, logs
 from openquake.commonlib.source_reader import random_filtered_sources
 from openquake.calculators import getters
@@ -98,7 +99,8 @@ def preclassical(srcs, srcfilter, gsims, params, monitor):
     """
     Split and prefilter the sources
     """
-    calc_times = AccumDict(accum=numpy.zeros(3, F32))  # nrups, nsites, time
+    # nrups, nsites, time, number of contexts
+    calc_times = AccumDict(accum=numpy.zeros(4, F32))
     pmap = AccumDict(accum=0)
     with monitor("splitting/filtering sources"):
         splits, _stime = split_sources(srcs)
@@ -109,7 +111,8 @@ def preclassical(srcs, srcfilter, gsims, params, monitor):
         if srcfilter.get_close_sites(src) is None:
             continue
         dt = time.time() - t0
-        calc_times[src.id] += F32([src.num_ruptures, src.nsites, dt])
+        calc_times[src.id] += F32(
+            [src.num_ruptures, src.nsites, dt, src.num_ruptures])
         for grp_id in src.grp_ids:
             pmap[grp_id] += 0
     return dict(pmap=pmap, calc_times=calc_times, rup_data={'grp_id': []},
@@ -124,6 +127,7 @@ class ClassicalCalculator(base.HazardCalculator):
     """
     core_task = classical_split_filter
     accept_precalc = ['classical']
+    timer = None  # used in adaptive mode
 
     def agg_dicts(self, acc, dic):
         """
@@ -142,8 +146,14 @@ class ClassicalCalculator(base.HazardCalculator):
         with self.monitor('aggregate curves'):
             extra = dic['extra']
             self.totrups += extra['totrups']
-            d = dic['calc_times']  # srcid -> eff_rups, eff_sites, dt
+            d = dic['calc_times']  # srcid -> eff_rups, eff_sites, dt, ctxs
             self.calc_times += d
+            if self.timer:  # feed the timer with the source durations
+                for srcid, (nrups, _, dt, _) in d.items():
+                    src = self.srcs_by_id[srcid]
+                    wvec = self.timer.weights([src]) * (
+                        nrups / src.num_ruptures)
+                    self.timer.observe((), dt, wvec)
             srcids = []
             eff_rups = 0
             eff_sites = 0
@@ -171,16 +181,12 @@ class ClassicalCalculator(base.HazardCalculator):
                         v = rup_data[k]
                     except KeyError:
                         v = default[vlen]
-                    if vlen:
-                        self.datastore.hdf5.save_vlen('rup/' + k, v)
-                    else:
-                        dset = self.datastore['rup/' + k]
-                        hdf5.extend(dset, v)
+                    self.appenders['rup/' + k].append(list(v) if vlen else v)
         return acc
 
     def acc0(self):
         """
-        Initial accumulator, a dict grp_id -> ProbabilityMap(L, G)
+        Initial accumulator, a dict grp_id -> DenseProbabilityMap(L, G)
         """
         zd = AccumDict()
         num_levels = len(self.oqparam.imtls.array)
@@ -197,7 +203,10 @@ class ClassicalCalculator(base.HazardCalculator):
                 rparams.update(cm.REQUIRES_RUPTURE_PARAMETERS)
                 for dparam in cm.REQUIRES_DISTANCES:
                     rparams.add(dparam + '_')
-                zd[grp_id] = ProbabilityMap(num_levels, len(gsims))
+                zd[grp_id] = DenseProbabilityMap(num_levels, len(gsims))
+                # the results of the tasks arrive site by site: allocate
+                # the rows of all the sites once, instead of growing
+                zd[grp_id].reserve(self.sitecol.sids)
         zd.eff_ruptures = AccumDict(accum=0)  # trt -> eff_ruptures
         self.rparams = sorted(rparams)
         for k in self.rparams:
@@ -212,10 +221,49 @@ class ClassicalCalculator(base.HazardCalculator):
             else:
                 dt = F32
             self.datastore.create_dset('rup/' + k, dt)
+        self.appenders = {'rup/' + k: hdf5.Appender(self.datastore, 'rup/' + k)
+                          for k in self.rparams}
         self.by_task = {}  # task_no => src_ids
         self.totrups = 0  # total number of ruptures before collapsing
         return zd
 
+    def save_checkpoint(self, h5, acc):
+        """
+        Save the accumulator, the source calculation times and the
+        number of rows in the rup/ datasets
+        """
+        for grp_id, pmap in acc.items():
+            h5['pmap/grp-%02d' % grp_id] = pmap
+        h5.create_group('eff_ruptures').attrs.update(acc.eff_ruptures)
+        h5['calc_times/srcids'] = U32(list(self.calc_times))
+        h5['calc_times/array'] = F32(list(self.calc_times.values()))
+        h5.attrs['totrups'] = self.totrups
+        for appender in self.appenders.values():
+            appender.flush()
+        self.datastore.flush()
+        h5.attrs['num_rup_rows'] = len(self.appenders['rup/grp_id'])
+
+    def load_checkpoint(self, h5, acc):
+        """
+        Read the data saved by .save_checkpoint and copy the rup/ rows
+        of the completed tasks from the calculation to resume
+        """
+        for grp_id in acc:
+            acc[grp_id] = h5['pmap/grp-%02d' % grp_id]
+            acc[grp_id].reserve(self.sitecol.sids)
+        acc.eff_ruptures.update(h5['eff_ruptures'].attrs)
+        self.calc_times += dict(zip(h5['calc_times/srcids'][()],
+                                    h5['calc_times/array'][()]))
+        self.totrups = h5.attrs['totrups']
+        nrows = h5.attrs['num_rup_rows']
+        if nrows:
+            with util.read(self.resume_id) as parent:
+                for k in self.rparams:
+                    vlen = k.endswith('_') or k == 'probs_occur'
+                    v = parent.getitem('rup/' + k)[:nrows]
+                    self.appenders['rup/' + k].append(list(v) if vlen else v)
+        return acc
+
     def execute(self):
         """
         Run in parallel `core_task(sources, sitecol, monitor)`, by
@@ -242,14 +290,35 @@ class ClassicalCalculator(base.HazardCalculator):
             self.core_task.__func__, h5=self.datastore.hdf5,
             num_cores=oq.num_cores)
         smap.task_queue = list(self.gen_task_queue())  # really fast
+        if (config.distribution.get('adaptive_tasks') and
+                not oq.checkpoint_every):
+            # predict the task durations from the source durations
+            smap.adapt(self.srcweight, operator.attrgetter('code'),
+                       observe_tasks=False)
+            self.timer = smap.timer
+            self.srcs_by_id = {src.id: src for sg in self.csm.src_groups
+                               for src in sg}
+        for func, args in smap.task_queue:
+            for arg in args[1:]:  # srcfilter, gsims and param
+                smap.share(arg)  # sent to each worker only once
         acc0 = self.acc0()  # create the rup/ datasets BEFORE swmr_on()
         self.datastore.swmr_on()
         smap.h5 = self.datastore.hdf5
-        self.calc_times = AccumDict(accum=numpy.zeros(3, F32))
+        self.calc_times = AccumDict(accum=numpy.zeros(4, F32))
+        if oq.checkpoint_every or self.resume_id:
+            agg = base.Checkpoint(self, smap, self.agg_dicts)
+            acc0 = agg.resume(acc0)
+        else:
+            agg = self.agg_dicts
         try:
-            acc = smap.get_results().reduce(self.agg_dicts, acc0)
+            acc = smap.get_results().reduce(agg, acc0)
+            if isinstance(agg, base.Checkpoint):
+                acc = agg.flush(acc)
+                agg.remove()
             self.store_rlz_info(acc.eff_ruptures)
         finally:
+            for appender in self.appenders.values():
+                appender.close()
             with self.monitor('store source_info'):
                 self.store_source_info(self.calc_times)
             if self.by_task:
@@ -275,6 +344,8 @@ class ClassicalCalculator(base.HazardCalculator):
         logging.info('Effective number of sites per rupture: %d',
                      numsites / self.numrups)
         self.calc_times.clear()  # save a bit of memory
+        if self.timer:
+            del self.timer, self.srcs_by_id
         return acc
 
     def gen_task_queue(self):
@@ -290,6 +361,7 @@ class ClassicalCalculator(base.HazardCalculator):
             g = len(gsims_by_trt[trt])
             m = (oq.maximum_distance(trt) / 300) ** 2
             return src.weight * g * m
+        self.srcweight = srcweight  # used in adaptive mode
 
         totweight = sum(sum(srcweight(src) for src in sg) for sg in src_groups)
         param = dict(
@@ -298,7 +370,10 @@ class ClassicalCalculator(base.HazardCalculator):
             maximum_distance=oq.maximum_distance,
             pointsource_distance=oq.pointsource_distance,
             shift_hypo=oq.shift_hypo, max_weight=oq.max_weight,
-            max_sites_disagg=oq.max_sites_disagg)
+            max_sites_disagg=oq.max_sites_disagg,
+            poes_float32=oq.poes_float32,
+            truncnorm_maxerr=oq.truncnorm_maxerr,
+            collapse_ctxs=oq.collapse_ctxs)
         srcfilter = self.src_filter(self.datastore.tempname)
         if oq.calculation_mode == 'preclassical':
             f1 = f2 = preclassical
@@ -376,8 +451,8 @@ class ClassicalCalculator(base.HazardCalculator):
                     self.datastore[key] = pmap
                     self.datastore.set_attrs(key, trt=trt)
                     extreme = max(
-                        get_extreme_poe(pmap[sid].array, oq.imtls)
-                        for sid in pmap)
+                        get_extreme_poe(array, oq.imtls)
+                        for array in pmap.array)
                     data.append((grp_id, trt, extreme))
         if oq.hazard_calculation_id is None and 'poes' in self.datastore:
             self.datastore['disagg_by_grp'] = numpy.array(
@@ -200,10 +200,15 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         self.param['minimum_asset_loss'] = mal
 
         elt_dt = [('event_id', U32), ('rlzi', U16), ('loss', (F32, (L,)))]
+        self.appenders = {}  # dataset name -> Appender
+        # there is a dataset per tag combination, so the appenders share
+        # a single budget, otherwise the memory would grow with the tags
+        budget = hdf5.Budget()
         for idxs, attrs in gen_indices(self.assetcol.tagcol, oq.aggregate_by):
-            idx = ','.join(map(str, idxs))
-            self.datastore.create_dset('event_loss_table/' + idx, elt_dt,
-                                       attrs=attrs)
+            name = 'event_loss_table/' + ','.join(map(str, idxs))
+            self.datastore.create_dset(name, elt_dt, attrs=attrs)
+            self.appenders[name] = hdf5.Appender(
+                self.datastore, name, budget=budget)
         self.param.pop('oqparam', None)  # unneeded
         self.datastore.create_dset('avg_losses-stats', F32, (A, 1, L))  # mean
         elt_nbytes = 4 * self.E * L
@@ -212,6 +217,8 @@ class EbriskCalculator(event_based.EventBasedCalculator):
                                'red with %d tasks' % oq.concurrent_tasks)
         self.datastore.create_dset('losses_by_event', elt_dt)
         self.datastore.create_dset('gmf_info', gmf_info_dt)
+        for name in ('losses_by_event', 'gmf_info'):
+            self.appenders[name] = hdf5.Appender(self.datastore, name)
 
     def execute(self):
         self.datastore.flush()  # just to be sure
@@ -233,7 +240,11 @@ class EbriskCalculator(event_based.EventBasedCalculator):
             self.core_task.__func__, h5=self.datastore.hdf5)
         for rgetter in getters.gen_rupture_getters(self.datastore, srcfilter):
             smap.submit((rgetter, srcfilter, self.param))
-        smap.reduce(self.agg_dicts)
+        try:
+            smap.reduce(self.agg_dicts)
+        finally:  # truncate the datasets even if a task failed
+            for appender in self.appenders.values():
+                appender.close()
         if self.indices:
             self.datastore['event_loss_table/indices'] = self.indices
         gmf_bytes = self.datastore['gmf_info']['gmfbytes'].sum()
@@ -248,14 +259,14 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         :param dic: dictionary with keys elt, losses_by_A
         """
         if 'gmf_info' in dic:
-            hdf5.extend(self.datastore['gmf_info'], dic.pop('gmf_info'))
+            self.appenders['gmf_info'].append(dic.pop('gmf_info'))
         if not dic:
             return
         self.oqparam.ground_motion_fields = False  # hack
         with self.monitor('saving losses_by_event and event_loss_table'):
-            hdf5.extend(self.datastore['losses_by_event'], dic['elt'])
+            self.appenders['losses_by_event'].append(dic['elt'])
             for idx, arr in dic['alt'].items():
-                hdf5.extend(self.datastore['event_loss_table/' + idx], arr)
+                self.appenders['event_loss_table/' + idx].append(arr)
         if self.oqparam.avg_losses:
             with self.monitor('saving avg_losses'):
                 self.datastore['avg_losses-stats'][:, 0] += dic['losses_by_A']
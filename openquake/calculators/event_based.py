@@ -18,6 +18,7 @@
 
 import os.path
 import logging
+import tempfile
 import operator
 import numpy
 
@@ -45,6 +46,7 @@ U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 TWO32 = numpy.float64(2 ** 32)
+BLOCKSIZE = 1000000  # number of GMF rows copied at once when resuming
 by_grp = operator.attrgetter('grp_id')
 
 
@@ -60,13 +62,35 @@ def get_mean_curves(dstore):
 # ########################################################################## #
 
 
+def save_gmfs(res, gmf_dir, task_no):
+    """
+    Save the GMFs and the sigma-epsilon rows of a task in a new file inside
+    gmf_dir and replace them in the result with a triple
+    (file name, number of GMF rows, number of sigma-epsilon rows)
+    """
+    fd, fname = tempfile.mkstemp('.hdf5', 'task-%05d-' % task_no, gmf_dir)
+    os.close(fd)  # the name is unique even for speculative copies of a task
+    gmfdata = res.pop('gmfdata')
+    sig_eps = res.pop('sig_eps')
+    with hdf5.File(fname, 'w') as h5:
+        h5['gmf_data/data'] = gmfdata
+        h5['gmf_data/sigma_epsilon'] = sig_eps
+    res['gmfdata'] = ()
+    res['gmf_file'] = os.path.basename(fname), len(gmfdata), len(sig_eps)
+    return res
+
+
 def compute_gmfs(rupgetter, srcfilter, param, monitor):
     """
     Compute GMFs and optionally hazard curves
     """
     oq = param['oqparam']
     getter = GmfGetter(rupgetter, srcfilter, oq, param['amplifier'])
-    return getter.compute_gmfs_curves(param.get('rlz_by_event'), monitor)
+    res = getter.compute_gmfs_curves(param.get('rlz_by_event'), monitor)
+    if param.get('gmf_dir') and len(res['gmfdata']):
+        with monitor('saving gmfs on the task file'):
+            save_gmfs(res, param['gmf_dir'], monitor.task_no)
+    return res
 
 
 @base.calculators.add('event_based', 'ucerf_hazard')
@@ -170,17 +194,24 @@ class EventBasedCalculator(base.HazardCalculator):
         agg_mon = self.monitor('aggregating hcurves')
         with sav_mon:
             data = result.pop('gmfdata')
-            if len(data):
+            gmf_file = result.pop('gmf_file', None)
+            if gmf_file:  # the GMFs were saved by the task
+                self.gmf_files.append(gmf_file)
+                num_rows = gmf_file[1]
+            else:
+                num_rows = len(data)
+            if num_rows:
                 times = result.pop('times')
                 rupids = list(times['rup_id'])
                 self.datastore['gmf_data/time_by_rup'][rupids] = times
-                hdf5.extend(self.datastore['gmf_data/data'], data)
-                sig_eps = result.pop('sig_eps')
-                hdf5.extend(self.datastore['gmf_data/sigma_epsilon'], sig_eps)
+                if not gmf_file:
+                    self.appenders['gmf_data/data'].append(data)
+                    self.appenders['gmf_data/sigma_epsilon'].append(
+                        result.pop('sig_eps'))
                 for sid, start, stop in result['indices']:
                     self.indices[sid, 0].append(start + self.offset)
                     self.indices[sid, 1].append(stop + self.offset)
-                self.offset += len(data)
+                self.offset += num_rows
         if self.offset >= TWO32:
             raise RuntimeError(
                 'The gmf_data table has more than %d rows' % TWO32)
@@ -193,6 +224,71 @@ class EventBasedCalculator(base.HazardCalculator):
         self.datastore.flush()
         return acc
 
+    def save_checkpoint(self, h5, acc):
+        """
+        Save the hazard curves and the position of the GMFs of the
+        completed tasks
+        """
+        for r, pmap in acc.items():
+            h5['hcurves/rlz-%03d' % r] = pmap
+        if self.oqparam.ground_motion_fields:
+            h5.attrs['offset'] = self.offset
+            for appender in self.appenders.values():
+                appender.flush()
+            self.datastore.flush()
+            h5.attrs['num_sig_eps'] = len(
+                self.appenders['gmf_data/sigma_epsilon'])
+            rows = [(sid, start, stop) for (sid, i), starts
+                    in self.indices.items() if i == 0
+                    for start, stop in zip(starts, self.indices[sid, 1])]
+            h5['indices'] = U32(rows).reshape(-1, 3)
+
+    def load_checkpoint(self, h5, acc):
+        """
+        Read the data saved by .save_checkpoint and copy the GMFs of
+        the completed tasks from the calculation to resume
+        """
+        for r in acc:
+            acc[r] = h5['hcurves/rlz-%03d' % r]
+        if not self.oqparam.ground_motion_fields:
+            return acc
+        self.offset = h5.attrs['offset']
+        for sid, start, stop in h5['indices'][()]:
+            self.indices[sid, 0].append(start)
+            self.indices[sid, 1].append(stop)
+        nrows = {'gmf_data/data': self.offset,
+                 'gmf_data/sigma_epsilon': h5.attrs['num_sig_eps']}
+        with util.read(self.resume_id) as parent:
+            for name, n in nrows.items():
+                dset = parent.getitem(name)
+                for start in range(0, n, BLOCKSIZE):
+                    self.appenders[name].append(
+                        dset[start:min(start + BLOCKSIZE, n)])
+            self.datastore['gmf_data/time_by_rup'][:] = parent.getitem(
+                'gmf_data/time_by_rup')[()]
+        return acc
+
+    def merge_gmf_files(self):
+        """
+        Build gmf_data/data and gmf_data/sigma_epsilon as virtual datasets
+        referencing the files saved by the tasks, in the order in which
+        the results arrived, consistently with gmf_data/indices. If the
+        tasks saved no files, the datasets are created empty.
+        """
+        oq = self.oqparam
+        gmf_dir = os.path.basename(self.param['gmf_dir'])  # relative path
+        logging.info('Merging %d GMF files', len(self.gmf_files))
+        self.datastore.close()  # datasets cannot be created in SWMR mode
+        self.datastore.open('a')
+        dtypes = [oq.gmf_data_dt(), sig_eps_dt(oq.imtls)]
+        for i, key in enumerate(['gmf_data/data', 'gmf_data/sigma_epsilon']):
+            if not self.gmf_files:
+                self.datastore[key] = numpy.zeros(0, dtypes[i])
+                continue
+            sources = [(os.path.join(gmf_dir, fname), key, sizes[i])
+                       for fname, *sizes in self.gmf_files]
+            hdf5.create_virtual(self.datastore.hdf5, key, sources, dtypes[i])
+
     def save_events(self, rup_array):
         """
         :param rup_array: an array of ruptures with fields grp_id
@@ -290,6 +386,8 @@ class EventBasedCalculator(base.HazardCalculator):
         self.offset = 0
         srcfilter = self.src_filter(self.datastore.tempname)
         self.indices = AccumDict(accum=[])  # sid, idx -> indices
+        self.appenders = {}  # dataset name -> Appender
+        self.gmf_files = []  # (file name, num_gmfs, num_sig_eps) triples
         if oq.hazard_calculation_id:  # from ruptures
             self.datastore.parent = util.read(oq.hazard_calculation_id)
             self.init_logic_tree(self.datastore.parent['full_lt'])
@@ -304,14 +402,20 @@ class EventBasedCalculator(base.HazardCalculator):
         N = len(self.sitecol.complete)
         if oq.ground_motion_fields:
             nrups = len(self.datastore['ruptures'])
-            self.datastore.create_dset('gmf_data/data', oq.gmf_data_dt())
-            self.datastore.create_dset('gmf_data/sigma_epsilon',
-                                       sig_eps_dt(oq.imtls))
             self.datastore.create_dset(
                 'gmf_data/indices', hdf5.vuint32, shape=(N, 2), fillvalue=None)
             self.datastore.create_dset('gmf_data/events_by_sid', U32, (N,))
             self.datastore.create_dset('gmf_data/time_by_rup',
                                        time_dt, (nrups,), fillvalue=None)
+            if oq.gmf_task_files:  # the tasks will save the GMFs
+                self.param['gmf_dir'] = self.datastore.filename[:-5] + '_gmfs'
+                os.makedirs(self.param['gmf_dir'], exist_ok=True)
+            else:
+                self.datastore.create_dset('gmf_data/data', oq.gmf_data_dt())
+                self.datastore.create_dset('gmf_data/sigma_epsilon',
+                                           sig_eps_dt(oq.imtls))
+                for name in ('gmf_data/data', 'gmf_data/sigma_epsilon'):
+                    self.appenders[name] = hdf5.Appender(self.datastore, name)
         if oq.hazard_curves_from_gmfs:
             self.param['rlz_by_event'] = self.datastore['events']['rlz_id']
 
@@ -321,10 +425,28 @@ class EventBasedCalculator(base.HazardCalculator):
         iterargs = ((rgetter, srcfilter, self.param)
                     for rgetter in gen_rupture_getters(
                             self.datastore, srcfilter))
-        acc = parallel.Starmap(
-            self.core_task.__func__, iterargs, h5=self.datastore.hdf5,
-            num_cores=oq.num_cores
-        ).reduce(self.agg_dicts, self.acc0())
+        try:
+            if oq.checkpoint_every or self.resume_id:
+                smap = parallel.Starmap(
+                    self.core_task.__func__, h5=self.datastore.hdf5,
+                    num_cores=oq.num_cores)
+                smap.task_queue = [(self.core_task.__func__, args)
+                                   for args in iterargs]
+                ckp = base.Checkpoint(self, smap, self.agg_dicts)
+                acc = ckp.resume(self.acc0())
+                ckp.save(acc)  # the ruptures are there, even if no GMFs yet
+                acc = ckp.flush(smap.get_results().reduce(ckp, acc))
+                ckp.remove()
+            else:
+                acc = parallel.Starmap(
+                    self.core_task.__func__, iterargs, h5=self.datastore.hdf5,
+                    num_cores=oq.num_cores
+                ).reduce(self.agg_dicts, self.acc0())
+        finally:  # truncate the datasets even if a task failed
+            for appender in self.appenders.values():
+                appender.close()
+        if 'gmf_dir' in self.param:
+            self.merge_gmf_files()
 
         if self.indices:
             dset = self.datastore['gmf_data/indices']
@@ -23,6 +23,8 @@ import gzip
 import ast
 import io
 import os
+import re
+import inspect
 
 import requests
 from h5py._hl.dataset import Dataset
@@ -173,18 +175,33 @@ class Extract(dict):
             return func
         return decorator
 
-    def __call__(self, dstore, key):
-        if '/' in key:
-            k, v = key.split('/', 1)
-            data = self[k](dstore, v)
-        elif '?' in key:
-            k, v = key.split('?', 1)
-            data = self[k](dstore, v)
+    def _get(self, dstore, key):
+        # split at the first slash or question mark, so that the query
+        # string can contain slashes, as in slice?dset=gmf_data/data
+        mo = re.search('[/?]', key)
+        if mo:
+            data = self[key[:mo.start()]](dstore, key[mo.end():])
         elif key in self:
             data = self[key](dstore, '')
         else:
             data = extract_(dstore, key)
-        return ArrayWrapper.from_(data)
+        return data
+
+    def __call__(self, dstore, key):
+        return ArrayWrapper.from_(self._get(dstore, key))
+
+    def iter(self, dstore, key):
+        """
+        Similar to __call__, but the arrays produced by generator extractors
+        are not collected in memory and are yielded one at the time.
+
+        :yields: pairs (name, value)
+        """
+        data = self._get(dstore, key)
+        if inspect.isgenerator(data):
+            yield from data
+        else:
+            yield from vars(ArrayWrapper.from_(data)).items()
 
 
 extract = Extract()
@@ -352,7 +369,7 @@ def _get_dict(dstore, name, imtls, stats):
         dt = numpy.dtype([(str(iml), F32) for iml in imls])
         dtlist.append((imt, dt))
     for s, stat in enumerate(stats):
-        dic[stat] = dstore[name][:, s].flatten().view(dtlist)
+        dic[stat] = hdf5.memmap(dstore[name])[:, s].flatten().view(dtlist)
     return dic
 
 
@@ -379,11 +396,11 @@ def extract_hcurves(dstore, what):
         slc = ALL
     sids = params.get('site_id', ALL)
     if params['rlzs']:
-        dset = dstore['hcurves-rlzs']
+        dset = hdf5.memmap(dstore['hcurves-rlzs'])
         for k in params['k']:
             yield 'rlz-%03d' % k, hdf5.extract(dset, sids, k, slc)[:, 0]
     else:
-        dset = dstore['hcurves-stats']
+        dset = hdf5.memmap(dstore['hcurves-stats'])
         stats = list(info['stats'])
         for k in params['k']:
             yield stats[k], hdf5.extract(dset, sids, k, slc)[:, 0]
@@ -400,6 +417,21 @@ def extract_sitecol(dstore, what):
     return dstore['sitecol'].array
 
 
+# used by the WebExtractor to read big datasets slice by slice
+@extract.add('slice')
+def extract_slice(dstore, what):
+    """
+    Extract a slice of a dataset, together with the total number of rows.
+    Use it as /extract/slice?dset=gmf_data/data&start=0&stop=1000
+    """
+    qdict = parse(what)
+    [key] = qdict['dset']
+    dset = dstore.getitem(key)
+    [start] = qdict.get('start', [0])
+    [stop] = qdict.get('stop', [len(dset)])
+    return ArrayWrapper(hdf5.memmap(dset)[start:stop], dict(nrows=len(dset)))
+
+
 @extract.add('hmaps')
 def extract_hmaps(dstore, what):
     """
@@ -423,11 +455,11 @@ def extract_hmaps(dstore, what):
     else:
         s = ALL
     if params['rlzs']:
-        dset = dstore['hmaps-rlzs']
+        dset = hdf5.memmap(dstore['hmaps-rlzs'])
         for k in params['k']:
             yield 'rlz-%03d' % k, hdf5.extract(dset, ALL, k, s, ALL)[:, 0]
     else:
-        dset = dstore['hmaps-stats']
+        dset = hdf5.memmap(dstore['hmaps-stats'])
         stats = list(info['stats'])
         for k in params['k']:
             yield stats[k], hdf5.extract(dset, ALL, k, s, ALL)[:, 0]
@@ -446,7 +478,7 @@ def extract_uhs(dstore, what):
         mesh = get_mesh(sitecol, complete=False)
         dic = {}
         for stat, s in info['stats'].items():
-            hmap = dstore['hmaps-stats'][:, s]
+            hmap = hdf5.memmap(dstore['hmaps-stats'])[:, s]
             dic[stat] = calc.make_uhs(hmap, info)
         yield from hazard_items(
             dic, mesh, investigation_time=info['investigation_time'])
@@ -461,12 +493,12 @@ def extract_uhs(dstore, what):
     else:
         sids = ALL
     if params['rlzs']:
-        dset = dstore['hmaps-rlzs']
+        dset = hdf5.memmap(dstore['hmaps-rlzs'])
         for k in params['k']:
             yield ('rlz-%03d' % k,
                    hdf5.extract(dset, sids, k, periods, ALL)[:, 0])
     else:
-        dset = dstore['hmaps-stats']
+        dset = hdf5.memmap(dstore['hmaps-stats'])
         stats = list(info['stats'])
         for k in params['k']:
             yield stats[k], hdf5.extract(dset, sids, k, periods, ALL)[:, 0]
@@ -1305,6 +1337,22 @@ class Extractor(object):
             return {k: v for k, v in vars(aw).items() if not k.startswith('_')}
         return aw
 
+    def get_slices(self, dset, slice_size):
+        """
+        Fetch a dataset slice by slice, without reading it all at once
+
+        :param dset: the name of a dataset in the datastore
+        :param slice_size: the maximum number of rows per slice
+        :yields: arrays with at most slice_size rows
+        """
+        query = 'slice?dset=%s&start=%d&stop=%d'
+        aw = self.get(query % (dset, 0, slice_size))
+        nrows = int(aw.nrows)
+        yield getattr(aw, 'array', ())
+        for start in range(slice_size, nrows, slice_size):
+            aw = self.get(query % (dset, start, start + slice_size))
+            yield aw.array
+
     def __enter__(self):
         return self
 
@@ -1377,18 +1425,43 @@ class WebExtractor(Extractor):
 
     def dump(self, fname):
         """
-        Dump the remote datastore on a local path.
+        Dump the remote datastore on a local path. The data are saved in
+        the file `<fname>.part`, renamed to `fname` at the end: if that
+        file exists the download is resumed, by requesting only the
+        missing bytes, unless the remote datastore has changed in the
+        meantime (its ETag is stored in the file `<fname>.part.etag`).
         """
         url = '%s/v1/calc/%d/datastore' % (self.server, self.calc_id)
-        resp = self.sess.get(url, stream=True)
+        part = fname + '.part'
+        etag = part + '.etag'
         down = 0
-        with open(fname, 'wb') as f:
-            logging.info('Saving %s', fname)
-            for chunk in resp.iter_content(CHUNKSIZE):
-                f.write(chunk)
-                down += len(chunk)
-                println('Downloaded {:,} bytes'.format(down))
-        print()
+        headers = {}
+        if os.path.exists(part) and os.path.exists(etag):
+            down = os.path.getsize(part)
+            with open(etag) as f:
+                headers['If-Range'] = f.read()
+            headers['Range'] = 'bytes=%d-' % down
+        resp = self.sess.get(url, stream=True, headers=headers)
+        if resp.status_code not in (200, 206, 416):
+            raise WebAPIError(resp.text)
+        elif resp.status_code != 416:  # 416 means already downloaded
+            if resp.status_code == 200:  # the whole file is sent
+                down = 0
+            if 'ETag' in resp.headers:
+                with open(etag, 'w') as f:
+                    f.write(resp.headers['ETag'])
+            elif os.path.exists(etag):  # the download cannot be resumed
+                os.remove(etag)
+            with open(part, 'ab' if down else 'wb') as f:
+                logging.info('Saving %s', fname)
+                for chunk in resp.iter_content(CHUNKSIZE):
+                    f.write(chunk)
+                    down += len(chunk)
+                    println('Downloaded {:,} bytes'.format(down))
+            print()
+        os.replace(part, fname)
+        if os.path.exists(etag):
+            os.remove(etag)
 
     def close(self):
         """
@@ -114,14 +114,21 @@ class PmapGetter(object):
         self._pmap_by_grp = {}
         if 'poes' in self.dstore:
             # build probability maps restricted to the given sids
-            ok_sids = set(self.sids)
             for grp, dset in self.dstore['poes'].items():
-                ds = dset['array']
+                # memory map the PoEs, so that the tasks reading the same
+                # datastore share the page cache instead of copying the data
+                ds = hdf5.memmap(dset['array'], 'c')
                 L, G = ds.shape[1:]
-                pmap = probability_map.ProbabilityMap(L, G)
-                for idx, sid in enumerate(dset['sids'][()]):
-                    if sid in ok_sids:
-                        pmap[sid] = probability_map.ProbabilityCurve(ds[idx])
+                sids = dset['sids'][()]
+                idxs, = numpy.isin(sids, self.sids).nonzero()
+                pmap = probability_map.DenseProbabilityMap(L, G)
+                if len(idxs):  # read the slice containing the given sids
+                    array = ds[idxs[0]: idxs[-1] + 1]
+                    pmap.sids = sids[idxs]
+                    if idxs[-1] - idxs[0] + 1 == len(idxs):  # contiguous
+                        pmap.array = array  # a view, no copy
+                    else:
+                        pmap.array = array[idxs - idxs[0]]
                 self._pmap_by_grp[grp] = pmap
                 self.nbytes += pmap.nbytes
         return self._pmap_by_grp
@@ -22,6 +22,7 @@ import unittest.mock as mock
 import numpy
 from openquake.baselib import parallel
 from openquake.hazardlib import InvalidFile
+from openquake.calculators import base
 from openquake.calculators.views import view
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
@@ -158,6 +159,31 @@ class ClassicalTestCase(CalculatorTestCase):
              'hazard_curve-smltp_b1_b3-gsimltp_b1.csv'],
             case_9.__file__)
 
+    def test_case_1_resume(self):
+        # keep the checkpoint of a calculation storing rup/ data and
+        # resume from it: the rup/ rows must be copied from the parent
+        with mock.patch.object(base.Checkpoint, 'remove'):
+            self.run_calc(case_1.__file__, 'job.ini', checkpoint_every='1E-9')
+        parent = self.calc.datastore
+        self.assertTrue(os.path.exists(base.checkpoint_path(
+            parent.calc_id, parent.datadir)))
+        calc = self.get_calc(case_1.__file__, 'job.ini',
+                             checkpoint_every='1E-9')
+        calc.resume_id = parent.calc_id
+        with calc._monitor:
+            calc.run()
+        for k in ('grp_id', 'occurrence_rate', 'rrup_', 'sid_'):
+            expected = parent['rup/' + k][()]
+            got = calc.datastore['rup/' + k][()]
+            self.assertGreater(len(expected), 0)
+            self.assertEqual(len(got), len(expected))
+            if k.endswith('_'):  # variable length arrays
+                expected = numpy.concatenate(expected)
+                got = numpy.concatenate(got)
+            numpy.testing.assert_allclose(sorted(got), sorted(expected))
+        numpy.testing.assert_allclose(calc.datastore['hcurves-rlzs'][()],
+                                      parent['hcurves-rlzs'][()])
+
     def test_case_10(self):
         self.assert_curves_ok(
             ['hazard_curve-smltp_b1_b2-gsimltp_b1.csv',
@@ -197,6 +197,12 @@ class EventBasedTestCase(CalculatorTestCase):
         self.assertEqualFiles(
             'expected/hazard_curve-smltp_b1-gsimltp_b1.csv', fname)
 
+        # the GMFs saved by the tasks and merged in virtual datasets
+        out = self.run_calc(case_2.__file__, 'job.ini', exports='csv',
+                            gmf_task_files='true')
+        [gmfs, sig_eps, _sitefile] = out['gmf_data', 'csv']
+        self.assertEqualFiles('expected/gmf-data.csv', gmfs)
+
     def test_case_2bis(self):  # oversampling
         out = self.run_calc(case_2.__file__, 'job_2.ini', exports='csv,xml')
         [fname, _, _] = out['gmf_data', 'csv']  # 2 realizations, 1 TRT
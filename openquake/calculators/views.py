@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import ast
+import json
 import os.path
 import numbers
 import operator
@@ -27,7 +28,7 @@ import numpy
 from openquake.baselib.general import (
     humansize, countby, AccumDict, CallableDict,
     get_array, group_array, fast_agg, fast_agg3)
-from openquake.baselib.performance import perf_dt
+from openquake.baselib.performance import perf_dt, trace_events
 from openquake.baselib.python3compat import encode, decode
 from openquake.hazardlib import valid
 from openquake.hazardlib.gsim.base import ContextMaker
@@ -466,6 +467,56 @@ def view_performance(token, dstore):
     return rst_table(performance_view(dstore))
 
 
+@view.add('trace')
+def view_trace(token, dstore):
+    """
+    Display the timeline of the tasks and of the operations in the master
+    in Chrome trace-event format. Save it in a file and open it with
+    chrome://tracing or https://ui.perfetto.dev to see the scheduling
+    gaps. Here is an example of usage::
+
+      $ oq show trace > trace.json
+    """
+    if 'task_timeline' not in dstore:
+        return 'Not available'
+    timeline = dstore['task_timeline']
+    timeline.refresh()
+    return json.dumps(trace_events(timeline[()]))
+
+
+@view.add('profile')
+def view_profile(token, dstore, maxrows=30):
+    """
+    Display the frames where the profiled tasks spent more time, i.e.
+    the percentage of samples where the frame is the last one (self) or
+    is in the stack (total). It is also possible to display the stacks in
+    folded format, suitable for flamegraph.pl or speedscope::
+
+      $ oq show profile
+      $ oq show profile:folded > stacks.txt
+    """
+    if 'profile' not in dstore or len(dstore['profile']) == 0:
+        return 'Not available, set profile_tasks in the job.ini'
+    data = dstore['profile'][()]
+    counts = AccumDict(accum=0)  # stack -> samples
+    for stack, n in zip(decode(list(data['stack'])), data['counts']):
+        counts[stack] += n
+    if token.endswith(':folded'):
+        return '\n'.join('%s %d' % item for item in sorted(counts.items()))
+    self_ = AccumDict(accum=0)  # frame -> samples
+    total = AccumDict(accum=0)  # frame -> samples
+    for stack, n in counts.items():
+        frames = stack.split(';')
+        self_[frames[-1]] += n
+        for frame in set(frames):
+            total[frame] += n
+    tot = sum(counts.values())
+    frames = sorted(total, key=lambda f: (self_[f], total[f]), reverse=True)
+    rows = [(frame, round(self_[frame] / tot * 100, 1),
+             round(total[frame] / tot * 100, 1)) for frame in frames[:maxrows]]
+    return rst_table(rows, header=['frame', 'self%', 'total%'])
+
+
 def stats(name, array, *extras):
     """
     Returns statistics from an array of numbers.
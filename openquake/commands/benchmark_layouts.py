@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import os
+import re
+import time
+import tempfile
+import numpy
+from openquake.baselib import sap, hdf5
+from openquake.baselib.general import humansize
+from openquake.commonlib import util
+from openquake.calculators.views import rst_table
+
+LAYOUTS = ['', 'chunk=65536', 'lzf,chunk=65536', 'gzip1,shuffle,chunk=65536',
+           'gzip4,shuffle,chunk=65536']
+
+
+def bench_layout(array, key, spec, slice_size, num_slices):
+    """
+    Store the array in a temporary file with the given layout and read it
+
+    :returns: file size, write MB/s, read MB/s, slices read per second
+    """
+    hdf5.set_layouts({re.escape(key): spec})
+    fd, fname = tempfile.mkstemp(suffix='.hdf5')
+    os.close(fd)
+    mb = array.nbytes / 1024 ** 2
+    try:
+        with hdf5.File(fname, 'w') as h5:
+            t0 = time.time()
+            h5[key] = array
+        dt_write = time.time() - t0
+        size = os.path.getsize(fname)
+        with hdf5.File(fname, 'r') as h5:
+            t0 = time.time()
+            h5[key][()]
+            dt_read = time.time() - t0
+        rng = numpy.random.RandomState(42)
+        starts = rng.randint(0, max(1, len(array) - slice_size), num_slices)
+        with hdf5.File(fname, 'r') as h5:
+            dset = h5[key]
+            t0 = time.time()
+            for start in starts:
+                dset[start:start + slice_size]
+            dt_slices = time.time() - t0
+    finally:
+        os.remove(fname)
+        hdf5.set_layouts()
+    return (humansize(size), round(mb / dt_write), round(mb / dt_read),
+            round(num_slices / dt_slices))
+
+
+@sap.script
+def benchmark_layouts(key='gmf_data/data', calc_id=-1, layouts='',
+                      slice_size=1000, num_slices=100):
+    """
+    Copy a dataset of a calculation into temporary files stored with
+    different layouts (see the section [dataset_layouts] in openquake.cfg)
+    and report the file size, the write and read throughput in MB/s
+    and the number of random slices read per second
+    """
+    with util.read(calc_id) as dstore:
+        array = dstore.getitem(key)[()]
+    print('Read %s with shape %s (%s)' % (
+        key, array.shape, humansize(array.nbytes)))
+    specs = layouts.split(';') if layouts else LAYOUTS
+    rows = [(spec or 'contiguous',) + bench_layout(
+        array, key, spec, slice_size, num_slices) for spec in specs]
+    print(rst_table(rows, ['layout', 'file_size', 'write_MB/s', 'read_MB/s',
+                           'slices/s']))
+
+
+benchmark_layouts.opt('key', 'dataset to benchmark')
+benchmark_layouts.opt('calc_id', 'calculation ID', type=int)
+benchmark_layouts.opt('layouts', 'layouts separated by semicolons')
+benchmark_layouts.opt('slice_size', 'number of rows per slice', type=int)
+benchmark_layouts.opt('num_slices', 'number of slices to read', type=int)
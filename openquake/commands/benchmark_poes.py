@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import time
+import numpy
+from openquake.baselib import sap
+from openquake.baselib.general import DictArray, humansize
+from openquake.hazardlib.gsim.base import get_poes, TruncNormSF
+from openquake.calculators.views import rst_table
+
+F32 = numpy.float32
+F64 = numpy.float64
+
+
+def bench_poes(func, repeat):
+    """
+    :returns: the minimum time in seconds of `repeat` calls to func
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+
+@sap.script
+def benchmark_poes(num_sites=10000, num_levels=20, num_imts=3, num_gsims=4,
+                   truncation_level=3., maxerr=1E-6, repeat=5):
+    """
+    Compute the PoEs for random means and standard deviations with the
+    current kernel (allocating a new array at each call), with preallocated
+    float64 and float32 buffers and with the tabulated survival function
+    and report the time and the maximum absolute error
+    """
+    N, L1, M, G = num_sites, num_levels, num_imts, num_gsims
+    rng = numpy.random.RandomState(42)
+    mean_std = numpy.zeros((2, N, M, G))
+    mean_std[0] = rng.uniform(-5, 0, (N, M, G))  # log of the mean
+    mean_std[1] = rng.uniform(.3, .9, (N, M, G))
+    imls = numpy.log(numpy.logspace(-3, .5, L1))
+    loglevels = DictArray({'SA(%s)' % (m / 10 + .1): imls for m in range(M)})
+    tl = truncation_level
+    expected = get_poes(mean_std, loglevels, tl)
+    print('Computing PoEs of shape %s (%s)' % (
+        expected.shape, humansize(expected.nbytes)))
+    buf64 = numpy.zeros(expected.shape, F64)
+    buf32 = numpy.zeros(expected.shape, F32)
+    methods = [('allocating', None, None),
+               ('float64 buffer', buf64, None),
+               ('float32 buffer', buf32, None)]
+    if tl:
+        methods.append(('float64 table', buf64, TruncNormSF(tl, maxerr)))
+        methods.append(('float32 table', buf32, TruncNormSF(tl, maxerr, F32)))
+    rows = []
+    dt0 = None
+    for name, out, sf in methods:
+        def func():
+            return get_poes(mean_std, loglevels, tl, out=out, sf=sf)
+        err = numpy.abs(func() - expected).max()
+        dt = bench_poes(func, repeat)
+        dt0 = dt0 or dt
+        rows.append((name, round(dt * 1000, 1), round(dt0 / dt, 2),
+                     '%.2E' % err))
+    print(rst_table(rows, ['method', 'time_ms', 'speedup', 'max_abs_err']))
+
+
+benchmark_poes.opt('num_sites', 'number of sites', type=int)
+benchmark_poes.opt('num_levels', 'number of levels per IMT', type=int)
+benchmark_poes.opt('num_imts', 'number of IMTs', type=int)
+benchmark_poes.opt('num_gsims', 'number of GSIMs', type=int)
+benchmark_poes.opt('truncation_level', 'truncation level', type=float)
+benchmark_poes.opt('maxerr', 'maximum error of the table', type=float)
+benchmark_poes.opt('repeat', 'number of repetitions', type=int)
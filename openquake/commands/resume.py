@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import os
+import logging
+from openquake.baselib import sap, datastore, parallel
+from openquake.commonlib import logs
+from openquake.calculators import base
+from openquake.server import dbserver
+
+
+@sap.script
+def resume(calc_id, loglevel='info', pdb=False):
+    """
+    Resume an interrupted calculation by starting a new calculation with
+    the same parameters, which skips the tasks completed before the last
+    checkpoint (see the parameter checkpoint_every in the job.ini)
+    """
+    dbserver.ensure_on()
+    with datastore.read(calc_id) as old:
+        oqparam = old['oqparam']
+        calc_id = old.calc_id  # in case of negative calc_id
+    hc_id = oqparam.hazard_calculation_id
+    new_id = logs.init('nojob', getattr(logging, loglevel.upper()))
+    calc = base.calculators(oqparam, new_id)
+    calc.resume_id = calc_id
+    if calc.is_stochastic and os.path.exists(base.checkpoint_path(calc_id)):
+        # the ruptures were already stored, they are read from calc_id
+        hc_id = calc_id
+    logging.info('Resuming calculation %d as calculation %d',
+                 calc_id, new_id)
+    try:
+        calc.run(pdb=pdb, hazard_calculation_id=hc_id)
+    finally:
+        parallel.Starmap.shutdown()
+    print('See the output with silx view %s' % calc.datastore.filename)
+    return calc
+
+
+resume.arg('calc_id', 'ID of the interrupted calculation', type=int)
+resume.opt('loglevel', 'logging level',
+           choices='debug info warn error critical'.split())
+resume.flg('pdb', 'enable post mortem debugging', '-d')
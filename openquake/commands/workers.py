@@ -21,7 +21,7 @@ from pprint import pprint
 from openquake.baselib import sap, config, workerpool
 
 
-ro_commands = ('status', 'inspect')
+ro_commands = ('status', 'inspect', 'load')
 
 
 @sap.script
@@ -38,4 +38,4 @@ def workers(cmd):
 
 
 workers.arg('cmd', 'command',
-            choices='start stop status restart inspect'.split())
+            choices='start stop status restart inspect load'.split())
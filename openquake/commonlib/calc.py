@@ -245,27 +245,31 @@ class RuptureSerializer(object):
         datastore.create_dset('ruptures', calc.stochastic.rupture_dt,
                               attrs={'nbytes': 0})
         datastore.create_dset('rupgeoms', calc.stochastic.point3d)
+        self.ruptures = hdf5.Appender(datastore, 'ruptures')
+        self.rupgeoms = hdf5.Appender(datastore, 'rupgeoms')
 
     def save(self, rup_array):
         """
          Store the ruptures in array format.
         """
         self.nruptures += len(rup_array)
-        offset = len(self.datastore['rupgeoms'])
+        offset = len(self.rupgeoms)
         rup_array.array['gidx1'] += offset
         rup_array.array['gidx2'] += offset
-        hdf5.extend(self.datastore['ruptures'], rup_array)
-        hdf5.extend(self.datastore['rupgeoms'], rup_array.geom)
+        self.ruptures.append(rup_array.array)
+        self.rupgeoms.append(rup_array.geom)
         # TODO: PMFs for nonparametric ruptures are not stored
-        self.datastore.flush()
 
     def close(self):
         """
-        Save information about the rupture codes as attributes of the
-        'ruptures' dataset.
+        Flush the buffered ruptures and save information about the rupture
+        codes as attributes of the 'ruptures' dataset.
         """
         if 'ruptures' not in self.datastore:  # for UCERF
             return
+        self.ruptures.close()
+        self.rupgeoms.close()
+        self.datastore.flush()
         codes = numpy.unique(self.datastore['ruptures']['code'])
         attr = {'code_%d' % code: ' '.join(
             cls.__name__ for cls in code2cls[code]) for code in codes}
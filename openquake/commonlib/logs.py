@@ -21,6 +21,7 @@ Set up some system-wide loggers
 import os.path
 import socket
 import logging
+import threading
 from datetime import datetime
 from contextlib import contextmanager
 from openquake.baselib import zeromq, config, parallel, datastore
@@ -32,6 +33,70 @@ LEVELS = {'debug': logging.DEBUG,
           'critical': logging.CRITICAL}
 
 DBSERVER_PORT = int(os.environ.get('OQ_DBSERVER_PORT') or config.dbserver.port)
+DBSERVER_TIMEOUT = 600  # seconds to wait for a reply of the database server
+
+
+class DbClient(object):
+    """
+    A client of the database server keeping a REQ socket open for each
+    process and thread, instead of opening a new one for each command.
+    If a command fails while the socket is waiting for the reply, or no
+    reply arrives within the timeout, the socket is discarded and a new
+    one is opened at the next command, so that a restarted database server
+    is reached again.
+
+    :param host: hostname of the database server
+    :param port: port of the database server
+    :param timeout: seconds to wait for a reply (None means forever)
+    """
+    def __init__(self, host, port, timeout=DBSERVER_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.end_point = None  # resolved at the first command
+        self.local = threading.local()
+
+    def _get_socket(self):
+        pid = os.getpid()
+        if getattr(self.local, 'pid', None) != pid:  # new thread or process
+            if self.end_point is None:
+                self.end_point = 'tcp://%s:%s' % (
+                    socket.gethostbyname(self.host), self.port)
+            # Context.instance() returns a new context in forked processes
+            sock = zeromq.zmq.Context.instance().socket(zeromq.zmq.REQ)
+            sock.connect(self.end_point)
+            self.local.sock = sock
+            self.local.pid = pid
+        return self.local.sock
+
+    def close(self):
+        """
+        Close the socket of the current thread, if any
+        """
+        if getattr(self.local, 'pid', None) == os.getpid():
+            self.local.sock.close(linger=0)
+        vars(self.local).clear()
+
+    def __call__(self, action, *args):
+        sock = self._get_socket()
+        try:
+            sock.send_pyobj((action,) + args)
+            if not sock.poll(None if self.timeout is None
+                             else self.timeout * 1000):
+                raise TimeoutError(
+                    'The database server at %s did not reply in %s seconds'
+                    % (self.end_point, self.timeout))
+            res = sock.recv_pyobj()
+        except BaseException:
+            # a REQ socket without a reply cannot be used anymore
+            self.close()
+            raise
+        if isinstance(res, parallel.Result):
+            return res.get()
+        return res
+
+
+_dbclient = DbClient(config.dbserver.host, DBSERVER_PORT)
 
 
 def dbcmd(action, *args):
@@ -41,14 +106,7 @@ def dbcmd(action, *args):
     :param string action: database action to perform
     :param tuple args: arguments
     """
-    host = socket.gethostbyname(config.dbserver.host)
-    sock = zeromq.Socket(
-        'tcp://%s:%s' % (host, DBSERVER_PORT), zeromq.zmq.REQ, 'connect')
-    with sock:
-        res = sock.send((action,) + args)
-        if isinstance(res, parallel.Result):
-            return res.get()
-    return res
+    return _dbclient(action, *args)
 
 
 def touch_log_file(log_file):
@@ -100,17 +158,56 @@ class LogFileHandler(logging.FileHandler):
 
 class LogDatabaseHandler(logging.Handler):
     """
-    Log stream handler
+    Log database handler. The records are buffered and sent to the
+    database server with a single `log_many` command when there are
+    `batch_size` of them, when `interval` seconds are passed since the
+    first one or immediately in the case of warnings and errors.
     """
-    def __init__(self, job_id):
+    def __init__(self, job_id, batch_size=100, interval=1.):
         super().__init__()
         self.job_id = job_id
+        self.batch_size = batch_size
+        self.interval = interval
+        self.records = []
+        self.timer = None
 
     def emit(self, record):  # pylint: disable=E0202
+        # NB: emit is called by .handle, which is holding the lock
         if record.levelno >= logging.INFO:
-            dbcmd('log', self.job_id, datetime.utcnow(), record.levelname,
-                  '%s/%s' % (record.processName, record.process),
-                  record.getMessage())
+            self.records.append((
+                self.job_id, datetime.utcnow(), record.levelname,
+                '%s/%s' % (record.processName, record.process),
+                record.getMessage()))
+            if (len(self.records) >= self.batch_size or
+                    record.levelno >= logging.WARNING):
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.interval, self._timeout)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _timeout(self):
+        # called in the thread of the timer, which has its own socket
+        try:
+            self.flush()
+        finally:
+            _dbclient.close()
+
+    def flush(self):
+        """
+        Send the buffered records to the database server
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.records:
+                records, self.records = self.records, []
+                dbcmd('log_many', records)
+
+    def close(self):
+        self.flush()
+        super().close()
 
 
 @contextmanager
@@ -144,6 +241,7 @@ def handle(job_id, log_level='info', log_file=None):
                 os.path.getsize(log_file) == 0):
             logging.root.warn('The log file %s is empty!?' % log_file)
         for handler in handlers:
+            handler.flush()
             logging.root.removeHandler(handler)
 
 
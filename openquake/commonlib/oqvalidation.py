@@ -17,11 +17,13 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import logging
 import functools
 import multiprocessing
 import numpy
 
+from openquake.baselib import hdf5
 from openquake.baselib.general import DictArray, AccumDict
 from openquake.hazardlib.imt import from_string
 from openquake.hazardlib import correlation, stats, calc
@@ -99,6 +101,8 @@ class OqParam(valid.ParamSet):
     avg_losses = valid.Param(valid.boolean, True)
     base_path = valid.Param(valid.utf8, '.')
     calculation_mode = valid.Param(valid.Choice())  # -> get_oqparam
+    checkpoint_every = valid.Param(valid.positivefloat, 0)
+    collapse_ctxs = valid.Param(valid.boolean, False)
     collapse_gsim_logic_tree = valid.Param(valid.namelist, [])
     collapse_threshold = valid.Param(valid.probability, 0.5)
     coordinate_bin_width = valid.Param(valid.positivefloat)
@@ -108,6 +112,7 @@ class OqParam(valid.ParamSet):
     conditional_loss_poes = valid.Param(valid.probabilities, [])
     continuous_fragility_discretization = valid.Param(valid.positiveint, 20)
     cross_correlation = valid.Param(valid.Choice('yes', 'no', 'full'), 'yes')
+    dataset_layouts = valid.Param(valid.dictionary, {})
     description = valid.Param(valid.utf8_not_empty)
     disagg_by_src = valid.Param(valid.boolean, False)
     disagg_outputs = valid.Param(valid.disagg_outputs, None)
@@ -120,6 +125,7 @@ class OqParam(valid.ParamSet):
     export_multi_curves = valid.Param(valid.boolean, False)
     exports = valid.Param(valid.export_formats, ())
     filter_distance = valid.Param(valid.Choice('rrup'), None)
+    gmf_task_files = valid.Param(valid.boolean, False)
     ground_motion_correlation_model = valid.Param(
         valid.NoneOr(valid.Choice(*GROUND_MOTION_CORRELATION_MODELS)), None)
     ground_motion_correlation_params = valid.Param(valid.dictionary, {})
@@ -164,7 +170,9 @@ class OqParam(valid.ParamSet):
     num_rlzs_disagg = valid.Param(valid.positiveint, 1)
     poes = valid.Param(valid.probabilities, [])
     poes_disagg = valid.Param(valid.probabilities, [])
+    poes_float32 = valid.Param(valid.boolean, False)
     pointsource_distance = valid.Param(valid.floatdict, {'default': {}})
+    profile_tasks = valid.Param(valid.probability, 0)
     quantile_hazard_curves = quantiles = valid.Param(valid.probabilities, [])
     random_seed = valid.Param(valid.positiveint, 42)
     reference_depth_to_1pt0km_per_sec = valid.Param(
@@ -206,6 +214,8 @@ class OqParam(valid.ParamSet):
     taxonomies_from_model = valid.Param(valid.boolean, False)
     time_event = valid.Param(str, None)
     truncation_level = valid.Param(valid.NoneOr(valid.positivefloat), None)
+    truncnorm_maxerr = valid.Param(
+        valid.NoneOr(valid.compose(valid.positivefloat, valid.nonzero)), None)
     uniform_hazard_spectra = valid.Param(valid.boolean, False)
     vs30_tolerance = valid.Param(valid.positiveint, 0)
     width_of_mfd_bin = valid.Param(valid.positivefloat, None)
@@ -735,6 +745,25 @@ class OqParam(valid.ParamSet):
         else:
             return True
 
+    def is_valid_dataset_layouts(self):
+        """
+        Invalid dataset_layouts={dataset_layouts}: {error}
+        """
+        for regex, spec in self.dataset_layouts.items():
+            try:
+                re.compile(regex)
+                hdf5.parse_layout(spec)
+            except Exception as exc:
+                self.error = str(exc)
+                return False
+        return True
+
+    def is_valid_gmf_task_files(self):
+        """
+        gmf_task_files cannot be used together with checkpoint_every
+        """
+        return not (self.gmf_task_files and self.checkpoint_every)
+
     def is_valid_maximum_distance(self):
         """
         Invalid maximum_distance={maximum_distance}: {error}
@@ -634,7 +634,8 @@ def get_composite_source_model(oqparam, h5=None):
         for src in sg:
             eri = src.grp_ids[0] % n
             data.append((eri, src.grp_ids[0], src.source_id, src.code,
-                         src.num_ruptures, 0, 0, 0, src.checksum, src._wkt))
+                         src.num_ruptures, 0, 0, 0, src.checksum, src._wkt,
+                         1))
             if hasattr(src, 'mags'):  # UCERF
                 srcmags = ['%.2f' % mag for mag in src.mags]
             elif hasattr(src, 'data'):  # nonparametric
@@ -42,6 +42,7 @@ source_info_dt = numpy.dtype([
     ('eff_ruptures', numpy.float32),   # 7
     ('checksum', numpy.uint32),        # 8
     ('wkt', hdf5.vstr),                # 9
+    ('collapse_ratio', numpy.float32),  # 10
 ])
 
 
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import pickle
+import logging
+import threading
+import unittest
+import unittest.mock as mock
+from openquake.baselib import zeromq
+from openquake.commonlib import logs
+
+
+def record(level, msg):
+    return logging.makeLogRecord(
+        dict(levelno=level, levelname=logging.getLevelName(level), msg=msg))
+
+
+class LogDatabaseHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(logs, 'dbcmd')
+        self.dbcmd = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent(self):
+        # the messages sent with each log_many command
+        return [[rec[-1] for rec in args[1]]
+                for args, _ in self.dbcmd.call_args_list
+                if args[0] == 'log_many']
+
+    def test_batch_size(self):
+        handler = logs.LogDatabaseHandler(1, batch_size=3, interval=60)
+        for i in range(7):
+            handler.handle(record(logging.INFO, 'msg%d' % i))
+        self.assertEqual(self.sent(), [['msg0', 'msg1', 'msg2'],
+                                       ['msg3', 'msg4', 'msg5']])
+        handler.close()
+        self.assertEqual(self.sent()[-1], ['msg6'])
+
+    def test_interval(self):
+        handler = logs.LogDatabaseHandler(1, batch_size=100, interval=.05)
+        handler.handle(record(logging.INFO, 'msg0'))
+        handler.handle(record(logging.INFO, 'msg1'))
+        self.assertEqual(self.sent(), [])
+        for _ in range(100):  # wait for the timer
+            if self.sent():
+                break
+            time.sleep(.05)
+        self.assertEqual(self.sent(), [['msg0', 'msg1']])
+        self.assertIsNone(handler.timer)
+
+    def test_level(self):
+        handler = logs.LogDatabaseHandler(1, batch_size=100, interval=60)
+        handler.handle(record(logging.DEBUG, 'debug'))  # not stored
+        handler.handle(record(logging.INFO, 'info'))
+        self.assertEqual(self.sent(), [])
+        handler.handle(record(logging.WARNING, 'warning'))
+        self.assertEqual(self.sent(), [['info', 'warning']])
+        handler.close()
+        self.assertEqual(len(self.sent()), 1)  # nothing left to send
+
+    def test_flush_on_exit(self):
+        with mock.patch.object(logs, 'init'), logs.handle(1):
+            [handler] = [h for h in logging.root.handlers
+                         if isinstance(h, logs.LogDatabaseHandler)]
+            handler.handle(record(logging.INFO, 'msg'))
+            self.assertEqual(self.sent(), [])
+        self.assertEqual(self.sent(), [['msg']])
+        self.assertNotIn(handler, logging.root.handlers)
+
+
+class DbClientTestCase(unittest.TestCase):
+    def test_timeout(self):
+        # a server not replying to the first request
+        sock = zeromq.context.socket(zeromq.zmq.ROUTER)
+        port = sock.bind_to_random_port('tcp://127.0.0.1')
+
+        def serve():
+            for reply in [None, 'pong']:
+                ident, empty, _ = sock.recv_multipart()
+                if reply:
+                    sock.send_multipart([ident, empty, pickle.dumps(reply)])
+        thread = threading.Thread(target=serve)
+        thread.start()
+        client = logs.DbClient('127.0.0.1', port, timeout=.1)
+        with self.assertRaises(TimeoutError):
+            client('ping')
+        # the socket has been discarded and a new one is used
+        self.assertEqual(client('ping'), 'pong')
+        thread.join()
+        client.close()
+        sock.close(linger=0)
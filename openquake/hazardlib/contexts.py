@@ -26,7 +26,7 @@ import numpy
 from scipy.interpolate import interp1d
 
 
-from openquake.baselib.general import AccumDict, DictArray
+from openquake.baselib.general import AccumDict, DictArray, block_splitter
 from openquake.baselib.performance import Monitor
 from openquake.hazardlib import imt as imt_module
 from openquake.hazardlib.gsim import base
@@ -36,6 +36,9 @@ from openquake.hazardlib.geo.surface import PlanarSurface
 
 I16 = numpy.int16
 F32 = numpy.float32
+F64 = numpy.float64
+MAX_BATCH = 1E6  # maximum size of the (N, L, G) poes array for a batch
+MAX_PENDING = 5E5  # maximum number of sites in the contexts to collapse
 KNOWN_DISTANCES = frozenset(
     'rrup rx ry0 rjb rhypo repi rcdpp azimuth azimuth_cp rvolc'.split())
 
@@ -145,6 +148,9 @@ class ContextMaker(object):
             param.get('maximum_distance') or IntegrationDistance({}))
         self.trunclevel = param.get('truncation_level')
         self.effect = param.get('effect')
+        self.poes_dtype = F32 if param.get('poes_float32') else F64
+        self.truncnorm_maxerr = param.get('truncnorm_maxerr')
+        self.collapse_ctxs = param.get('collapse_ctxs', False)
         for req in self.REQUIRES:
             reqset = set()
             for gsim in gsims:
@@ -314,8 +320,9 @@ class ContextMaker(object):
         L, G = len(imtls.array), len(self.gsims)
         pmap = AccumDict(accum=ProbabilityMap(L, G))
         rup_data = AccumDict(accum=[])
-        # AccumDict of arrays with 3 elements nrups, nsites, calc_time
-        calc_times = AccumDict(accum=numpy.zeros(3, numpy.float32))
+        # AccumDict of arrays with 4 elements nrups, nsites, calc_time,
+        # number of contexts actually computed after collapsing
+        calc_times = AccumDict(accum=numpy.zeros(4, numpy.float32))
         pmaker = PmapMaker(self, srcfilter, group)
         totrups = 0
         src_sites = srcfilter(group)
@@ -332,7 +339,11 @@ class ContextMaker(object):
                 raise etype(msg).with_traceback(tb)
             totrups += poemap.totrups
             calc_times[src.id] += numpy.array(
-                [poemap.numrups, poemap.nsites, time.time() - t0])
+                [poemap.numrups, poemap.nsites, time.time() - t0,
+                 0 if pmaker.collapse_ctxs else poemap.numrups])
+            if pmaker.pending_sites > MAX_PENDING:
+                calc_times += pmaker.flush(pmap)
+        calc_times += pmaker.flush(pmap)
 
         rdata = {k: numpy.array(v) for k, v in rup_data.items()}
         rdata['grp_id'] = numpy.uint16(rup_data['grp_id'])
@@ -347,6 +358,30 @@ def _collapse(rups):
     return [rup]
 
 
+def _batches(ctxs, gsim):
+    # yield lists of indices of contexts with the same rupture parameters
+    acc = AccumDict(accum=[])
+    params = sorted(gsim.REQUIRES_RUPTURE_PARAMETERS)
+    for i, (rup, sctx, dctx) in enumerate(ctxs):
+        acc[tuple(getattr(rup, par) for par in params)].append(i)
+    return acc.values()
+
+
+def _stack_ctxs(ctxs):
+    # stack a list of contexts (rup, sctx, dctx) into a single context;
+    # the rupture parameters are taken from the first rupture
+    rup, sitecol, dctx = ctxs[0]
+    if len(ctxs) == 1:
+        return rup, sitecol, dctx
+    sctx = object.__new__(sitecol.__class__)
+    sctx.array = numpy.concatenate([ctx[1].array for ctx in ctxs])
+    sctx.complete = sitecol.complete
+    dists = DistancesContext(
+        (name, numpy.concatenate([getattr(ctx[2], name) for ctx in ctxs]))
+        for name in vars(dctx))
+    return rup, sctx, dists
+
+
 def _collapse_ctxs(ctxs):
     if len(ctxs) == 1:
         return ctxs
@@ -371,23 +406,64 @@ class PmapMaker(object):
         self.poe_mon = cmaker.mon('get_poes', measuremem=False)
         self.pne_mon = cmaker.mon('composing pnes', measuremem=False)
         self.gmf_mon = cmaker.mon('computing mean_std', measuremem=False)
-
-    def _sids_poes(self, rup, r_sites, dctx, srcid):
-        # return sids and poes of shape (N, L, G)
-        # NB: this must be fast since it is inside an inner loop
+        # buffer for the poes, reused across blocks and sources
+        self.poes_buf = numpy.zeros(0, self.poes_dtype)
+        # contexts waiting to be collapsed across sources, see .flush
+        self.collapse_ctxs = (cmaker.collapse_ctxs and self.rup_indep and
+                              not self.src_mutex)
+        self.pending = []  # pairs (src, ctx)
+        self.pending_sites = 0
+        if self.truncnorm_maxerr and self.trunclevel:
+            self.sf = base.TruncNormSF(
+                self.trunclevel, self.truncnorm_maxerr, self.poes_dtype)
+        else:  # use the exact survival function
+            self.sf = None
+
+    def _gen_poes(self, ctxs):
+        # yield the poes of shape (N, L, G) for each context; the mean and
+        # stddevs of the batched GSIMs are computed with a single call for
+        # each group of contexts with the same rupture parameters
+        # NB: this must be fast since it is inside an inner loop; the poes
+        # are views over self.poes_buf, valid only until the next call
+        slices = []
+        start = 0
+        for rup, r_sites, dctx in ctxs:
+            slices.append(slice(start, start + len(r_sites)))
+            start += len(r_sites)
+        M, G = len(self.imts), len(self.gsims)
         with self.gmf_mon:
-            mean_std = base.get_mean_std(  # shape (2, N, M, G)
-                r_sites, rup, dctx, self.imts, self.gsims)
+            mean_std = numpy.zeros((2, start, M, G))
+            for g, gsim in enumerate(self.gsims):
+                if gsim.batched and len(ctxs) > 1:
+                    for idxs in _batches(ctxs, gsim):
+                        rup, sctx, dctx = _stack_ctxs([ctxs[i] for i in idxs])
+                        rows = numpy.concatenate(
+                            [numpy.arange(slices[i].start, slices[i].stop)
+                             for i in idxs])
+                        mean_std[:, rows, :, g:g+1] = base.get_mean_std(
+                            sctx, rup, dctx, self.imts, [gsim])
+                else:
+                    for (rup, r_sites, dctx), slc in zip(ctxs, slices):
+                        mean_std[:, slc, :, g:g+1] = base.get_mean_std(
+                            r_sites, rup, dctx, self.imts, [gsim])
         with self.poe_mon:
             ll = self.loglevels
-            poes = base.get_poes(mean_std, ll, self.trunclevel, self.gsims)
+            size = start * len(ll.array) * G
+            if len(self.poes_buf) < size:
+                self.poes_buf = numpy.zeros(size, self.poes_dtype)
+            poes = base.get_poes(
+                mean_std, ll, self.trunclevel, self.gsims,
+                self.poes_buf[:size].reshape(start, len(ll.array), G), self.sf)
             for g, gsim in enumerate(self.gsims):
                 for m, imt in enumerate(ll):
                     if hasattr(gsim, 'weight') and gsim.weight[imt] == 0:
                         # set by the engine when parsing the gsim logictree;
                         # when 0 ignore the gsim: see _build_trts_branches
                         poes[:, ll(imt), g] = 0
-            return r_sites.sids, poes
+        for slc in slices:
+            # the probabilities of no exceedance are computed in double
+            # precision even for float32 poes, since 1 - pne can be tiny
+            yield poes[slc].astype(F64, copy=False)
 
     def _update(self, pmap, pm, src):
         if self.rup_indep:
@@ -424,20 +500,33 @@ class PmapMaker(object):
                     totrups += len(ctxs)
                     ctxs = self.collapse(ctxs)
                     numrups += len(ctxs)
-            for rup, r_sites, dctx in ctxs:
-                if self.fewsites:  # store rupdata
-                    rupdata.add(rup, r_sites, dctx)
-                sids, poes = self._sids_poes(rup, r_sites, dctx, src.id)
-                with self.pne_mon:
-                    pnes = rup.get_probability_no_exceedance(poes)
-                    if self.rup_indep:
-                        for sid, pne in zip(sids, pnes):
-                            poemap.setdefault(sid, self.rup_indep).array *= pne
-                    else:
-                        for sid, pne in zip(sids, pnes):
-                            poemap.setdefault(sid, self.rup_indep).array += (
-                                1.-pne) * rup.weight
-                nsites += len(sids)
+            if self.collapse_ctxs:  # the PoEs are computed in .flush
+                for rup, r_sites, dctx in ctxs:
+                    if self.fewsites:  # store rupdata
+                        rupdata.add(rup, r_sites, dctx)
+                    self.pending.append((src, (rup, r_sites, dctx)))
+                    self.pending_sites += len(r_sites)
+                    nsites += len(r_sites)
+                continue
+            maxsites = max(1, int(MAX_BATCH / L / G))
+            for block in block_splitter(
+                    ctxs, maxsites, weight=lambda ctx: len(ctx[1])):
+                for (rup, r_sites, dctx), poes in zip(
+                        block, self._gen_poes(block)):
+                    if self.fewsites:  # store rupdata
+                        rupdata.add(rup, r_sites, dctx)
+                    with self.pne_mon:
+                        pnes = rup.get_probability_no_exceedance(poes)
+                        if self.rup_indep:
+                            for sid, pne in zip(r_sites.sids, pnes):
+                                poemap.setdefault(
+                                    sid, self.rup_indep).array *= pne
+                        else:
+                            for sid, pne in zip(r_sites.sids, pnes):
+                                poemap.setdefault(
+                                    sid, self.rup_indep).array += (
+                                        1.-pne) * rup.weight
+                    nsites += len(r_sites)
         poemap.totrups = totrups
         poemap.numrups = numrups
         poemap.nsites = nsites
@@ -449,6 +538,66 @@ class PmapMaker(object):
                     rup_data[k].extend(v)
         return poemap
 
+    def flush(self, pmap, precision=1E-3):
+        """
+        Compute the PoEs of the pending contexts of all sources, once for
+        each group of contexts with the same rupture parameters, the same
+        sites and distances equivalent up to 1/1000, and update the pmap.
+
+        :returns: a dictionary src.id -> [0, 0, calc_time, num_contexts]
+            where num_contexts is the number of computed contexts, each
+            one shared in equal parts between the sources producing it
+        """
+        pending, self.pending = self.pending, []
+        self.pending_sites = 0
+        if not pending:
+            return {}
+        t0 = time.time()
+        params = sorted(self.REQUIRES_RUPTURE_PARAMETERS)
+        distmax = max(ctx[2].rrup.max() for src, ctx in pending)
+        ctx_by_key = {}
+        members = AccumDict(accum=[])  # key -> [(src, rup), ...]
+        for src, (rup, sctx, dctx) in pending:
+            tup = [getattr(rup, p) for p in params]
+            tup.append(sctx.sids.tobytes())
+            for name in self.REQUIRES_DISTANCES:
+                dists = getattr(dctx, name)
+                tup.append(I16(dists / distmax / precision).tobytes())
+            key = tuple(tup)
+            ctx_by_key.setdefault(key, (rup, sctx, dctx))
+            members[key].append((src, rup))
+        L, G = len(self.imtls.array), len(self.gsims)
+        pnemap = {}  # grp_id -> ProbabilityMap of probabilities of no exc.
+        maxsites = max(1, int(MAX_BATCH / L / G))
+        for block in block_splitter(
+                ctx_by_key, maxsites, weight=lambda k: len(ctx_by_key[k][1])):
+            ctxs = [ctx_by_key[key] for key in block]
+            for key, (rup, r_sites, dctx), poes in zip(
+                    block, ctxs, self._gen_poes(ctxs)):
+                with self.pne_mon:
+                    rups_by_grp_ids = AccumDict(accum=[])
+                    for src, rup in members[key]:
+                        rups_by_grp_ids[tuple(src.grp_ids)].append(rup)
+                    for grp_ids, rups in rups_by_grp_ids.items():
+                        pnes = rups[0].get_probability_no_exceedance(poes)
+                        for rup in rups[1:]:
+                            pnes *= rup.get_probability_no_exceedance(poes)
+                        for grp_id in grp_ids:
+                            pm = pnemap.setdefault(grp_id,
+                                                   ProbabilityMap(L, G))
+                            for sid, pne in zip(r_sites.sids, pnes):
+                                pm.setdefault(sid, 1.).array *= pne
+        for grp_id, pm in pnemap.items():
+            pmap[grp_id] |= ~pm
+        # share the calculation time and the computed contexts between the
+        # sources proportionally to the number of contexts
+        dt = (time.time() - t0) / len(pending)
+        calc_times = AccumDict(accum=numpy.zeros(4, F32))
+        for srcs in members.values():
+            for src, rup in srcs:
+                calc_times[src.id] += numpy.array([0, 0, dt, 1 / len(srcs)])
+        return calc_times
+
     def collapse(self, ctxs, precision=1E-3):
         """
         Collapse the contexts if the distances are equivalent up to 1/1000
@@ -92,6 +92,9 @@ class AkkarBommer2010(GMPE):
     #: Required distance measure is RRup (eq. 1, page 199).
     REQUIRES_DISTANCES = {'rjb'}
 
+    #: The contexts of ruptures with the same parameters can be stacked
+    batched = True
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
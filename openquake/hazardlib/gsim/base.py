@@ -106,7 +106,8 @@ def get_mean_std(sctx, rctx, dctx, imts, gsims):
     return arr
 
 
-def get_poes(mean_std, loglevels, truncation_level, gsims=()):
+def get_poes(mean_std, loglevels, truncation_level, gsims=(), out=None,
+              sf=None):
     """
     Calculate and return probabilities of exceedance (PoEs) of one or more
     intensity measure levels (IMLs) of one intensity measure type (IMT)
@@ -136,6 +137,12 @@ def get_poes(mean_std, loglevels, truncation_level, gsims=()):
         value and is defined in units of sigmas. The resulting PoEs
         for that mode are values of complementary cumulative distribution
         function of that truncated Gaussian applied to IMLs.
+    :param out:
+        If given, a contiguous array of shape (N, L, G) where to store the
+        PoEs; it can have dtype float32
+    :param sf:
+        If given, a :class:`TruncNormSF` instance for the truncation level,
+        used instead of the exact survival function
 
     :returns:
         array of PoEs of shape (N, L, G)
@@ -164,34 +171,43 @@ def get_poes(mean_std, loglevels, truncation_level, gsims=()):
                     ms = numpy.array(mean_std[:, :, :, g])  # make a copy
                     for m in range(len(loglevels)):
                         ms[0, :, m] += s * gsim.adjustment
-                    outs.append(_get_poes(ms, loglevels, tl, squeeze=1))
+                    outs.append(
+                        _get_poes(ms, loglevels, tl, squeeze=1, sf=sf))
                 arr[:, :, g] = numpy.average(outs, weights=weights, axis=0)
             else:
                 ms = mean_std[:, :, :, g]
-                arr[:, :, g] = _get_poes(ms, loglevels, tl, squeeze=1)
+                arr[:, :, g] = _get_poes(ms, loglevels, tl, squeeze=1, sf=sf)
+        if out is not None:
+            out[:] = arr
+            return out
         return arr
     else:
         # regular case
-        return _get_poes(mean_std, loglevels, truncation_level)
+        return _get_poes(mean_std, loglevels, truncation_level, out=out, sf=sf)
 
 
 # this is the critical function for the performance of the classical calculator
-# it is dominated by memory allocations (i.e. _truncnorm_sf is ultra-fast)
-# the only way to speedup is to reduce the maximum_distance, then the array
-# will become shorted in the N dimension (number of affected sites)
-def _get_poes(mean_std, loglevels, truncation_level, squeeze=False):
+# which used to be dominated by memory allocations; now the PmapMaker passes a
+# preallocated `out` buffer (possibly float32) and both the normalized values
+# and the PoEs are computed in place, possibly with a tabulated TruncNormSF
+def _get_poes(mean_std, loglevels, truncation_level, squeeze=False, out=None,
+              sf=None):
     mean, stddev = mean_std  # shape (N, M, G) each
     N, L, G = len(mean), len(loglevels.array), mean.shape[-1]
-    out = numpy.zeros((N, L) if squeeze else (N, L, G))
-    lvl = 0
+    if out is None:
+        out = numpy.zeros((N, L) if squeeze else (N, L, G))
+    shp = (-1,) + (1,) * (out.ndim - 2)  # levels broadcast on the gsims
     for m, imt in enumerate(loglevels):
-        for iml in loglevels[imt]:
-            if truncation_level == 0:  # just compare imls to mean
-                out[:, lvl] = iml <= mean[:, m]
-            else:
-                out[:, lvl] = (iml - mean[:, m]) / stddev[:, m]
-            lvl += 1
-    return _truncnorm_sf(truncation_level, out)
+        imls = loglevels[imt].reshape(shp)
+        arr = out[:, loglevels(imt)]  # shape (N, L1, G) or (N, L1)
+        if truncation_level == 0:  # just compare imls to mean
+            numpy.less_equal(imls, mean[:, m, None], out=arr)
+        else:
+            numpy.subtract(imls, mean[:, m, None], out=arr)
+            arr /= stddev[:, m, None]
+    if sf is not None and truncation_level:
+        return sf(out, out)
+    return _truncnorm_sf(truncation_level, out, out)
 
 
 class MetaGSIM(abc.ABCMeta):
@@ -310,6 +326,10 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
     non_verified = False
     experimental = False
     adapted = False
+    #: True if the GSIM reads only the declared REQUIRES_* attributes of
+    #: the contexts; then the contexts of different ruptures with the
+    #: same rupture parameters can be stacked and computed in a single call
+    batched = False
     get_poes = staticmethod(get_poes)
 
     @classmethod
@@ -436,7 +456,7 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
         return '[%s]' % self.__class__.__name__
 
 
-def _truncnorm_sf(truncation_level, values):
+def _truncnorm_sf(truncation_level, values, out=None):
     """
     Survival function for truncated normal distribution.
 
@@ -449,6 +469,9 @@ def _truncnorm_sf(truncation_level, values):
     :param values:
         Numpy array of values as input to a survival function for the given
         distribution.
+    :param out:
+        If given, an array where to store the result (possibly `values`
+        itself); in that case no temporary arrays are allocated
     :returns:
         Numpy array of survival function results in a range between 0 and 1.
 
@@ -460,10 +483,13 @@ def _truncnorm_sf(truncation_level, values):
     True
     """
     if truncation_level == 0:
+        if out is not None and out is not values:
+            out[:] = values
+            return out
         return values
 
     if truncation_level is None:
-        return ndtr(- values)
+        return ndtr(numpy.negative(values, out=out), out=out)
 
     # notation from http://en.wikipedia.org/wiki/Truncated_normal_distribution.
     # given that mu = 0 and sigma = 1, we have alpha = a and beta = b.
@@ -489,7 +515,81 @@ def _truncnorm_sf(truncation_level, values):
     # ``SF(x) = (Z - CDF(x) + CDF(a)) / Z``,
     # ``SF(x) = (CDF(b) - CDF(a) - CDF(x) + CDF(a)) / Z``,
     # ``SF(x) = (CDF(b) - CDF(x)) / Z``.
-    return ((phi_b - ndtr(values)) / z).clip(0.0, 1.0)
+    if out is None:
+        return ((phi_b - ndtr(values)) / z).clip(0.0, 1.0)
+    ndtr(values, out=out)
+    numpy.subtract(phi_b, out, out=out)
+    out /= z
+    return numpy.clip(out, 0.0, 1.0, out=out)
+
+
+class TruncNormSF(object):
+    """
+    Survival function of the truncated normal distribution, with the same
+    conventions as :func:`_truncnorm_sf`, tabulated on a regular grid
+    in the range [-truncation_level, truncation_level] and evaluated by
+    linear interpolation. The step of the grid is chosen so that the
+    interpolation error is below `maxerr`; with `dtype=numpy.float32` the
+    rounding adds a further error of the order of 1E-7.
+
+    The object keeps its temporary arrays and reuses them across calls,
+    so it must not be shared between threads.
+
+    >>> sf = TruncNormSF(3)
+    >>> xs = numpy.linspace(-4, 4, 10001)
+    >>> float(numpy.abs(sf(xs) - _truncnorm_sf(3, xs)).max()) < 1E-6
+    True
+    """
+    def __init__(self, truncation_level, maxerr=1E-6, dtype=numpy.float64):
+        if not truncation_level or truncation_level < 0:
+            raise ValueError('Cannot tabulate the SF for truncation_level=%s'
+                             % truncation_level)
+        self.truncation_level = tl = truncation_level
+        self.maxerr = maxerr
+        self.dtype = dtype
+        # the error of the linear interpolation is bounded by h**2/8 * |f''|
+        # and |f''(x)| = |x| exp(-x**2/2) / sqrt(2 pi) / z <= pdf(1) / z
+        z = ndtr(tl) * 2 - 1
+        pdf1 = math.exp(-.5) / math.sqrt(2 * math.pi)
+        step = math.sqrt(8 * maxerr * z / pdf1)
+        self.num = num = int(math.ceil(2 * tl / step))
+        self.scale = num / (2 * tl)
+        ys = _truncnorm_sf(tl, numpy.linspace(-tl, tl, num + 1))
+        self.ys = ys.astype(dtype)
+        self.dys = numpy.append(numpy.diff(ys), 0).astype(dtype)
+        self.idx = numpy.zeros(0, numpy.int32)
+        self.tmp = numpy.zeros(0, dtype)
+
+    def __call__(self, values, out=None):
+        """
+        :param values: a contiguous array of normalized values
+        :param out: an array where to store the result (possibly `values`)
+        :returns: the array `out`, or a new array if `out` is None
+        """
+        if out is None:
+            out = numpy.zeros(values.shape, self.dtype)
+        size = values.size
+        if len(self.idx) < size:
+            self.idx = numpy.zeros(size, numpy.int32)
+            self.tmp = numpy.zeros(size, self.dtype)
+        idx, tmp = self.idx[:size], self.tmp[:size]
+        vals = out.reshape(-1)
+        # position in the grid: t = (x + tl) * scale clipped to [0, num]
+        numpy.add(values.reshape(-1), self.truncation_level, out=vals)
+        vals *= self.scale
+        numpy.clip(vals, 0, self.num, out=vals)
+        numpy.copyto(idx, vals, casting='unsafe')  # floor, since t >= 0
+        vals -= idx  # fractional part
+        numpy.take(self.dys, idx, out=tmp, mode='clip')
+        vals *= tmp
+        numpy.take(self.ys, idx, out=tmp, mode='clip')
+        vals += tmp
+        return out
+
+    def __repr__(self):
+        return '<%s tl=%s, maxerr=%s, %d points>' % (
+            self.__class__.__name__, self.truncation_level, self.maxerr,
+            self.num + 1)
 
 
 def to_distribution_values(vals, imt):
@@ -650,13 +750,23 @@ class CoeffsTable(object):
     ...           imt.PGA(): {"a": 0.1, "b": 1.0},
     ...           imt.PGV(): {"a": 0.5, "b": 10.0}}
     >>> ct = CoeffsTable(sa_damping=5, table=coeffs)
+
+    Internally the coefficients are stored in a 2D array with a row per
+    IMT and a column per coefficient, in the order of `.columns`, which
+    is used to interpolate the SA coefficients; the interpolated
+    dictionaries are cached:
+
+    >>> ct.columns
+    ('a', 'b')
+    >>> '%.5f' % ct[imt.SA(0.5)]['a']
+    '2.39794'
     """
     num_instances = 0
 
     def __init__(self, **kwargs):
         if 'table' not in kwargs:
             raise TypeError('CoeffsTable requires "table" kwarg')
-        self._coeffs = {}  # cache
+        self._coeffs = {}  # cache imt -> dict
         table = kwargs.pop('table')
         self.sa_coeffs = {}
         self.non_sa_coeffs = {}
@@ -674,8 +784,30 @@ class CoeffsTable(object):
         else:
             raise TypeError("CoeffsTable cannot be constructed with inputs "
                             "of the form '%s'" % table.__class__.__name__)
+        self._setup_array()
         self.__class__.num_instances += 1
 
+    def _setup_array(self):
+        # build a 2D array with a row per IMT; the SA rows are sorted by
+        # damping and period, to make the interpolation easy
+        self._sa_imts = sorted(self.sa_coeffs,
+                               key=lambda imt: (imt.damping, imt.period))
+        imts = list(self.non_sa_coeffs) + self._sa_imts
+        rows = [self.non_sa_coeffs[imt] for imt in self.non_sa_coeffs] + [
+            self.sa_coeffs[imt] for imt in self._sa_imts]
+        self.columns = tuple(rows[0]) if rows and isinstance(
+            rows[0], dict) else ()
+        self._idx = {imt: i for i, imt in enumerate(imts)}
+        if all(isinstance(row, dict) and tuple(row) == self.columns
+               for row in rows):
+            self._array = numpy.array(
+                [[row[col] for col in self.columns] for row in rows],
+                numpy.float64).reshape(len(rows), len(self.columns))
+        else:
+            # the table was instantiated from a dictionary imt -> scalar
+            # and it cannot be interpolated
+            self._array = None
+
     def _setup_table_from_str(self, table, sa_damping):
         """
         Builds the input tables from a string definition
@@ -706,6 +838,39 @@ class CoeffsTable(object):
                 imt = imt_module.SA(sa_period, sa_damping)
                 self.sa_coeffs[imt] = imt_coeffs
 
+    def _get_row(self, imt):
+        # return the array of coefficients for the given IMT, possibly
+        # interpolated in a logarithmic scale of periods
+        if self._array is None:
+            raise TypeError('The coefficients are not dictionaries of floats')
+        try:
+            row = self._array[self._idx[imt]]
+        except KeyError:
+            if imt.name != 'SA':
+                raise KeyError(imt)
+            max_below = min_above = None
+            for i, sa in enumerate(self._sa_imts):  # sorted by period
+                if sa.damping != imt.damping:
+                    continue
+                elif sa.period < imt.period:
+                    max_below = i
+                elif sa.period > imt.period:
+                    min_above = i
+                    break
+            if max_below is None or min_above is None:
+                raise KeyError(imt)
+            below = self._sa_imts[max_below]
+            above = self._sa_imts[min_above]
+            # ratio tends to 1 when target period tends to a minimum
+            # known period above and to 0 if target period is close
+            # to maximum period below.
+            ratio = ((math.log(imt.period) - math.log(below.period))
+                     / (math.log(above.period) - math.log(below.period)))
+            lo = self._array[self._idx[below]]
+            hi = self._array[self._idx[above]]
+            row = (hi - lo) * ratio + lo
+        return row
+
     def __getitem__(self, imt):
         """
         Return a dictionary of coefficients corresponding to ``imt``
@@ -723,35 +888,10 @@ class CoeffsTable(object):
         except KeyError:
             pass
         if imt.name != 'SA':
-            self._coeffs[imt] = c = self.non_sa_coeffs[imt]
-            return c
-        try:
-            self._coeffs[imt] = c = self.sa_coeffs[imt]
-            return c
-        except KeyError:
-            pass
-
-        max_below = min_above = None
-        for unscaled_imt in list(self.sa_coeffs):
-            if unscaled_imt.damping != imt.damping:
-                continue
-            if unscaled_imt.period > imt.period:
-                if min_above is None or unscaled_imt.period < min_above.period:
-                    min_above = unscaled_imt
-            elif unscaled_imt.period < imt.period:
-                if max_below is None or unscaled_imt.period > max_below.period:
-                    max_below = unscaled_imt
-        if max_below is None or min_above is None:
-            raise KeyError(imt)
-
-        # ratio tends to 1 when target period tends to a minimum
-        # known period above and to 0 if target period is close
-        # to maximum period below.
-        ratio = ((math.log(imt.period) - math.log(max_below.period))
-                 / (math.log(min_above.period) - math.log(max_below.period)))
-        max_below = self.sa_coeffs[max_below]
-        min_above = self.sa_coeffs[min_above]
-        self._coeffs[imt] = c = {
-            co: (min_above[co] - max_below[co]) * ratio + max_below[co]
-            for co in max_below}
+            c = self.non_sa_coeffs[imt]
+        elif imt in self.sa_coeffs:
+            c = self.sa_coeffs[imt]
+        else:
+            c = dict(zip(self.columns, self._get_row(imt).tolist()))
+        self._coeffs[imt] = c
         return c
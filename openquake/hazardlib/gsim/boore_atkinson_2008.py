@@ -72,6 +72,9 @@ class BooreAtkinson2008(GMPE):
     #: See paragraph 'Predictor Variables', pag 103
     REQUIRES_DISTANCES = {'rjb'}
 
+    #: The contexts of ruptures with the same parameters can be stacked
+    batched = True
+
     #: Shear-wave velocity for reference soil conditions in [m s-1]
     DEFINED_FOR_REFERENCE_VELOCITY = 760.
 
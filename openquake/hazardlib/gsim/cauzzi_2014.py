@@ -86,6 +86,9 @@ class CauzziEtAl2014(GMPE):
     #: Required distance measure is Rrup,
     REQUIRES_DISTANCES = {'rrup'}
 
+    #: The contexts of ruptures with the same parameters can be stacked
+    batched = True
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
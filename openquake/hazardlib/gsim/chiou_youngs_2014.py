@@ -68,6 +68,9 @@ class ChiouYoungs2014(GMPE):
     #: Required distance measures are RRup, Rjb and Rx.
     REQUIRES_DISTANCES = {'rrup', 'rjb', 'rx'}
 
+    #: The contexts of ruptures with the same parameters can be stacked
+    batched = True
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
@@ -23,6 +23,9 @@ in the form of binary tables, and
 :class:`openquake.hazardlib.gsim.gmpe_table.AmplificationTable` for defining
 the corresponding amplification of the IMLs
 """
+import io
+import os
+import zlib
 from copy import deepcopy
 
 import h5py
@@ -30,6 +33,7 @@ from scipy.interpolate import interp1d
 import numpy
 
 from openquake.baselib.python3compat import decode
+from openquake.baselib.parallel import oq_distribute
 from openquake.hazardlib import const, site
 from openquake.hazardlib import imt as imt_module
 from openquake.hazardlib.contexts import RuptureContext
@@ -37,6 +41,104 @@ from openquake.hazardlib.gsim.base import GMPE
 from openquake.baselib.python3compat import round
 
 
+# (path, checksum) -> TableGroup; the tables are read once per process
+# and shared by all the GMPETable instances using them
+_tables = {}
+# (path, st_mtime_ns, st_size) -> checksum, to avoid reading the files again
+_checksums = {}
+# distributions where the workers may run on machines without the files
+REMOTE_DISTRIBUTE = ('zmq', 'celery', 'dask')
+
+
+class TableGroup(dict):
+    """
+    A read-only copy of an HDF5 group, supporting the same path syntax
+    (i.e. group["IMLs/SA"]). The contiguous datasets of real files are
+    memory-mapped, so that all the processes on a machine share the same
+    pages of the operating system cache; the other datasets are read
+    in memory.
+
+    :attr attrs:
+        the attributes of the group
+    :attr dset_attrs:
+        a dictionary name -> attributes for the datasets in the group
+    :attr amplification:
+        the :class:`AmplificationTable` built from the subgroup
+        "Amplification", if any, shared by all the GMPETable instances
+    """
+    amplification = None
+
+    def __init__(self, h5group, fname=None):
+        self.attrs = dict(h5group.attrs)
+        self.dset_attrs = {}
+        for name, obj in h5group.items():
+            if isinstance(obj, h5py.Group):
+                self[name] = TableGroup(obj, fname)
+            else:
+                self[name] = _read_dset(obj, fname)
+                self.dset_attrs[name] = dict(obj.attrs)
+
+    def __getitem__(self, path):
+        obj = self
+        for name in path.split('/'):
+            obj = dict.__getitem__(obj, name)
+        return obj
+
+
+def _read_dset(dset, fname):
+    # returns a read-only array, memory-mapped if possible
+    offset = dset.id.get_offset()
+    if fname and dset.shape and dset.chunks is None and offset is not None:
+        return numpy.memmap(fname, dset.dtype, 'r', offset,
+                            dset.shape).view(numpy.ndarray)
+    arr = numpy.array(dset[()])
+    arr.flags.writeable = False
+    return arr
+
+
+def get_checksum(fname):
+    """
+    :param fname: the path of a file or a BytesIO object
+    :returns: the adler32 checksum of the content
+    """
+    if isinstance(fname, io.BytesIO):
+        return zlib.adler32(fname.getbuffer())
+    stat = os.stat(fname)
+    key = os.path.abspath(fname), stat.st_mtime_ns, stat.st_size
+    try:
+        return _checksums[key]
+    except KeyError:
+        pass
+    checksum = 1
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            checksum = zlib.adler32(chunk, checksum)
+    _checksums[key] = checksum
+    return checksum
+
+
+def read_table(fname, key=None):
+    """
+    Read a GMPE table or return it from the registry of the current process
+
+    :param fname: the path of an HDF5 file or a BytesIO object
+    :param key: the pair (path, checksum) of the table, if known
+    :returns: a pair (key, TableGroup)
+    """
+    path = '' if isinstance(fname, io.BytesIO) else os.path.abspath(fname)
+    if key is None:
+        key = path, get_checksum(fname)
+    try:
+        return key, _tables[key]
+    except KeyError:
+        if key[1] != get_checksum(fname):
+            raise ValueError('The GMPE table %s has changed' % (path or
+                                                                 fname))
+    with h5py.File(fname, 'r') as fle:
+        _tables[key] = group = TableGroup(fle, path)
+    return key, group
+
+
 def hdf_arrays_to_dict(hdfgroup):
     """
     Convert an hdf5 group contains only data sets to a dictionary of
@@ -51,6 +153,60 @@ def hdf_arrays_to_dict(hdfgroup):
     return {key: hdfgroup[key][:] for key in hdfgroup}
 
 
+def apply_magnitude_interpolation(mag, iml_table, m_w):
+    """
+    Interpolates the tables to the required magnitude level
+
+    :param float mag:
+        Magnitude
+    :param iml_table:
+        Intensity measure level table
+    :param m_w:
+        Magnitudes of the table
+    """
+    # do not allow "mag" to exceed maximum table magnitude
+    if mag > m_w[-1]:
+        mag = m_w[-1]
+
+    # Get magnitude values
+    if mag < m_w[0] or mag > m_w[-1]:
+        raise ValueError("Magnitude %.2f outside of supported range "
+                         "(%.2f to %.2f)" % (mag, m_w[0], m_w[-1]))
+    # It is assumed that log10 of the spectral acceleration scales
+    # linearly (or approximately linearly) with magnitude
+    m_interpolator = interp1d(m_w, numpy.log10(iml_table), axis=1)
+    return 10.0 ** m_interpolator(mag)
+
+
+def get_mean(data, dists, distances):
+    """
+    Returns the mean intensity measure level from the tables
+
+    :param data:
+        The intensity measure level vector for the given magnitude and IMT
+    :param dists:
+        The distance vector for the given magnitude and IMT
+    :param distances:
+        The distances of the sites
+    """
+    # For values outside of the interpolation range use -999. to ensure
+    # value is identifiable and outside of potential real values
+    interpolator_mean = interp1d(dists, data,
+                                 bounds_error=False,
+                                 fill_value=-999.)
+    mean = interpolator_mean(distances)
+    # For those distances less than or equal to the shortest distance
+    # extrapolate the shortest distance value
+    mean[distances < (dists[0] + 1.0E-3)] = data[0]
+    # For those distances significantly greater than the furthest distance
+    # set to 1E-20.
+    mean[distances > (dists[-1] + 1.0E-3)] = 1E-20
+    # If any distance is between the final distance and a margin of 0.001
+    # km then assign to smallest distance
+    mean[mean < -1.] = data[-1]
+    return mean
+
+
 class AmplificationTable(object):
     """
     Class to apply amplification from the GMPE tables.
@@ -309,31 +465,58 @@ class GMPETable(GMPE):
         """
         super().__init__(**kwargs)
         fname = self.kwargs.get('gmpe_table', self.gmpe_table)
-        with h5py.File(fname, "r") as fle:
-            self.distance_type = decode(fle["Distances"].attrs["metric"])
-            self.REQUIRES_DISTANCES = set([self.distance_type])
-            # Load in magnitude
-            self.m_w = fle["Mw"][:]
-            # Load in distances
-            self.distances = fle["Distances"][:]
-            # Load intensity measure types and levels
-            self.imls = hdf_arrays_to_dict(fle["IMLs"])
-            self.DEFINED_FOR_INTENSITY_MEASURE_TYPES = set(
-                self._supported_imts())
-            if "SA" in self.imls and "T" not in self.imls:
-                raise ValueError("Spectral Acceleration must be accompanied by"
-                                 " periods")
-            # Get the standard deviations
-            self._setup_standard_deviations(fle)
-            if "Amplification" in fle:
-                self._setup_amplification(fle)
+        self._table_key, self._table = read_table(fname)
+        self._setup_tables(self._table)
+
+    def _setup_tables(self, fle):
+        """
+        Set the tables from the given :class:`TableGroup`
+        """
+        self.distance_type = decode(fle.dset_attrs["Distances"]["metric"])
+        self.REQUIRES_DISTANCES = set([self.distance_type])
+        # Load in magnitude
+        self.m_w = fle["Mw"][:]
+        # Load in distances
+        self.distances = fle["Distances"][:]
+        # Load intensity measure types and levels
+        self.imls = hdf_arrays_to_dict(fle["IMLs"])
+        self.DEFINED_FOR_INTENSITY_MEASURE_TYPES = set(
+            self._supported_imts())
+        if "SA" in self.imls and "T" not in self.imls:
+            raise ValueError("Spectral Acceleration must be accompanied by"
+                             " periods")
+        # Get the standard deviations
+        self._setup_standard_deviations(fle)
+        if "Amplification" in fle:
+            self._setup_amplification(fle)
+
+    def __getstate__(self):
+        # the tables are not pickled: only their key is sent and the
+        # tables are read from the registry or from the file in the
+        # receiving process; if the workers may run on other machines,
+        # possibly without the file, the tables are sent too
+        state = {k: v for k, v in self.__dict__.items()
+                 if k not in ('_table', 'm_w', 'distances', 'imls',
+                              'stddevs', 'amplification')}
+        if oq_distribute() in REMOTE_DISTRIBUTE:
+            state['_table'] = self._table
+        return state
+
+    def __setstate__(self, state):
+        table = state.pop('_table', None)
+        self.__dict__.update(state)
+        if table is not None:  # sent with the instance
+            _tables.setdefault(self._table_key, table)
+        fname = self.kwargs.get('gmpe_table', self.gmpe_table)
+        _, self._table = read_table(fname, self._table_key)
+        self._setup_tables(self._table)
 
     def _setup_standard_deviations(self, fle):
         """
         Reads the standard deviation tables from hdf5 and stores them in
         memory
         :param fle:
-            HDF5 Tables as instance of :class:`h5py.File`
+            HDF5 Tables as instance of :class:`TableGroup`
         """
         # Load in total standard deviation
         self.stddevs = {}
@@ -351,11 +534,17 @@ class GMPETable(GMPE):
     def _setup_amplification(self, fle):
         """
         If amplification data is specified then reads into memory and updates
-        the required rupture and site parameters
+        the required rupture and site parameters. The amplification arrays
+        are built only once and stored in the TableGroup in the registry.
         """
-        self.amplification = AmplificationTable(fle["Amplification"],
-                                                self.m_w,
-                                                self.distances)
+        if fle.amplification is None:
+            amp = AmplificationTable(fle["Amplification"], self.m_w,
+                                     self.distances)
+            for dic in [amp.mean] + list(amp.sigma.values()):
+                for arr in dic.values():
+                    arr.flags.writeable = False  # shared by the instances
+            fle.amplification = amp
+        self.amplification = fle.amplification
         if self.amplification.element == "Sites":
             self.REQUIRES_SITES_PARAMETERS = set(
                 [self.amplification.parameter])
@@ -421,22 +610,7 @@ class GMPETable(GMPE):
         :param distances:
             The distance vector for the given magnitude and IMT
         """
-        # For values outside of the interpolation range use -999. to ensure
-        # value is identifiable and outside of potential real values
-        interpolator_mean = interp1d(dists, data,
-                                     bounds_error=False,
-                                     fill_value=-999.)
-        mean = interpolator_mean(getattr(dctx, self.distance_type))
-        # For those distances less than or equal to the shortest distance
-        # extrapolate the shortest distance value
-        mean[getattr(dctx, self.distance_type) < (dists[0] + 1.0E-3)] = data[0]
-        # For those distances significantly greater than the furthest distance
-        # set to 1E-20.
-        mean[getattr(dctx, self.distance_type) > (dists[-1] + 1.0E-3)] = 1E-20
-        # If any distance is between the final distance and a margin of 0.001
-        # km then assign to smallest distance
-        mean[mean < -1.] = data[-1]
-        return mean
+        return get_mean(data, dists, getattr(dctx, self.distance_type))
 
     def _get_stddevs(self, dists, mag, dctx, imt, stddev_types):
         """
@@ -513,17 +687,4 @@ class GMPETable(GMPE):
         :param iml_table:
             Intensity measure level table
         """
-        # do not allow "mag" to exceed maximum table magnitude
-        if mag > self.m_w[-1]:
-            mag = self.m_w[-1]
-
-        # Get magnitude values
-        if mag < self.m_w[0] or mag > self.m_w[-1]:
-            raise ValueError("Magnitude %.2f outside of supported range "
-                             "(%.2f to %.2f)" % (mag,
-                                                 self.m_w[0],
-                                                 self.m_w[-1]))
-        # It is assumed that log10 of the spectral acceleration scales
-        # linearly (or approximately linearly) with magnitude
-        m_interpolator = interp1d(self.m_w, numpy.log10(iml_table), axis=1)
-        return 10.0 ** m_interpolator(mag)
+        return apply_magnitude_interpolation(mag, iml_table, self.m_w)
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module exports :class:`TabulatedGSIM`, which wraps a slow GSIM and
+interpolates its mean and standard deviations from tables built on the fly.
+The syntax to use in the logic tree file is as in this example::
+
+              <logicTreeBranch branchID="b1">
+                <uncertaintyModel>
+                  [TabulatedGSIM]
+                  tolerance = 0.01
+                  rupture_steps.hypo_depth = 2.0
+                  site_steps.vs30 = 10.0
+                  gmpe.ZhaoEtAl2006SInter = {}
+                </uncertaintyModel>
+                <uncertaintyWeight>1</uncertaintyWeight>
+              </logicTreeBranch>
+"""
+import logging
+import numpy
+from openquake.hazardlib import const
+from openquake.hazardlib.contexts import (
+    RuptureContext, SitesContext, DistancesContext)
+from openquake.hazardlib.gsim.base import GMPE, registry
+from openquake.hazardlib.gsim.gmpe_table import (
+    apply_magnitude_interpolation, get_mean)
+
+MIN_IML = 1E-20  # smaller ground motions are considered zero
+# rupture parameters taking few distinct values in a model, which can be
+# used directly in the keys of the tables; the other parameters (ztor, dip,
+# hypo_depth ...) can be different for each rupture and must be quantized
+DISCRETE_RUPTURE_PARAMETERS = {'rake'}
+# wrapper key -> {(imt, rupture key, site key): table or None};
+# the tables are shared by all the tasks running in the same process
+_tables = {}
+
+
+def _subset(ctx, idxs, num):
+    # returns a copy of the context with only the given sites
+    new = object.__new__(ctx.__class__)
+    for name, value in vars(ctx).items():
+        if isinstance(value, numpy.ndarray) and value.shape[:1] == (num,):
+            value = value[idxs]
+        setattr(new, name, value)
+    return new
+
+
+class TabulatedGSIM(GMPE):
+    """
+    The TabulatedGSIM returns the mean and stddevs of an underlying GSIM by
+    interpolating tables on a (magnitude, distance) grid, with the same
+    interpolation used by :class:`GMPETable`. A table is built the first
+    time it is needed for each IMT and each combination of the other
+    rupture parameters and of the site parameters; then it is checked
+    against the underlying GSIM on random samples and discarded if the
+    error exceeds the tolerance. The underlying GSIM is called directly
+    for the discarded tables, for IMTs other than PGA, PGV and SA and
+    for magnitudes and distances outside of the grid.
+
+    The rupture parameters other than the magnitude and the rake must be
+    quantized with the `rupture_steps` parameter: the tables are built
+    for the multiples of the steps and the random samples of the check
+    cover the full step, so the quantization error is within the tolerance
+    too. GSIMs requiring rupture parameters without a step are refused.
+    The site parameters can be quantized in the same way with the
+    `site_steps` parameter, otherwise a table is built for each distinct
+    combination of their values, until `max_tables` is reached.
+
+    :param gmpe:
+        a dictionary {gsim_name: gsim_params} or the name of a GSIM
+    :param tolerance:
+        maximum error on the natural logarithm of the mean and on the
+        standard deviations
+    :param min_mag, max_mag, mag_step:
+        magnitude grid
+    :param min_distance, max_distance, num_distances, distance_step:
+        logarithmic distance grid in km, refined so that two consecutive
+        distances never differ by more than `distance_step`
+    :param num_samples:
+        number of random magnitudes and distances used in the check
+    :param max_tables:
+        maximum number of tables kept in memory for each TabulatedGSIM
+    :param rupture_steps:
+        a dictionary rupture parameter -> quantization step
+    :param site_steps:
+        a dictionary site parameter -> quantization step
+    """
+    experimental = True
+
+    #: Supported tectonic region type is undefined
+    DEFINED_FOR_TECTONIC_REGION_TYPE = ""
+
+    #: Supported intensity measure types will be set from the GSIM
+    DEFINED_FOR_INTENSITY_MEASURE_TYPES = set()
+
+    #: Supported intensity measure component will be set from the GSIM
+    DEFINED_FOR_INTENSITY_MEASURE_COMPONENT = const.IMC.HORIZONTAL
+
+    #: Supported standard deviation types will be set from the GSIM
+    DEFINED_FOR_STANDARD_DEVIATION_TYPES = {const.StdDev.TOTAL}
+
+    #: Required site parameters will be set from the GSIM
+    REQUIRES_SITES_PARAMETERS = set()
+
+    #: Required rupture parameters will be set from the GSIM
+    REQUIRES_RUPTURE_PARAMETERS = set()
+
+    #: Required distance metric will be set from the GSIM
+    REQUIRES_DISTANCES = set()
+
+    def __init__(self, gmpe, tolerance=.01, min_mag=3., max_mag=9.5,
+                 mag_step=.1, min_distance=1., max_distance=1000.,
+                 num_distances=100, distance_step=5., num_samples=10,
+                 max_tables=100, rupture_steps=None, site_steps=None):
+        super().__init__(
+            gmpe=gmpe, tolerance=tolerance, min_mag=min_mag,
+            max_mag=max_mag, mag_step=mag_step, min_distance=min_distance,
+            max_distance=max_distance, num_distances=num_distances,
+            distance_step=distance_step, num_samples=num_samples,
+            max_tables=max_tables, rupture_steps=rupture_steps or {},
+            site_steps=site_steps or {})
+        if isinstance(gmpe, str):
+            self.gmpe = registry[gmpe]()
+        else:
+            [(gsim_name, params)] = gmpe.items()
+            self.gmpe = registry[gsim_name](**params)
+        self.set_parameters()
+        if len(self.REQUIRES_DISTANCES) != 1:
+            raise ValueError(
+                '%s cannot be tabulated, since it requires the distances %s'
+                % (self.gmpe, sorted(self.REQUIRES_DISTANCES)))
+        [self.distance_type] = self.REQUIRES_DISTANCES
+        self.rup_params = sorted(self.REQUIRES_RUPTURE_PARAMETERS - {'mag'})
+        steps = rupture_steps or {}
+        missing = (set(self.rup_params) - DISCRETE_RUPTURE_PARAMETERS -
+                   set(steps))
+        if missing:
+            raise ValueError(
+                '%s cannot be tabulated, since it requires the rupture '
+                'parameters %s: set the rupture_steps for them'
+                % (self.gmpe, sorted(missing)))
+        for par, step in steps.items():
+            if not step > 0:
+                raise ValueError('Invalid rupture step %s=%s' % (par, step))
+        self.steps = [steps.get(par, 0) for par in self.rup_params]
+        self.site_params = sorted(self.REQUIRES_SITES_PARAMETERS)
+        site_steps = site_steps or {}
+        for par, step in site_steps.items():
+            if not step > 0:
+                raise ValueError('Invalid site step %s=%s' % (par, step))
+        self.site_steps = [site_steps.get(par, 0) for par in self.site_params]
+        self.stddev_types = sorted(self.DEFINED_FOR_STANDARD_DEVIATION_TYPES)
+        self.tolerance = tolerance
+        self.m_w = numpy.arange(min_mag, max_mag + mag_step / 2, mag_step)
+        ratio = (max_distance / min_distance) ** (1 / (num_distances - 1))
+        dists = [min_distance]
+        while dists[-1] < max_distance:
+            dists.append(min(dists[-1] * ratio, dists[-1] + distance_step,
+                             max_distance))
+        self.dists = numpy.array(dists)
+        self.num_samples = num_samples
+        self.max_tables = max_tables
+        self._key = '%s%r' % (self.__class__.__name__,
+                              sorted(self.kwargs.items()))
+
+    def _contexts(self, rupkey, sitekey, mag, dists):
+        # build fake contexts with the given parameters for all distances
+        rctx = RuptureContext([(par, val) for par, val in zip(
+            self.rup_params, rupkey)])
+        rctx.mag = mag
+        sctx = SitesContext(self.site_params)
+        sctx.sids = numpy.arange(len(dists))
+        for par, (val, dt) in zip(self.site_params, sitekey):
+            setattr(sctx, par, numpy.full(len(dists), val, dt))
+        dctx = DistancesContext([(self.distance_type, dists)])
+        return sctx, rctx, dctx
+
+    def _exact(self, imt, rupkey, sitekey, mag, dists):
+        # returns the log of the mean and the stddevs of the underlying GSIM
+        mean, stddevs = self.gmpe.get_mean_and_stddevs(
+            *self._contexts(rupkey, sitekey, mag, dists), imt,
+            self.stddev_types)
+        return numpy.maximum(mean, numpy.log(MIN_IML)), stddevs
+
+    def _interpolate(self, table, mag, dists, stddev_types):
+        # returns the log of the mean and the stddevs from the table
+        imls = apply_magnitude_interpolation(mag, table['IMLs'], self.m_w)
+        mean = numpy.log(get_mean(imls, self.dists, dists))
+        stddevs = []
+        for stddev_type in stddev_types:
+            sigma = apply_magnitude_interpolation(
+                mag, table[stddev_type], self.m_w)
+            stddevs.append(numpy.interp(dists, self.dists, sigma))
+        return mean, stddevs
+
+    def _get_rupkey(self, rctx):
+        # returns the values of the rupture parameters, quantized
+        return tuple(numpy.round(getattr(rctx, par) / step) * step
+                     if step else getattr(rctx, par)
+                     for par, step in zip(self.rup_params, self.steps))
+
+    def _sample_rupkey(self, rupkey, rng):
+        # returns random values of the rupture parameters with the given key
+        return tuple(val + rng.uniform(-step / 2, step / 2) if step else val
+                     for val, step in zip(rupkey, self.steps))
+
+    def _sample_sitekey(self, sitekey, rng):
+        # returns random values of the site parameters with the given key
+        return tuple((val + rng.uniform(-step / 2, step / 2), dt)
+                     if step else (val, dt)
+                     for (val, dt), step in zip(sitekey, self.site_steps))
+
+    def _build(self, imt, rupkey, sitekey):
+        # returns a table valid within the tolerance or None
+        shp = len(self.dists), len(self.m_w)
+        table = {'IMLs': numpy.zeros(shp)}
+        for stddev_type in self.stddev_types:
+            table[stddev_type] = numpy.zeros(shp)
+        rng = numpy.random.RandomState(42)
+        mags = rng.uniform(self.m_w[0], self.m_w[-1], self.num_samples)
+        dists = numpy.exp(rng.uniform(numpy.log(self.dists[0]),
+                                      numpy.log(self.dists[-1]),
+                                      self.num_samples))
+        error = 0
+        try:
+            for m, mag in enumerate(self.m_w):
+                mean, stddevs = self._exact(
+                    imt, rupkey, sitekey, mag, self.dists)
+                table['IMLs'][:, m] = numpy.exp(mean)
+                for stddev_type, stddev in zip(self.stddev_types, stddevs):
+                    table[stddev_type][:, m] = stddev
+            for mag in mags:
+                mean, stddevs = self._exact(
+                    imt, self._sample_rupkey(rupkey, rng),
+                    self._sample_sitekey(sitekey, rng), mag, dists)
+                tmean, tstddevs = self._interpolate(
+                    table, mag, dists, self.stddev_types)
+                error = max(error, numpy.abs(tmean - mean).max(), *[
+                    numpy.abs(ts - s).max()
+                    for ts, s in zip(tstddevs, stddevs)])
+        except Exception as exc:
+            logging.warning('Cannot tabulate %s for %s: %s',
+                            self.gmpe, imt, exc)
+            return
+        if not error <= self.tolerance:  # works also for error=nan
+            logging.warning('Not tabulating %s for %s, %s, %s: error %s > %s',
+                            self.gmpe, imt, rupkey, sitekey, error,
+                            self.tolerance)
+            return
+        return table
+
+    def _get_table(self, imt, rupkey, sitekey):
+        tables = _tables.setdefault(self._key, {})
+        key = imt, rupkey, sitekey
+        try:
+            return tables[key]
+        except KeyError:
+            if len(tables) >= self.max_tables:
+                return
+        tables[key] = table = self._build(imt, rupkey, sitekey)
+        if len(tables) == self.max_tables:  # logged once per process
+            logging.warning('Reached max_tables=%d for %s: the GSIM will be '
+                            'called directly for the other parameters',
+                            self.max_tables, self.gmpe)
+        return table
+
+    def _gen_site_groups(self, sctx, idxs):
+        # yield pairs (site key, site indices) for the sites in idxs with
+        # the same (quantized) site parameters; a site key is a list of
+        # pairs (value, dtype) for each site parameter
+        if not self.site_params:
+            yield (), idxs
+            return
+        arrays = []
+        for par, step in zip(self.site_params, self.site_steps):
+            array = getattr(sctx, par)[idxs]
+            if step:
+                array = (numpy.round(array / step) * step).astype(array.dtype)
+            arrays.append(array)
+        rec = numpy.rec.fromarrays(arrays, names=self.site_params)
+        uniq, inv = numpy.unique(rec, return_inverse=True)
+        dts = [rec.dtype[par] for par in self.site_params]
+        for u, vals in enumerate(uniq.tolist()):
+            yield tuple(zip(vals, dts)), idxs[inv == u]
+
+    def get_mean_and_stddevs(self, sctx, rctx, dctx, imt, stddev_types):
+        """
+        Interpolate the tables of the underlying GSIM, or call it directly
+        for the sites which cannot be tabulated
+        """
+        dists = getattr(dctx, self.distance_type)
+        num = len(dists)
+        mean = numpy.zeros(num)
+        stddevs = [numpy.zeros(num) for _ in stddev_types]
+        exact = numpy.ones(num, bool)
+        if (imt.name in ('PGA', 'PGV', 'SA') and
+                self.m_w[0] <= rctx.mag <= self.m_w[-1]):
+            inside = (dists >= self.dists[0]) & (dists <= self.dists[-1])
+            rupkey = self._get_rupkey(rctx)
+            for sitekey, idxs in self._gen_site_groups(
+                    sctx, numpy.where(inside)[0]):
+                table = self._get_table(imt, rupkey, sitekey)
+                if table is None:
+                    continue
+                m, ss = self._interpolate(
+                    table, rctx.mag, dists[idxs], stddev_types)
+                mean[idxs] = m
+                for stddev, s in zip(stddevs, ss):
+                    stddev[idxs] = s
+                exact[idxs] = False
+        if exact.all():
+            return self.gmpe.get_mean_and_stddevs(
+                sctx, rctx, dctx, imt, stddev_types)
+        elif exact.any():
+            idxs = numpy.where(exact)[0]
+            m, ss = self.gmpe.get_mean_and_stddevs(
+                _subset(sctx, idxs, num), rctx, _subset(dctx, idxs, num),
+                imt, stddev_types)
+            mean[idxs] = m
+            for stddev, s in zip(stddevs, ss):
+                stddev[idxs] = s
+        return mean, stddevs
@@ -65,6 +65,9 @@ class SadighEtAl1997(GMPE):
     #: Required distance measure is RRup (eq. 1).
     REQUIRES_DISTANCES = {'rrup'}
 
+    #: The contexts of ruptures with the same parameters can be stacked
+    batched = True
+
     #: If site vs30 is more than 750 m/s -- treat the soil as rock.
     #: See page 180.
     ROCK_VS30 = 750
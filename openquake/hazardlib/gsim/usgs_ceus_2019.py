@@ -237,7 +237,7 @@ class NGAEastUSGSGMPE(NGAEastGMPE):
         # value is identifiable and outside of potential real values
         # For extremely short distance (rrup = 0) use an arbitrarily small
         # distance measure (1.0E-5 used by US NSHMP code)
-        dists[dists < 1.0E-5] = 1.0E-5
+        dists = np.maximum(dists, 1.0E-5)
         interpolator_mean = interp1d(np.log10(dists), np.log(data),
                                      bounds_error=False,
                                      fill_value=-999.)
@@ -18,6 +18,7 @@
 from openquake.baselib.python3compat import zip
 import numpy
 
+U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 BYTES_PER_FLOAT = 8
@@ -352,6 +353,275 @@ class ProbabilityMap(dict):
                                     self.shape_y, self.shape_z)
 
 
+class DenseProbabilityMap(object):
+    """
+    An array-backed version of :class:`ProbabilityMap`: the PoEs are stored
+    in a single buffer of shape (N, L, I) indexed by an ordered array of N
+    site IDs. The rows of the sites expected to be added can be allocated
+    in advance with `.reserve(sids)`; the other sites are added by growing
+    the buffer geometrically. It supports the same operators of
+    :class:`ProbabilityMap`, but they work on the whole buffer at once;
+    moreover it has the same HDF5 layout, so it can be stored and read in
+    place of a :class:`ProbabilityMap`. Here is an example of use:
+
+    >>> pmap = DenseProbabilityMap.build(3, 1, sids=[1, 2], initvalue=.1)
+    >>> pmap |= ProbabilityMap.build(3, 1, sids=[2, 5], initvalue=.5)
+    >>> pmap.sids
+    array([1, 2, 5], dtype=uint32)
+    >>> pmap.array[:, :, 0]
+    array([[0.1 , 0.1 , 0.1 ],
+           [0.55, 0.55, 0.55],
+           [0.5 , 0.5 , 0.5 ]])
+    """
+    @classmethod
+    def build(cls, shape_y, shape_z, sids, initvalue=0., dtype=F64):
+        """
+        :param shape_y: the total number of intensity measure levels
+        :param shape_z: the number of inner levels
+        :param sids: a set of site indices
+        :param initvalue: the initial value of the probability (default 0)
+        :returns: a DenseProbabilityMap instance
+        """
+        sids = numpy.unique(numpy.array(sids, U32))
+        array = numpy.empty((len(sids), shape_y, shape_z), dtype)
+        array.fill(initvalue)
+        return cls(shape_y, shape_z, sids, array)
+
+    @classmethod
+    def from_pmap(cls, pmap):
+        """
+        :param pmap: a ProbabilityMap or DenseProbabilityMap instance
+        :returns: a DenseProbabilityMap with a copy of the data
+        """
+        if not pmap:
+            return cls(pmap.shape_y, pmap.shape_z)
+        return cls(pmap.shape_y, pmap.shape_z, pmap.sids,
+                   numpy.array(pmap.array))
+
+    def __init__(self, shape_y, shape_z=1, sids=(), array=None):
+        self.shape_y = shape_y
+        self.shape_z = shape_z
+        self.sids = sids
+        if array is None:
+            array = numpy.zeros((len(self._keys), shape_y, shape_z))
+        self.array = array
+
+    # the buffer has a row for each key, i.e. for each site ID seen or
+    # reserved, in any order; only the rows of the used keys are in the map
+    @property
+    def sids(self):
+        """The ordered array of the site IDs in the map"""
+        return self._keys[self._used]
+
+    @sids.setter
+    def sids(self, sids):
+        self._keys = numpy.array(sids, U32)
+        self._rows = numpy.arange(len(self._keys))
+        self._used = numpy.ones(len(self._keys), bool)
+
+    @property
+    def array(self):
+        """The array of shape (N, L, I) of the PoEs, ordered by site ID"""
+        rows = self._rows[self._used]
+        if not (len(rows) == len(self._buf) and
+                (rows == numpy.arange(len(rows))).all()):
+            # compact the buffer, so that the array is a view on it
+            self._keys = self._keys[self._used]
+            self._buf = self._buf[rows]
+            self.sids = self._keys
+        return self._buf
+
+    @array.setter
+    def array(self, array):
+        self._buf = array
+
+    def reserve(self, sids):
+        """
+        Allocate the rows for the given site IDs in advance, so that they
+        are added to the map without copying the buffer
+
+        :param sids: the site IDs which may be added to the map
+        """
+        new = numpy.setdiff1d(numpy.array(sids, U32), self._keys)
+        if len(new):
+            self._add_keys(new, len(self._keys) + len(new))
+
+    def _add_keys(self, new, nrows):
+        # add rows for the new site IDs (unused) to a buffer of nrows rows
+        n = len(self._keys)
+        if nrows > len(self._buf):
+            buf = numpy.zeros((nrows, self.shape_y, self.shape_z),
+                              self._buf.dtype)
+            buf[:n] = self._buf[:n]
+            self._buf = buf
+        keys = numpy.concatenate([self._keys, new])
+        rows = numpy.concatenate([self._rows, numpy.arange(n, len(keys))])
+        used = numpy.concatenate([self._used, numpy.zeros(len(new), bool)])
+        order = numpy.argsort(keys)
+        self._keys, self._rows, self._used = (
+            keys[order], rows[order], used[order])
+
+    def _extend(self, sids):
+        # add the missing site IDs with zero PoEs and return the rows
+        # of the given sids in the buffer
+        pos = numpy.searchsorted(self._keys, sids)
+        known = pos < len(self._keys)
+        known[known] = self._keys[pos[known]] == sids[known]
+        if not known.all():  # not reserved, grow the buffer geometrically
+            new = numpy.array(sids[~known], U32)
+            nrows = len(self._keys) + len(new)
+            if nrows > len(self._buf):
+                nrows = max(nrows, 2 * len(self._buf))
+            self._add_keys(new, nrows)
+            pos = numpy.searchsorted(self._keys, sids)
+        self._used[pos] = True
+        return self._rows[pos]
+
+    def _check(self, other):
+        if (other.shape_y, other.shape_z) != (self.shape_y, self.shape_z):
+            raise ValueError('%s has inconsistent shape with %s' %
+                             (other, self))
+
+    def __len__(self):
+        return int(self._used.sum())
+
+    def __bool__(self):
+        return bool(self._used.any())
+
+    def __iter__(self):
+        return iter(self.sids.tolist())
+
+    def __contains__(self, sid):
+        idx = numpy.searchsorted(self._keys, sid)
+        return (idx < len(self._keys) and self._keys[idx] == sid and
+                self._used[idx])
+
+    def __getitem__(self, sid):
+        # returns a ProbabilityCurve which is a view over the buffer
+        if sid not in self:
+            raise KeyError(sid)
+        idx = numpy.searchsorted(self._keys, sid)
+        return ProbabilityCurve(self._buf[self._rows[idx]])
+
+    def get(self, sid, default=None):
+        try:
+            return self[sid]
+        except KeyError:
+            return default
+
+    def items(self):
+        for sid, row in zip(self.sids, self._rows[self._used]):
+            yield sid, ProbabilityCurve(self._buf[row])
+
+    @property
+    def nbytes(self):
+        """The size of the underlying buffer"""
+        return self._buf.nbytes
+
+    # used when exporting to HDF5
+    def convert(self, imtls, nsites, idx=0):
+        """
+        Convert a probability map into a composite array of length `nsites`
+        and dtype `imtls.dt`.
+
+        :param imtls:
+            DictArray instance
+        :param nsites:
+            the total number of sites
+        :param idx:
+            index on the z-axis (default 0)
+        """
+        curves = numpy.zeros(nsites, imtls.dt)
+        for imt in curves.dtype.names:
+            curves[imt][self.sids] = self.array[:, imtls(imt), idx]
+        return curves
+
+    def filter(self, sids):
+        """
+        Extracs a submap of self for the given sids.
+        """
+        ok = numpy.isin(self.sids, sids)
+        return self.__class__(self.shape_y, self.shape_z,
+                              self.sids[ok], self.array[ok])
+
+    def extract(self, inner_idx):
+        """
+        Extracts a component of the underlying buffer, specified by the
+        index `inner_idx`.
+        """
+        return self.__class__(self.shape_y, 1, self.sids,
+                              self.array[:, :, [inner_idx]])
+
+    def __ior__(self, other):
+        if not other:
+            return self
+        self._check(other)
+        idx = self._extend(other.sids)
+        self._buf[idx] = 1. - (1. - self._buf[idx]) * (1. - other.array)
+        return self
+
+    def __or__(self, other):
+        new = self.from_pmap(self)
+        new |= other
+        return new
+
+    __ror__ = __or__
+
+    def __iadd__(self, other):
+        # this is used when composing mutually exclusive probabilities
+        if not other:
+            return self
+        self._check(other)
+        idx = self._extend(other.sids)
+        self._buf[idx] += other.array
+        return self
+
+    def __mul__(self, other):
+        if not hasattr(other, 'sids'):  # assume a float
+            assert 0. <= other <= 1., other  # must be a probability
+            return self.__class__(self.shape_y, self.shape_z, self.sids,
+                                  self.array * other)
+        # the missing curves are considered as curves of ones
+        sids = numpy.union1d(self.sids, other.sids)
+        shape = (len(sids), self.shape_y, self.shape_z)
+        array = numpy.ones(shape)
+        array[numpy.searchsorted(sids, self.sids)] = self.array
+        if other:
+            array[numpy.searchsorted(sids, other.sids)] *= other.array
+        return self.__class__(self.shape_y, self.shape_z, sids, array)
+
+    __rmul__ = __mul__
+
+    def __ipow__(self, n):
+        self.array **= n
+        return self
+
+    def __pow__(self, n):
+        return self.__class__(self.shape_y, self.shape_z, self.sids,
+                              self.array ** n)
+
+    def __invert__(self):
+        ok = (self.array != 1.).any(axis=(1, 2))
+        # store only nonzero probabilities
+        return self.__class__(self.shape_y, self.shape_z, self.sids[ok],
+                              1. - self.array[ok])
+
+    def __toh5__(self):
+        # the buffer is not compacted, so the reserved rows are kept
+        array = F64(self._buf[self._rows[self._used]])
+        return dict(array=array, sids=self.sids), {}
+
+    def __fromh5__(self, dic, attrs):
+        self.array = dic['array'][()]
+        self.sids = dic['sids'][()]
+        self.shape_y = self.array.shape[1]
+        self.shape_z = self.array.shape[2]
+
+    def __repr__(self):
+        return '<%s %d, %d, %d>' % (self.__class__.__name__, len(self),
+                                    self.shape_y, self.shape_z)
+
+
 def get_shape(pmaps):
     """
     :param pmaps: a set of homogenous ProbabilityMaps
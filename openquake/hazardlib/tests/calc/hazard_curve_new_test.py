@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
 import os
 import unittest
 import numpy
@@ -230,3 +231,41 @@ class MultiPointTestCase(unittest.TestCase):
         psources = list(mps1) + list(mps2)
         hcurves = calc_hazard_curves(psources, sitecol, imtls, gsim_by_trt)
         npt.assert_allclose(hcurves['PGA'][0], expected, rtol=1E-4, atol=1E-6)
+
+
+class CollapseCtxsTestCase(unittest.TestCase):
+    def test(self):
+        d = os.path.dirname(os.path.dirname(__file__))
+        source_model = os.path.join(d, 'source_model/multi-point-source.xml')
+        groups = nrml.to_python(source_model, SourceConverter(
+            investigation_time=50., rupture_mesh_spacing=2.))
+        [[mps1, mps2]] = groups
+        # the point sources appear twice, so that each context is duplicated
+        srcs = []
+        for i, src in enumerate((list(mps1) + list(mps2)) * 2):
+            src = copy.copy(src)
+            src.id = i
+            src.num_ruptures = src.count_ruptures()
+            srcs.append(src)
+        group = SourceGroup(srcs[0].tectonic_region_type, srcs, 'test',
+                            'indep', 'indep')
+        sitecol = SiteCollection([
+            Site(Point(0.1, 0.1), 800, z1pt0=100., z2pt5=1.),
+            Site(Point(0.3, 0.1), 400, z1pt0=100., z2pt5=1.)])
+        imtls = DictArray({'PGA': [0.01, 0.02, 0.04, 0.08, 0.16]})
+        res = []
+        for collapse_ctxs in (False, True):
+            param = dict(imtls=imtls, truncation_level=3,
+                         filter_distance='rjb', collapse_ctxs=collapse_ctxs)
+            res.append(classical(group, sitecol, [Campbell2003()], param))
+        pmap, pmap_collapsed = [r['pmap'][0] for r in res]
+        self.assertEqual(sorted(pmap), sorted(pmap_collapsed))
+        for sid in pmap:
+            npt.assert_allclose(pmap_collapsed[sid].array,
+                                pmap[sid].array, rtol=1E-3)
+        # nrups, nsites, calc_time, number of computed contexts
+        ctimes = [numpy.array(list(r['calc_times'].values())).sum(axis=0)
+                  for r in res]
+        self.assertEqual(ctimes[0][0], ctimes[1][0])
+        self.assertEqual(ctimes[0][3], ctimes[0][0])  # no collapse
+        self.assertGreaterEqual(ctimes[1][0] / ctimes[1][3], 2)
@@ -199,3 +199,30 @@ class AvgGMPETestCase(unittest.TestCase):
             'Active Shallow Crust': ag})['PGA']
         # the AvgGMPE is not producing real means!!
         numpy.testing.assert_almost_equal(hc, hcm, decimal=3)
+
+
+class BatchedGSIMTestCase(unittest.TestCase):
+    def test_same_curves_as_unbatched(self):
+        sitecol = SiteCollection([
+            Site(Point(30.0, 30.0), 760., 1.0, 1.0),
+            Site(Point(30.25, 30.25), 400., 1.0, 1.0),
+            Site(Point(30.4, 30.4), 200., 1.0, 1.0)])
+        mfd = TruncatedGRMFD(4.5, 8.0, 0.1, 4.0, 1.0)
+        npd = PMF([(0.25, NodalPlane(0.0, 90.0, 0.0)),
+                   (0.25, NodalPlane(45.0, 60.0, 0.0)),
+                   (0.5, NodalPlane(90.0, 45.0, 90.0))])
+        hdd = PMF([(0.5, 5.0), (0.5, 10.0)])
+        sources = [PointSource('001', 'Point1', 'Active Shallow Crust',
+                               mfd, 1.0, WC1994(), 1.0, PoissonTOM(50.0),
+                               0.0, 30.0, Point(30.0, 30.5), npd, hdd)]
+        imtls = {'PGA': [0.01, 0.1, 0.2, 0.5, 0.8],
+                 'SA(0.5)': [0.01, 0.1, 0.2, 0.5, 0.8]}
+        for gsim in (AkkarBommer2010(), SadighEtAl1997()):
+            self.assertTrue(gsim.batched)
+            hc1 = calc_hazard_curves(
+                sources, sitecol, imtls, {'Active Shallow Crust': gsim})
+            gsim.batched = False  # compute the contexts one by one
+            hc2 = calc_hazard_curves(
+                sources, sitecol, imtls, {'Active Shallow Crust': gsim})
+            for imt in imtls:
+                numpy.testing.assert_allclose(hc1[imt], hc2[imt])
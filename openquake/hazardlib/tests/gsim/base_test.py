@@ -23,10 +23,12 @@ import unittest.mock as mock
 import numpy
 from copy import deepcopy
 
+from openquake.baselib.general import DictArray
 from openquake.hazardlib import const
 from openquake.hazardlib.gsim.base import (
     GMPE, CoeffsTable, SitesContext, RuptureContext,
-    NotVerifiedWarning, DeprecationWarning)
+    NotVerifiedWarning, DeprecationWarning, TruncNormSF, get_poes,
+    _truncnorm_sf)
 from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.imt import PGA, PGV, SA
 from openquake.hazardlib.site import Site, SiteCollection
@@ -350,6 +352,18 @@ class CoeffsTableTestCase(unittest.TestCase):
         self.assertDictEqual(table1.sa_coeffs, table2.sa_coeffs)
         self.assertDictEqual(table1.non_sa_coeffs, table2.non_sa_coeffs)
 
+    def test_columns(self):
+        table = CoeffsTable(sa_damping=5, table=self.coefficient_string)
+        self.assertEqual(table.columns, ('a', 'b'))
+        aac([table[imt]['a'] for imt in [PGA(), SA(0.1), SA(0.5), PGV()]],
+            [0.05, 1., 3.7959, 0.1], atol=1E-4)
+        # the interpolated coefficients are cached
+        self.assertIs(table[SA(0.5)], table[SA(0.5)])
+        with self.assertRaises(KeyError):
+            table[SA(20.)]
+        with self.assertRaises(KeyError):
+            table[SA(0.5, 10)]
+
     def test_table_bad_instantiation(self):
         # If instantiated with anything other than string or tuple should
         # raise a TypeError
@@ -358,3 +372,41 @@ class CoeffsTableTestCase(unittest.TestCase):
         self.assertEqual(str(te.exception),
                          "CoeffsTable cannot be constructed with "
                          "inputs of the form 'int'")
+
+
+class GetPoesTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.mean_std = numpy.zeros((2, 100, 2, 3))  # (2, N, M, G)
+        self.mean_std[0] = rng.uniform(-5, 0, (100, 2, 3))
+        self.mean_std[1] = rng.uniform(.3, .9, (100, 2, 3))
+        imls = numpy.log(numpy.logspace(-3, .5, 10))
+        self.loglevels = DictArray({'PGA': imls, 'SA(1.0)': imls})
+
+    def test_out(self):
+        # writing in a preallocated buffer gives the same poes
+        for tl in (None, 0, 3):
+            expected = get_poes(self.mean_std, self.loglevels, tl)
+            self.assertEqual(expected.shape, (100, 20, 3))
+            out = numpy.ones((100, 20, 3))
+            poes = get_poes(self.mean_std, self.loglevels, tl, out=out)
+            self.assertIs(poes, out)
+            numpy.testing.assert_equal(poes, expected)
+            out = numpy.ones((100, 20, 3), numpy.float32)
+            poes = get_poes(self.mean_std, self.loglevels, tl, out=out)
+            aac(poes, expected, atol=1E-6)
+
+    def test_tabulated_sf(self):
+        xs = numpy.linspace(-5, 5, 100001)
+        for tl in (.5, 1, 2.5, 3):
+            for maxerr in (1E-4, 1E-6):
+                sf = TruncNormSF(tl, maxerr)
+                exact = _truncnorm_sf(tl, xs)
+                self.assertLess(numpy.abs(sf(xs) - exact).max(), maxerr)
+        sf = TruncNormSF(3, 1E-6, numpy.float32)
+        expected = get_poes(self.mean_std, self.loglevels, 3)
+        out = numpy.zeros((100, 20, 3), numpy.float32)
+        get_poes(self.mean_std, self.loglevels, 3, out=out, sf=sf)
+        self.assertLess(numpy.abs(out - expected).max(), 1.5E-6)
+        with self.assertRaises(ValueError):
+            TruncNormSF(0)
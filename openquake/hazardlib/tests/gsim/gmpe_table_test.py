@@ -16,15 +16,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import io
 import os
+import pickle
+import shutil
 import tempfile
 import unittest
+import unittest.mock as mock
 
 import h5py
 import numpy as np
 from scipy.interpolate import interp1d
 
 from openquake.hazardlib import const
+from openquake.hazardlib.gsim import gmpe_table
 from openquake.hazardlib.gsim.gmpe_table import (
     GMPETable, AmplificationTable, hdf_arrays_to_dict)
 from openquake.hazardlib.gsim.base import (
@@ -718,6 +723,95 @@ class GSIMTableTestCaseNoAmplification(unittest.TestCase):
         np.testing.assert_array_almost_equal(sigma[0], 0.5 * np.ones(5), 5)
 
 
+class GSIMTableRegistryTestCase(unittest.TestCase):
+    """
+    Tests the sharing of the tables between GMPETable instances
+    """
+    TABLE_FILE = os.path.join(BASE_DATA_PATH, "good_dummy_table.hdf5")
+
+    def setUp(self):
+        gmpe_table._tables.clear()
+
+    def get_means(self, gsim):
+        rctx = RuptureContext()
+        rctx.mag = 6.0
+        rctx.rake = 90.
+        dctx = DistancesContext()
+        dctx.rjb = np.array([1.0, 10.0, 100.0])
+        sctx = SitesContext()
+        sctx.vs30 = np.array([400., 1000., 1000.])
+        return [gsim.get_mean_and_stddevs(
+            sctx, rctx, dctx, imt, [const.StdDev.TOTAL])[0]
+            for imt in (imt_module.PGA(), imt_module.SA(0.5))]
+
+    def test_shared(self):
+        gsim1 = GMPETable(gmpe_table=self.TABLE_FILE)
+        gsim2 = GMPETable(gmpe_table=self.TABLE_FILE)
+        self.assertEqual(len(gmpe_table._tables), 1)
+        for iml in ["PGA", "PGV", "SA", "T"]:
+            arr = gsim1.imls[iml]
+            self.assertFalse(arr.flags.writeable)
+            self.assertTrue(np.shares_memory(arr, gsim2.imls[iml]))
+        self.assertTrue(np.shares_memory(gsim1.distances, gsim2.distances))
+        # the amplification arrays are built only once
+        self.assertIs(gsim1.amplification, gsim2.amplification)
+        self.assertFalse(gsim1.amplification.mean['SA'].flags.writeable)
+
+    def test_checksum(self):
+        # the file is read to compute its checksum only the first time
+        GMPETable(gmpe_table=self.TABLE_FILE)
+        gmpe_table._tables.clear()
+        with mock.patch.object(gmpe_table.zlib, 'adler32') as adler32:
+            GMPETable(gmpe_table=self.TABLE_FILE)
+        self.assertEqual(adler32.call_count, 0)
+
+    def test_pickle(self):
+        gsim = GMPETable(gmpe_table=self.TABLE_FILE)
+        data = pickle.dumps(gsim)
+        self.assertNotIn(b'numpy', data)  # no arrays are pickled
+        new = pickle.loads(data)
+        self.assertTrue(np.shares_memory(new.imls['SA'], gsim.imls['SA']))
+        self.assertIs(new.amplification, gsim.amplification)
+        np.testing.assert_equal(self.get_means(new), self.get_means(gsim))
+
+        # a new process reads the table again
+        gmpe_table._tables.clear()
+        new = pickle.loads(data)
+        np.testing.assert_equal(self.get_means(new), self.get_means(gsim))
+
+    def test_pickle_remote(self):
+        # the tables are sent to workers which may not have the file
+        fname = os.path.join(tempfile.mkdtemp(), 'table.hdf5')
+        shutil.copy(self.TABLE_FILE, fname)
+        gsim = GMPETable(gmpe_table=fname)
+        with mock.patch.dict(os.environ, OQ_DISTRIBUTE='zmq'):
+            data = pickle.dumps(gsim)
+        expected = self.get_means(gsim)
+        os.remove(fname)
+        gmpe_table._tables.clear()
+        new = pickle.loads(data)
+        np.testing.assert_equal(self.get_means(new), expected)
+
+    def test_bytesio(self):
+        with open(self.TABLE_FILE, 'rb') as f:
+            gsim = GMPETable(gmpe_table=io.BytesIO(f.read()))
+        new = pickle.loads(pickle.dumps(gsim))
+        self.assertEqual(len(gmpe_table._tables), 1)
+        np.testing.assert_equal(self.get_means(new), self.get_means(
+            GMPETable(gmpe_table=self.TABLE_FILE)))
+
+    def test_changed_file(self):
+        fname = os.path.join(tempfile.mkdtemp(), 'table.hdf5')
+        shutil.copy(self.TABLE_FILE, fname)
+        data = pickle.dumps(GMPETable(gmpe_table=fname))
+        gmpe_table._tables.clear()
+        with open(fname, 'ab') as f:
+            f.write(b'x')
+        with self.assertRaises(ValueError) as ctx:
+            pickle.loads(data)
+        self.assertIn('has changed', str(ctx.exception))
+
+
 class GSIMTableQATestCase(BaseGSIMTestCase):
     """
     Quality Assurance test case with real data taken from the
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import unittest.mock as mock
+import numpy
+from openquake.hazardlib import const
+from openquake.hazardlib.imt import PGA, SA, MMI
+from openquake.hazardlib.contexts import (
+    RuptureContext, SitesContext, DistancesContext)
+from openquake.hazardlib.gsim.mgmpe import tabulated_gsim
+from openquake.hazardlib.gsim.mgmpe.tabulated_gsim import TabulatedGSIM
+
+STDDEVS = [const.StdDev.TOTAL, const.StdDev.INTER_EVENT]
+
+
+def get_contexts(mag):
+    rctx = RuptureContext([('mag', mag), ('rake', 30.)])
+    sctx = SitesContext(['vs30'])
+    sctx.vs30 = numpy.array([300., 760., 300., 760., 300., 760.])
+    sctx.sids = numpy.arange(6)
+    dctx = DistancesContext(
+        [('rjb', numpy.array([0., 5., 27.3, 120., 480., 1500.]))])
+    return sctx, rctx, dctx
+
+
+class TabulatedGSIMTestCase(unittest.TestCase):
+    def setUp(self):
+        tabulated_gsim._tables.clear()
+
+    def test_close_to_exact(self):
+        gsim = TabulatedGSIM('BooreAtkinson2008')
+        for mag in [4.23, 6.5, 7.81]:
+            ctxs = get_contexts(mag)
+            for imt in [PGA(), SA(0.3)]:
+                mean, stddevs = gsim.get_mean_and_stddevs(
+                    *ctxs, imt, STDDEVS)
+                emean, estddevs = gsim.gmpe.get_mean_and_stddevs(
+                    *ctxs, imt, STDDEVS)
+                numpy.testing.assert_allclose(mean, emean, atol=.01)
+                numpy.testing.assert_allclose(stddevs, estddevs, atol=.01)
+                # outside of the distance grid the GSIM is called directly
+                self.assertEqual(mean[0], emean[0])
+                self.assertEqual(mean[-1], emean[-1])
+        # one table per IMT and rake, for the two vs30 values
+        [tables] = tabulated_gsim._tables.values()
+        self.assertEqual(len(tables), 4)
+        self.assertEqual(sum(t is None for t in tables.values()), 0)
+
+    def test_fallback(self):
+        # with a tiny tolerance nothing is tabulated
+        gsim = TabulatedGSIM({'BooreAtkinson2008': {}}, tolerance=1E-12)
+        ctxs = get_contexts(6.5)
+        mean, stddevs = gsim.get_mean_and_stddevs(*ctxs, PGA(), STDDEVS)
+        emean, estddevs = gsim.gmpe.get_mean_and_stddevs(
+            *ctxs, PGA(), STDDEVS)
+        numpy.testing.assert_equal(mean, emean)
+        numpy.testing.assert_equal(stddevs, estddevs)
+        [tables] = tabulated_gsim._tables.values()
+        self.assertEqual(list(tables.values()), [None, None])
+
+    def test_not_tabulated(self):
+        # magnitudes and IMTs outside of the grid
+        gsim = TabulatedGSIM('BooreAtkinson2008', max_mag=8.)
+        ctxs = get_contexts(8.5)
+        mean, _ = gsim.get_mean_and_stddevs(*ctxs, PGA(), STDDEVS)
+        emean, _ = gsim.gmpe.get_mean_and_stddevs(*ctxs, PGA(), STDDEVS)
+        numpy.testing.assert_equal(mean, emean)
+        self.assertEqual(tabulated_gsim._tables, {})
+        gsim = TabulatedGSIM('AllenEtAl2012')
+        sctx, rctx, dctx = get_contexts(6.5)
+        dctx = DistancesContext([('rrup', dctx.rjb)])
+        mean, _ = gsim.get_mean_and_stddevs(
+            sctx, rctx, dctx, MMI(), [const.StdDev.TOTAL])
+        emean, _ = gsim.gmpe.get_mean_and_stddevs(
+            sctx, rctx, dctx, MMI(), [const.StdDev.TOTAL])
+        numpy.testing.assert_equal(mean, emean)
+        self.assertEqual(tabulated_gsim._tables, {})
+
+    def test_many_distances(self):
+        with self.assertRaises(ValueError) as ctx:
+            TabulatedGSIM('AbrahamsonSilva2008')
+        self.assertIn('cannot be tabulated', str(ctx.exception))
+
+    def test_rupture_steps(self):
+        # hypo_depth is continuous and must be quantized
+        with self.assertRaises(ValueError) as ctx:
+            TabulatedGSIM('ZhaoEtAl2006Asc')
+        self.assertIn("['hypo_depth']", str(ctx.exception))
+        gsim = TabulatedGSIM('ZhaoEtAl2006Asc',
+                             rupture_steps={'hypo_depth': 1.})
+        sctx, rctx, dctx = get_contexts(6.5)
+        dctx = DistancesContext([('rrup', dctx.rjb)])
+        for hypo_depth in [9.7, 10.2, 10.4]:  # all quantized to 10 km
+            rctx.hypo_depth = hypo_depth
+            mean, stddevs = gsim.get_mean_and_stddevs(
+                sctx, rctx, dctx, PGA(), STDDEVS)
+            emean, estddevs = gsim.gmpe.get_mean_and_stddevs(
+                sctx, rctx, dctx, PGA(), STDDEVS)
+            numpy.testing.assert_allclose(mean, emean, atol=.01)
+            numpy.testing.assert_allclose(stddevs, estddevs, atol=.01)
+        # one table for each vs30 value
+        [tables] = tabulated_gsim._tables.values()
+        self.assertEqual(len(tables), 2)
+        self.assertEqual(sum(t is None for t in tables.values()), 0)
+
+    def test_site_steps(self):
+        # vs30 is quantized to multiples of 10 m/s
+        gsim = TabulatedGSIM('BooreAtkinson2008', tolerance=.05,
+                             site_steps={'vs30': 10.})
+        sctx, rctx, dctx = get_contexts(6.5)
+        sctx.vs30 = numpy.array([298., 758., 302., 762., 301., 760.])
+        mean, stddevs = gsim.get_mean_and_stddevs(
+            sctx, rctx, dctx, PGA(), STDDEVS)
+        emean, estddevs = gsim.gmpe.get_mean_and_stddevs(
+            sctx, rctx, dctx, PGA(), STDDEVS)
+        numpy.testing.assert_allclose(mean, emean, atol=.05)
+        numpy.testing.assert_allclose(stddevs, estddevs, atol=.05)
+        # one table for 300 m/s and one for 760 m/s
+        [tables] = tabulated_gsim._tables.values()
+        self.assertEqual(sorted(key[2][0][0] for key in tables), [300, 760])
+        self.assertEqual(sum(t is None for t in tables.values()), 0)
+
+        # the check covers the full step, so the table for 400 m/s is
+        # refused: the sites with vs30=300 would have a too large error
+        tabulated_gsim._tables.clear()
+        gsim = TabulatedGSIM('BooreAtkinson2008', tolerance=.05,
+                             site_steps={'vs30': 200.})
+        mean, _ = gsim.get_mean_and_stddevs(sctx, rctx, dctx, PGA(), STDDEVS)
+        numpy.testing.assert_equal(mean[::2], emean[::2])
+        [tables] = tabulated_gsim._tables.values()
+        self.assertEqual({key[2][0][0]: table is None
+                          for key, table in tables.items()},
+                         {400: True, 800: False})
+        with self.assertRaises(ValueError):
+            TabulatedGSIM('BooreAtkinson2008', site_steps={'vs30': 0})
+
+    def test_max_tables(self):
+        # the warning is logged only when the limit is reached
+        gsim = TabulatedGSIM('BooreAtkinson2008', max_tables=1)
+        ctxs = get_contexts(6.5)
+        with mock.patch.object(tabulated_gsim.logging, 'warning') as warn:
+            for _ in range(2):
+                gsim.get_mean_and_stddevs(*ctxs, PGA(), STDDEVS)
+        self.assertEqual(warn.call_count, 1)
+        self.assertIn('max_tables=1', warn.call_args[0][0] %
+                      warn.call_args[0][1:])
+        [tables] = tabulated_gsim._tables.values()
+        self.assertEqual(len(tables), 1)
@@ -18,7 +18,9 @@
 
 import unittest
 import numpy
-from openquake.hazardlib.probability_map import ProbabilityMap
+from openquake.baselib.general import DictArray
+from openquake.hazardlib.probability_map import (
+    ProbabilityMap, DenseProbabilityMap)
 
 
 class ProbabilityMapTestCase(unittest.TestCase):
@@ -40,3 +42,57 @@ class ProbabilityMapTestCase(unittest.TestCase):
         # test pmap power
         pmap = pmap1 ** 2
         numpy.testing.assert_almost_equal(pmap[0].array, [[.16], [0], [0]])
+
+
+class DenseProbabilityMapTestCase(unittest.TestCase):
+    def test_same_as_dict(self):
+        pmap1 = ProbabilityMap.build(3, 2, sids=[0, 2, 5], initvalue=.1)
+        pmap1[2].array[1] = .4
+        pmap2 = ProbabilityMap.build(3, 2, sids=[1, 2], initvalue=.5)
+        dmap1 = DenseProbabilityMap.from_pmap(pmap1)
+        dmap2 = DenseProbabilityMap.from_pmap(pmap2)
+        for pmap, dmap in [(pmap1 | pmap2, dmap1 | pmap2),
+                           (pmap1 * pmap2, dmap1 * dmap2),
+                           (pmap1 ** 2, dmap1 ** 2),
+                           (~pmap1, ~dmap1)]:
+            numpy.testing.assert_equal(pmap.sids, dmap.sids)
+            numpy.testing.assert_almost_equal(pmap.array, dmap.array)
+
+        dmap1 |= dmap2
+        numpy.testing.assert_equal(dmap1.sids, [0, 1, 2, 5])
+        numpy.testing.assert_almost_equal(dmap1[2].array[:, 0], [.55, .7, .55])
+        self.assertNotIn(3, dmap1)
+        self.assertEqual(dmap1.__toh5__()[0]['array'].shape, (4, 3, 2))
+
+    def test_reserve(self):
+        # the sites arriving piecemeal do not reallocate the buffer
+        dmap = DenseProbabilityMap(3, 1)
+        dmap.reserve(range(10))
+        buf = dmap._buf
+        self.assertFalse(dmap)
+        for sids in ([7, 2], [2, 9], [0]):
+            dmap |= ProbabilityMap.build(3, 1, sids=sids, initvalue=.5)
+        self.assertIs(dmap._buf, buf)
+        numpy.testing.assert_equal(dmap.sids, [0, 2, 7, 9])
+        numpy.testing.assert_almost_equal(dmap[2].array[:, 0], [.75] * 3)
+        self.assertNotIn(5, dmap)
+        self.assertEqual(dmap.__toh5__()[0]['array'].shape, (4, 3, 1))
+
+        # the unreserved sites are added by doubling the buffer
+        dmap |= ProbabilityMap.build(3, 1, sids=[12], initvalue=.5)
+        self.assertEqual(len(dmap._buf), 20)
+        buf = dmap._buf
+        dmap |= ProbabilityMap.build(3, 1, sids=[11], initvalue=.5)
+        self.assertIs(dmap._buf, buf)  # the spare rows are used
+        numpy.testing.assert_equal(dmap.sids, [0, 2, 7, 9, 11, 12])
+        # the array is a view ordered by site ID
+        self.assertEqual(dmap.array.shape, (6, 3, 1))
+        dmap.array[-1] = .1
+        numpy.testing.assert_almost_equal(dmap[12].array[:, 0], [.1] * 3)
+
+    def test_convert(self):
+        imtls = DictArray({'PGA': [.1, .2], 'SA(1.0)': [.1]})
+        pmap = ProbabilityMap.build(3, 1, sids=[0, 3], initvalue=.2)
+        dmap = DenseProbabilityMap.from_pmap(pmap)
+        numpy.testing.assert_equal(pmap.convert(imtls, 4),
+                                   dmap.convert(imtls, 4))
@@ -96,6 +96,16 @@ def to_toml(uncertainty):
     return text
 
 
+def _fix_paths(kwargs, basedir):
+    # make the paths relative to basedir, also in the parameters of
+    # nested GSIMs, i.e. gmpe.NGAEastGMPE.gmpe_table = "..."
+    for k, v in kwargs.items():
+        if isinstance(v, dict):
+            _fix_paths(v, basedir)
+        elif k.endswith(('_file', '_table')):
+            kwargs[k] = os.path.normpath(os.path.join(basedir, v))
+
+
 # more tests are in tests/valid_test.py
 def gsim(value, basedir=''):
     """
@@ -106,9 +116,7 @@ def gsim(value, basedir=''):
     """
     value = to_toml(value)  # convert to TOML
     [(gsim_name, kwargs)] = toml.loads(value).items()
-    for k, v in kwargs.items():
-        if k.endswith(('_file', '_table')):
-            kwargs[k] = os.path.normpath(os.path.join(basedir, v))
+    _fix_paths(kwargs, basedir)
     minimum_distance = float(kwargs.pop('minimum_distance', 0))
     if gsim_name == 'FromFile':
         return FromFile()
@@ -202,6 +202,7 @@ U32 = numpy.uint32
 F32 = numpy.float32
 U64 = numpy.uint64
 TWO32 = 2 ** 32
+CHUNKSIZE = 100000  # rows read at once from the exposure CSV files
 by_taxonomy = operator.attrgetter('taxonomy')
 
 
@@ -908,10 +909,11 @@ class Exposure(object):
             conv[field] = float
             rename[field] = 'occupants_' + field
         for fname in self.datafiles:
-            array = hdf5.read_csv(fname, conv, rename).array
-            array['lon'] = numpy.round(array['lon'], 5)
-            array['lat'] = numpy.round(array['lat'], 5)
-            yield from array
+            for aw in hdf5.read_csv(fname, conv, rename, chunksize=CHUNKSIZE):
+                array = aw.array
+                array['lon'] = numpy.round(array['lon'], 5)
+                array['lat'] = numpy.round(array['lat'], 5)
+                yield from array
 
     def _populate_from(self, asset_array, param, check_dupl):
         asset_refs = set()
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import shutil
 import psutil
 import getpass
 import operator
@@ -367,6 +368,8 @@ def del_calc(db, job_id, user, force=False):
         os.remove(fname)
     except OSError as exc:  # permission error
         return {"error": 'Could not remove %s: %s' % (fname, exc)}
+    # the GMF files written by the tasks, if gmf_task_files was set
+    shutil.rmtree(path + '_gmfs', ignore_errors=True)
     return {"success": fname}
 
 
@@ -391,6 +394,25 @@ def log(db, job_id, timestamp, level, process, message):
        'VALUES (?X)', (job_id, timestamp, level, process, message))
 
 
+def log_many(db, records):
+    """
+    Write several log records in the database in a single transaction.
+
+    :param db:
+        a :class:`openquake.server.dbapi.Db` instance
+    :param records:
+        a list of tuples (job_id, timestamp, level, process, message)
+    """
+    db('BEGIN')
+    try:
+        db.insert('log', ['job_id', 'timestamp', 'level', 'process',
+                          'message'], records)
+    except Exception:
+        db('ROLLBACK')
+        raise
+    db('COMMIT')
+
+
 def get_log(db, job_id):
     """
     Extract the logs as a big string
@@ -593,6 +615,32 @@ def get_log_slice(db, job_id, start, stop):
              log.process, log.message] for log in logs]
 
 
+def get_log_since(db, job_id, last_id, limit=0):
+    """
+    Get the log records of a calculation following the given record,
+    as a JSON list of rows [id, timestamp, level, process, message].
+    The query uses the index on (job_id, id) and it is fast even for
+    large log tables.
+
+    :param db:
+        a :class:`openquake.server.dbapi.Db` instance
+    :param job_id:
+        a job ID
+    :param last_id:
+        the ID of the last record already read (0 to start from the first)
+    :param limit:
+        the maximum number of records to return (0 means no limit)
+    """
+    if limit:
+        logs = db('SELECT * FROM log WHERE job_id=?x AND id>?x '
+                  'ORDER BY id LIMIT ?s', job_id, int(last_id), int(limit))
+    else:
+        logs = db('SELECT * FROM log WHERE job_id=?x AND id>?x '
+                  'ORDER BY id', job_id, int(last_id))
+    return [[log.id, log.timestamp.isoformat()[:22], log.level,
+             log.process, log.message] for log in logs]
+
+
 def get_log_size(db, job_id):
     """
     Get a slice of the calculation log as a JSON list of rows.
@@ -0,0 +1,3 @@
+DROP INDEX log_job_id;
+
+CREATE INDEX log_job_id_id on log (job_id, id);
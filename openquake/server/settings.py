@@ -166,6 +166,10 @@ LOGGING = {
 
 FILE_UPLOAD_MAX_MEMORY_SIZE = 1
 
+# Maximum size in bytes of the in-memory cache of the results of the
+# extract API; set it to 0 to disable the cache
+EXTRACT_CACHE_SIZE = 256 * 1024 ** 2
+
 # A server name can be specified to customize the WebUI in case of
 # multiple installations of the Engine are available. This helps avoiding
 # confusion between different installations when the WebUI is used
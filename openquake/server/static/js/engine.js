@@ -118,6 +118,8 @@
             logIsNew: false,
             logLinesAll: 0,
             logLines: 0,
+            logLastId: 0,
+            logPageSize: 1000,
             logTimeout: null,
 
             initialize: function (options) {
@@ -287,7 +289,14 @@
                 }
                 var obj = this;
 
-                this.logXhr = $.ajax({url: gem_oq_server_url + "/v1/calc/" + calc_id + "/log/" + from + ":",
+                // the records following the record "from" are returned, one page
+                // at the time; if the calculation is running the server waits for
+                // them (long polling)
+                var query = "?limit=" + this.logPageSize;
+                if (is_running && !is_new) {
+                    query += "&timeout=20";
+                }
+                this.logXhr = $.ajax({url: gem_oq_server_url + "/v1/calc/" + calc_id + "/log/since/" + from + query,
                                       error: function (jqXHR, textStatus, errorThrown) {
                                           if (jqXHR.status == 404) {
                                               diaerror.show(true, "Log of calculation " + calc_id + " not found.");
@@ -299,10 +308,13 @@
                                       },
                                       success: function (data, textStatus, jqXHR) {
                                           var delay = 250;
+                                          // a full page means that there are more records
+                                          var more = (data.length == obj.logPageSize);
 
                                           if (is_new) {
                                               obj.logLines = 0;
                                               obj.logLinesAll = 0;
+                                              obj.logLastId = 0;
                                           }
                                           else {
                                               // if data is empty check if job is still running
@@ -327,7 +339,9 @@
                                                   obj.logLinesAll++;
                                                   continue;
                                               }
-                                              out += '<p ' + (obj.logLines % 2 == 1 ? 'style="background-color: #ffffff;"' : '') + '>' + htmlEscape(data[s]) + '</p>';
+                                              // the first field is the ID of the record
+                                              obj.logLastId = data[s][0];
+                                              out += '<p ' + (obj.logLines % 2 == 1 ? 'style="background-color: #ffffff;"' : '') + '>' + htmlEscape(data[s].slice(1)) + '</p>';
                                               obj.logLines++;
                                               obj.logLinesAll++;
                                           }
@@ -355,13 +369,13 @@
                                               diaerror.scroll_to_bottom($('.modal-body', diaerror.getdiv()));
                                           }
 
-                                          if (is_running) {
+                                          if (is_running || more) {
                                               function log_update(obj)
                                               {
-                                                  obj._show_log_priv(false, obj.logId, true, obj.logLinesAll);
+                                                  obj._show_log_priv(false, obj.logId, is_running, obj.logLastId);
                                               }
 
-                                              obj.logTimeout = window.setTimeout(log_update, delay, obj);
+                                              obj.logTimeout = window.setTimeout(log_update, more ? 0 : delay, obj);
                                           }
                                           else {
                                               $('#diaerror_scroll_enabled_box').hide();
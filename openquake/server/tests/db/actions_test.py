@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2020 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from openquake.server import dbapi
+from openquake.server.db import actions
+
+
+class LogManyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = dbapi.Db(sqlite3.connect, ':memory:', isolation_level=None,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+        actions.upgrade_db(self.db)
+        self.job_id = actions.create_job(self.db, tempfile.mkdtemp())
+
+    def messages(self):
+        return [row.message for row in self.db(
+            'SELECT message FROM log WHERE job_id=?x ORDER BY id',
+            self.job_id)]
+
+    def record(self, message):
+        return (self.job_id, datetime.utcnow(), 'INFO', 'proc', message)
+
+    def test_commit(self):
+        actions.log_many(self.db, [self.record('a'), self.record('b')])
+        self.assertEqual(self.messages(), ['a', 'b'])
+
+    def test_rollback(self):
+        # the second record is invalid, so the whole batch is discarded
+        with self.assertRaises(sqlite3.IntegrityError):
+            actions.log_many(self.db, [self.record('a'), self.record(None)])
+        self.assertEqual(self.messages(), [])
+        # the connection is not left inside a transaction
+        actions.log_many(self.db, [self.record('c')])
+        self.assertEqual(self.messages(), ['c'])
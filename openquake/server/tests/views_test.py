@@ -136,6 +136,21 @@ class EngineServerTestCase(unittest.TestCase):
         self.wait()
         log = self.get('%s/log/:' % job_id)
         self.assertGreater(len(log), 0)
+        rows = self.get('%s/log/since/0' % job_id)
+        self.assertEqual(len(rows), len(log))
+        # the job is complete, so there is no waiting for new records
+        rows = self.get('%s/log/since/%d' % (job_id, rows[-1][0]), timeout=10)
+        self.assertEqual(rows, [])
+        # reading the log in pages of 2 records
+        pages = [self.get('%s/log/since/0' % job_id, limit=2)]
+        while len(pages[-1]) == 2:
+            pages.append(self.get('%s/log/since/%d' % (
+                job_id, pages[-1][-1][0]), limit=2))
+        self.assertEqual(sum(pages, []), self.get('%s/log/since/0' % job_id))
+        for timeout in ('nan', 'inf', '-1', 'x'):
+            resp = self.c.get('/v1/calc/%s/log/since/0' % job_id,
+                              dict(timeout=timeout))
+            self.assertEqual(resp.status_code, 400)
         results = self.get('%s/results' % job_id)
         self.assertGreater(len(results), 0)
         for res in results:
@@ -187,6 +202,13 @@ class EngineServerTestCase(unittest.TestCase):
         self.assertEqual(len(got['array']), 6)  # expected 6 aggregates
         self.assertEqual(resp.status_code, 200)
 
+        # check slice
+        resp = self.c.get(
+            extract_url + 'slice?dset=assetcol/array&start=5&stop=15')
+        got = loadnpz(resp.streaming_content)
+        self.assertEqual(len(got['array']), 10)
+        self.assertGreater(got['nrows'], 10)
+
         # there is some logic in `core.export_from_db` that it is only
         # exercised when the export fails
         datadir, dskeys = actions.get_results(db, job_id)
@@ -271,6 +293,20 @@ class EngineServerTestCase(unittest.TestCase):
         resp = self.c.get('/v1/calc/%s/datastore' % job_id)
         self.assertEqual(resp.status_code, 200)
 
+        # download only the first 10 bytes
+        resp = self.c.get('/v1/calc/%s/datastore' % job_id,
+                          HTTP_RANGE='bytes=0-9')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(len(b''.join(resp.streaming_content)), 10)
+
+        # the range is honoured only if the datastore has not changed
+        resp = self.c.get('/v1/calc/%s/datastore' % job_id,
+                          HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=resp['ETag'])
+        self.assertEqual(resp.status_code, 206)
+        resp = self.c.get('/v1/calc/%s/datastore' % job_id,
+                          HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"changed"')
+        self.assertEqual(resp.status_code, 200)
+
         tb = self.get('%s/traceback' % job_id)
         if not tb:
             sys.stderr.write('Empty traceback, please check!\n')
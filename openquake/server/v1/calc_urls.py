@@ -33,6 +33,7 @@ urlpatterns = [
     url(r'^(\d+)/traceback$', views.calc_traceback),
     url(r'^(\d+)/log/size$', views.calc_log_size),
     url(r'^(\d+)/log/(\d*):(\d*)$', views.calc_log),
+    url(r'^(\d+)/log/since/(\d+)$', views.calc_log_since),
     url(r'^(\d+)/remove$', views.calc_remove),
     url(r'^result/(\d+)$', views.calc_result),
     url(r'^run$', views.calc_run),
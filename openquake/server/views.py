@@ -18,6 +18,7 @@
 
 import shutil
 import json
+import time
 import logging
 import os
 import sys
@@ -27,6 +28,8 @@ import threading
 import traceback
 import signal
 import zlib
+import zipfile
+import itertools
 import pickle
 import urllib.parse as urlparse
 import re
@@ -36,13 +39,13 @@ from urllib.parse import unquote_plus
 from xml.parsers.expat import ExpatError
 from django.http import (
     HttpResponse, HttpResponseNotFound, HttpResponseBadRequest,
-    HttpResponseForbidden)
+    HttpResponseForbidden, StreamingHttpResponse)
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import render
 
 from openquake.baselib import datastore
-from openquake.baselib.general import groupby, gettemp, zipfiles
+from openquake.baselib.general import groupby, gettemp, zipfiles, LRUCache
 from openquake.baselib.parallel import safely_call
 from openquake.hazardlib import nrml, gsim, valid
 
@@ -58,8 +61,6 @@ from openquake.engine.export.core import DataStoreExportError
 from openquake.server import utils, dbapi
 
 from django.conf import settings
-from django.http import FileResponse
-from wsgiref.util import FileWrapper
 
 if settings.LOCKDOWN:
     from django.contrib.auth import authenticate, login, logout
@@ -84,6 +85,14 @@ DEFAULT_CONTENT_TYPE = 'text/plain'
 
 LOGGER = logging.getLogger('openquake.server')
 
+# .npz outputs of the extract API for completed calculations
+EXTRACT_CACHE = LRUCache(settings.EXTRACT_CACHE_SIZE)
+
+CHUNKSIZE = 4 * 1024 ** 2  # size of the blocks of the downloaded files
+RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+LOG_POLL_INTERVAL = .5  # seconds between the queries of calc_log_since
+LOG_MAX_TIMEOUT = 30  # maximum waiting time of calc_log_since
+
 ACCESS_HEADERS = {'Access-Control-Allow-Origin': '*',
                   'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                   'Access-Control-Max-Age': 1000,
@@ -438,6 +447,7 @@ def calc_remove(request, calc_id):
         return HttpResponseNotFound()
 
     if 'success' in message:
+        EXTRACT_CACHE.discard(lambda key: key[0] == int(calc_id))
         return HttpResponse(content=json.dumps(message),
                             content_type=JSON, status=200)
     elif 'error' in message:
@@ -472,6 +482,43 @@ def calc_log(request, calc_id, start, stop):
     return HttpResponse(content=json.dumps(response_data), content_type=JSON)
 
 
+@require_http_methods(['GET'])
+@cross_domain_ajax
+def calc_log_since(request, calc_id, last_id):
+    """
+    Get the log records of the calculation following the record `last_id`,
+    as a JSON list of rows [id, timestamp, level, process, message].
+    If the query string contains a `limit` parameter, at most `limit`
+    records are returned. If the calculation is running and the query
+    string contains a `timeout` parameter (in seconds, capped to
+    LOG_MAX_TIMEOUT), wait until new records arrive, the calculation ends
+    or the timeout expires (long polling).
+    """
+    try:
+        timeout = float(request.GET.get('timeout', 0))
+        limit = int(request.GET.get('limit', 0))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid timeout or limit')
+    if not (0 <= timeout < numpy.inf):  # false also for nan
+        return HttpResponseBadRequest('Invalid timeout %s' % timeout)
+    elif limit < 0:
+        return HttpResponseBadRequest('Invalid limit %d' % limit)
+    timeout = min(timeout, LOG_MAX_TIMEOUT)
+    job = logs.dbcmd('get_job', int(calc_id))
+    if job is None:
+        return HttpResponseNotFound()
+    t0 = time.time()
+    while True:
+        rows = logs.dbcmd('get_log_since', job.id, last_id, limit)
+        if rows or not job.is_running or time.time() - t0 >= timeout:
+            break
+        time.sleep(LOG_POLL_INTERVAL)
+        # the job may end while waiting: then its last records are read
+        # by the next query and there is no point in waiting further
+        job = logs.dbcmd('get_job', job.id)
+    return HttpResponse(content=json.dumps(rows), content_type=JSON)
+
+
 @require_http_methods(['GET'])
 @cross_domain_ajax
 def calc_log_size(request, calc_id):
@@ -701,16 +748,164 @@ def calc_result(request, result_id):
         export_type, DEFAULT_CONTENT_TYPE)
 
     fname = 'output-%s-%s' % (result_id, os.path.basename(exported))
-    stream = FileWrapper(open(exported, 'rb'))  # 'b' is needed on Windows
-    stream.close = lambda: (
-        FileWrapper.close(stream), shutil.rmtree(tmpdir))
-    response = FileResponse(stream, content_type=content_type)
-    response['Content-Disposition'] = (
-        'attachment; filename=%s' % os.path.basename(fname))
-    response['Content-Length'] = str(os.path.getsize(exported))
+    return file_response(request, exported, content_type,
+                         os.path.basename(fname),
+                         lambda: shutil.rmtree(tmpdir))
+
+
+class _Pipe(object):
+    # a write-only file-like object collecting the bytes written by zipfile
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_npz(items):
+    """
+    :param items: pairs (name, value) with values convertible to arrays
+    :yields: the bytes of an .npz file, one compressed array at the time
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, value in items:
+            with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                numpy.lib.format.write_array(f, numpy.asanyarray(value))
+            yield pipe.pop()
+    yield pipe.pop()  # the central directory
+
+
+def _npz_items(items):
+    # convert the values extracted into arrays readable by oq extract
+    for key, val in items:
+        if key.startswith('_'):
+            continue
+        elif isinstance(val, str):
+            # without this oq extract would fail
+            yield key, numpy.array(val.encode('utf-8'))
+        elif isinstance(val, dict):
+            # this is hack: we are losing the values
+            yield key, list(val)
+        else:
+            yield key, utils.array_of_strings_to_bytes(val, key)
+
+
+def _stream_extract(fname, what, cache):
+    # yield the bytes of the .npz file and populate the cache, if any;
+    # the datastore is kept open until the last array has been sent
+    chunks = []
+    nbytes = 0
+    with datastore.read(fname) as ds:
+        for data in stream_npz(_npz_items(_extract.iter(ds, what))):
+            if cache and nbytes <= cache[0].maxbytes:
+                chunks.append(data)
+                nbytes += len(data)
+            yield data
+    if cache and nbytes <= cache[0].maxbytes:
+        cache[0][cache[1]] = b''.join(chunks)
+
+
+def _abort_on_error(chunks, what):
+    # the errors after the first chunk cannot be returned to the client,
+    # since the response has already started: log them and abort the
+    # stream, so that the client gets a truncated download
+    try:
+        yield from chunks
+    except Exception:
+        LOGGER.exception('Error while streaming extract/%s', what)
+        raise
+
+
+def _read_range(fname, start, stop, cleanup=None):
+    # yield the bytes of the file in the range [start, stop)
+    try:
+        with open(fname, 'rb') as f:
+            f.seek(start)
+            while start < stop:
+                data = f.read(min(CHUNKSIZE, stop - start))
+                if not data:
+                    break
+                start += len(data)
+                yield data
+    finally:
+        if cleanup:
+            cleanup()
+
+
+def file_response(request, fname, content_type, filename, cleanup=None):
+    """
+    :param request: a `django.http.HttpRequest` object
+    :param fname: path to the file to send
+    :param content_type: the content type of the file
+    :param filename: the name of the attachment
+    :param cleanup: function to call after sending the file, if any
+    :returns:
+        a response with the whole file or, if the request contains an
+        header `Range: bytes=start-stop`, a 206 response with the
+        requested byte range, so that big downloads can be resumed;
+        if the request contains also an header `If-Range` not matching
+        the ETag of the file, i.e. the file has changed, the whole file
+        is sent
+    """
+    stat = os.stat(fname)
+    size = stat.st_size
+    etag = '"%x-%x"' % (stat.st_mtime_ns, size)
+    mo = RANGE.match(request.META.get('HTTP_RANGE', ''))
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if mo is None or if_range and if_range != etag:
+        # whole file, multiple ranges are not supported
+        start, stop, status = 0, size, 200
+    else:
+        first, last = mo.groups()
+        if first:
+            start = int(first)
+            stop = min(int(last) + 1, size) if last else size
+        else:  # suffix range, i.e. the last bytes
+            start, stop = max(size - int(last or 0), 0), size
+        if start >= stop:
+            if cleanup:
+                cleanup()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            response['ETag'] = etag
+            return response
+        status = 206
+    response = StreamingHttpResponse(
+        _read_range(fname, start, stop, cleanup), content_type=content_type,
+        status=status)
+    if status == 206:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (
+            start, stop - 1, size)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    response['Content-Length'] = str(stop - start)
     return response
 
 
+def normalize_query(query_string):
+    """
+    :returns: the query string with the parameters sorted by name
+
+    >>> normalize_query('?kind=mean&imt=PGA&kind=max')
+    'imt=PGA&kind=mean&kind=max'
+    """
+    # the order of repeated parameters is significant and it is kept
+    pairs = urlparse.parse_qsl(query_string.lstrip('?'),
+                               keep_blank_values=True)
+    return urlparse.urlencode(sorted(pairs, key=lambda pair: pair[0]))
+
+
 @cross_domain_ajax
 @require_http_methods(['GET', 'HEAD'])
 def extract(request, calc_id, what):
@@ -724,41 +919,44 @@ def extract(request, calc_id, what):
     if not utils.user_has_permission(request, job.user_name):
         return HttpResponseForbidden()
 
+    fname = job.ds_calc_dir + '.hdf5'
+    n = len(request.path_info)
+    query_string = unquote_plus(request.get_full_path()[n:])
     try:
-        # read the data and save them on a temporary .npz file
-        with datastore.read(job.ds_calc_dir + '.hdf5') as ds:
-            fd, fname = tempfile.mkstemp(
-                prefix=what.replace('/', '-'), suffix='.npz')
-            os.close(fd)
-            n = len(request.path_info)
-            query_string = unquote_plus(request.get_full_path()[n:])
-            aw = _extract(ds, what + query_string)
-            a = {}
-            for key, val in vars(aw).items():
-                if key.startswith('_'):
-                    continue
-                elif isinstance(val, str):
-                    # without this oq extract would fail
-                    a[key] = numpy.array(val.encode('utf-8'))
-                elif isinstance(val, dict):
-                    # this is hack: we are losing the values
-                    a[key] = list(val)
-                else:
-                    a[key] = utils.array_of_strings_to_bytes(val, key)
-            numpy.savez_compressed(fname, **a)
-    except Exception as exc:
-        tb = ''.join(traceback.format_tb(exc.__traceback__))
-        return HttpResponse(
-            content='%s: %s\n%s' % (exc.__class__.__name__, exc, tb),
-            content_type='text/plain', status=500)
-
-    # stream the data back
-    stream = FileWrapper(open(fname, 'rb'))
-    stream.close = lambda: (FileWrapper.close(stream), os.remove(fname))
-    response = FileResponse(stream, content_type='application/octet-stream')
+        stat = os.stat(fname)
+    except FileNotFoundError:
+        return HttpResponseNotFound()
+    # the modification time of the file is part of the key, so that
+    # a recomputed calculation never returns stale data
+    key = (job.id, stat.st_mtime, stat.st_size, what.strip('/'),
+           normalize_query(query_string))
+    data = EXTRACT_CACHE.get(key)
+    if data is not None:
+        chunks = [data]
+    else:
+        # the .npz file is streamed one array at the time; it is
+        # also kept in the cache if the calculation is complete
+        # and the file is small enough
+        if job.status == 'complete':
+            cache = (EXTRACT_CACHE, key)
+        else:
+            cache = None
+        chunks = _stream_extract(fname, what + query_string, cache)
+        try:
+            # read the first array, to catch the errors in the query
+            chunks = itertools.chain(
+                [next(chunks)], _abort_on_error(chunks, what + query_string))
+        except Exception as exc:
+            tb = ''.join(traceback.format_tb(exc.__traceback__))
+            return HttpResponse(
+                content='%s: %s\n%s' % (exc.__class__.__name__, exc, tb),
+                content_type='text/plain', status=500)
+    response = StreamingHttpResponse(
+        chunks, content_type='application/octet-stream')
     response['Content-Disposition'] = (
-        'attachment; filename=%s' % os.path.basename(fname))
-    response['Content-Length'] = str(os.path.getsize(fname))
+        'attachment; filename=%s.npz' % what.strip('/').replace('/', '-'))
+    if data is not None:
+        response['Content-Length'] = str(len(data))
     return response
 
 
@@ -783,12 +981,7 @@ def calc_datastore(request, job_id):
         return HttpResponseForbidden()
 
     fname = job.ds_calc_dir + '.hdf5'
-    response = FileResponse(
-        FileWrapper(open(fname, 'rb')), content_type=HDF5)
-    response['Content-Disposition'] = (
-        'attachment; filename=%s' % os.path.basename(fname))
-    response['Content-Length'] = str(os.path.getsize(fname))
-    return response
+    return file_response(request, fname, HDF5, os.path.basename(fname))
 
 
 @cross_domain_ajax